@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/3.2/ref/settings/
 
 from pathlib import Path
 import os
+import tempfile
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -41,17 +42,21 @@ INSTALLED_APPS = [
     'rest_framework',  # 添加 DRF
     'corsheaders',  # 添加 CORS
     'drf_yasg',  # 添加 Swagger
+    'django_filters',  # 列表接口过滤
     'myapp',  # 添加我们的应用
     'rest_framework.authtoken',  # 添加这行
 ]
 
 MIDDLEWARE = [
-    'corsheaders.middleware.CorsMiddleware',  # CORS中间件必须放在最前面
+    'myapp.metrics.RequestMetricsMiddleware',  # 放在最前面，耗时包含其余中间件
+    'myapp.profiling.ProfilingMiddleware',
+    'corsheaders.middleware.CorsMiddleware',  # CORS中间件必须放在其余中间件之前
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'myapp.middleware.SlidingSessionMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -86,6 +91,8 @@ DATABASES = {
         'NAME': BASE_DIR / 'db.sqlite3',
     }
 }
+# 每个新建的 SQLite 连接上执行的 PRAGMA（见 myapp.signals.configure_sqlite），生产配置中开启 WAL
+SQLITE_PRAGMAS = {}
 
 
 # Password validation
@@ -106,6 +113,16 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# 密码哈希：第一项用于新密码，其余用于校验旧密码；算法或成本与第一项不同的密码在登录成功时自动重新哈希
+PASSWORD_HASHERS = [
+    'myapp.hashers.ConfigurablePBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'myapp.hashers.ConfigurableBCryptSHA256PasswordHasher',
+]
+PASSWORD_PBKDF2_ITERATIONS = 260000
+PASSWORD_BCRYPT_ROUNDS = 12
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/3.2/topics/i18n/
@@ -159,7 +176,7 @@ CORS_EXPOSE_HEADERS = ['content-type', 'x-csrftoken']
 # REST Framework设置
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'myapp.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
@@ -217,11 +234,15 @@ LOGGING = {
 }
 
 # Session设置
-SESSION_ENGINE = 'django.contrib.sessions.backends.db'
+# 会话保存在签名 Cookie 中，读写都不访问数据库；会话内容对客户端可见（不可篡改），只存放用户 ID 等少量数据。
+# 需要服务端注销时可改用 'django.contrib.sessions.backends.cache'，并把 SESSION_CACHE_ALIAS 指向 Redis 等共享缓存
+SESSION_ENGINE = 'django.contrib.sessions.backends.signed_cookies'
 SESSION_COOKIE_AGE = 60 * 60 * 24 * 7  # 7天
 SESSION_COOKIE_NAME = 'sessionid'
 SESSION_COOKIE_HTTPONLY = True
-SESSION_SAVE_EVERY_REQUEST = True
+# 不在每个请求都保存会话，由 SlidingSessionMiddleware 按间隔续期
+SESSION_SAVE_EVERY_REQUEST = False
+SESSION_REFRESH_INTERVAL = 60 * 60  # 1小时
 SESSION_COOKIE_SAMESITE = None  # 允许跨站请求
 SESSION_COOKIE_SECURE = False  # 开发环境设置为False
 
@@ -268,3 +289,105 @@ CSRF_TRUSTED_ORIGINS = [
 
 # 自定义用户模型
 AUTH_USER_MODEL = 'myapp.UserProfile'
+
+# 媒体文件加速投递：None 表示由 Django 直接发送，
+# 'x-accel-redirect' 交给 Nginx（需配置 internal location），'x-sendfile' 交给 Apache/lighttpd
+MEDIA_ACCEL_MODE = None
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+
+# 分块断点续传
+CHUNKED_UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+CHUNKED_UPLOAD_MIN_CHUNK_SIZE = 256 * 1024
+CHUNKED_UPLOAD_MAX_CHUNK_SIZE = 32 * 1024 * 1024
+CHUNKED_UPLOAD_MAX_SIZE = 10 * 1024 * 1024 * 1024
+# 会话在创建或收到最后一个分块后多久过期（秒），过期会话由 purge_upload_sessions 命令清理
+CHUNKED_UPLOAD_SESSION_TTL = 24 * 60 * 60
+
+# 上传文件按内容识别出的媒体类型限制大小（见 myapp.uploads），普通上传和分块上传都适用
+MEDIA_UPLOAD_MAX_SIZE = {
+    'IMAGE': 50 * 1024 * 1024,
+    'AUDIO': 500 * 1024 * 1024,
+    'VIDEO': 4 * 1024 * 1024 * 1024,
+    'DOCUMENT': 100 * 1024 * 1024,
+}
+
+# 衍生文件（缩略图/网页尺寸图/视频封面/音频波形）
+# 图片处理依赖 Pillow，音视频依赖 ffmpeg；由 `python manage.py derivative_worker` 后台生成
+DERIVATIVE_SIZES = {
+    'thumb': 256,
+    'web': 1280,
+    'poster': 1280,
+}
+DERIVATIVE_WAVEFORM_SIZE = (1280, 200)
+DERIVATIVE_POSTER_OFFSET = 1  # 秒
+DERIVATIVE_JOB_TIMEOUT = 10 * 60
+DERIVATIVE_RETRY_DELAY = 60  # 失败后首次重试的等待秒数，之后每次加倍
+FFMPEG_BINARY = 'ffmpeg'
+FFPROBE_BINARY = 'ffprobe'  # 读取音视频的时长和尺寸（见 myapp.mediainfo）
+
+# 缓存
+# 'api' 用于读接口的响应缓存（见 myapp.caching）。多进程部署时需换成共享后端，例如：
+#   文件：'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': '/var/tmp/course_design_cache'
+#   Redis：安装 django-redis 后 'BACKEND': 'django_redis.cache.RedisCache', 'LOCATION': 'redis://127.0.0.1:6379/1'
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'api': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'api-responses',
+        'TIMEOUT': 300,
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+}
+API_CACHE_ALIAS = 'api'
+
+# 批量接口
+BULK_CHUNK_SIZE = 500  # 每个事务写入的记录数
+BULK_MAX_ITEMS = 20000  # 单次请求的最大记录数
+
+# 导出
+EXPORT_CHUNK_SIZE = 2000
+
+# 地图聚合瓦片（见 myapp.clustering）
+CLUSTER_CACHE_MAX_ZOOM = 12  # 只保存不超过该级别的瓦片，更高级别每次直接计算
+CLUSTER_TILE_TTL = 10 * 60  # 秒，超过后重新计算，限制并发失效时旧结果的可见时间
+CLUSTER_INVALIDATE_MIN_ZOOM = 6  # Survey 变化时只删除该级别及以上的瓦片，更低级别按 TTL 刷新
+
+# Token 认证（见 myapp.authentication）
+TOKEN_EXPIRE_AFTER = 60 * 60 * 24 * 7  # 7天
+TOKEN_CACHE_SIZE = 10000  # 每个进程缓存的 token 数
+TOKEN_CACHE_TTL = 300  # 进程内缓存的有效期（秒）
+# 吊销标记所在的缓存，多进程部署时须为 memcached 等原子、不随机淘汰的共享后端，不能用文件缓存
+TOKEN_REVOCATION_CACHE_ALIAS = 'default'
+
+# 登录限流（见 myapp.ratelimit）：(次数, 窗口秒数)
+# 计数依赖原子 incr，多进程部署时与吊销标记一样须为 memcached 等共享后端
+RATELIMIT_CACHE_ALIAS = 'default'
+# 反向代理的地址：来自这些地址的请求按 X-Forwarded-For 确定客户端 IP
+TRUSTED_PROXY_IPS = []
+LOGIN_RATE_LIMITS = {
+    'username': (5, 60),
+    'ip': (20, 60),
+}
+
+# ASGI 部署（见 myapp.asgi、myapp.aio）
+ASGI_ROOT_URLCONF = 'course_design.urls_asgi'
+ASYNC_DB_WORKERS = 8  # 异步视图中同时执行 ORM 的线程数，也是每个进程的数据库连接上限
+ASYNC_FILE_WORKERS = 16  # 同时进行的媒体文件读取数
+
+# 请求指标（见 myapp.metrics），/metrics 输出 Prometheus 文本格式
+# 各进程把指标写入 METRICS_DIR，多进程部署时须为同一目录
+METRICS_DIR = os.path.join(tempfile.gettempdir(), 'course_design_metrics')
+METRICS_FLUSH_INTERVAL = 1.0  # 后台线程写入指标文件的间隔（秒）
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']  # 可访问 /metrics 的地址，另外管理员登录后也可访问
+METRICS_TOKEN = None  # 设置后 Authorization: Bearer <METRICS_TOKEN> 可访问 /metrics
+# 慢请求日志：处理时间超过该秒数的请求连同最慢的 SQL 写入 myapp.slow_requests，None 表示关闭
+SLOW_REQUEST_THRESHOLD = None
+SLOW_REQUEST_SQL_LIMIT = 10
+
+# 请求采样分析（见 myapp.profiling）：管理员用 X-Profile: 1 或 ?profile=1 开启，另可按比例随机抽样
+PROFILE_DIR = os.path.join(tempfile.gettempdir(), 'course_design_profiles')
+PROFILE_MAX_TRACES = 200  # 只保留最近的记录
+PROFILE_SAMPLE_RATE = 0.0  # 随机抽样的请求比例，0 表示只分析带标记的请求
+PROFILE_SAMPLE_INTERVAL = 0.005  # 秒
@@ -0,0 +1,179 @@
+"""
+生产环境配置
+
+在基础配置之上按环境变量覆盖，使用方式：
+    DJANGO_SETTINGS_MODULE=course_design.settings_production
+
+主要环境变量：
+    DJANGO_SECRET_KEY           必填
+    DJANGO_ALLOWED_HOSTS        逗号分隔
+    DJANGO_CORS_ALLOWED_ORIGINS 逗号分隔，同时作为 CSRF_TRUSTED_ORIGINS
+    DJANGO_DEBUG                默认关闭；开启时 Django 会为每个请求记录全部 SQL
+    DATABASE_ENGINE             sqlite（默认）或 postgresql
+    SQLITE_PATH / SQLITE_BUSY_TIMEOUT
+    POSTGRES_DB / POSTGRES_USER / POSTGRES_PASSWORD / POSTGRES_HOST / POSTGRES_PORT
+    DATABASE_CONN_MAX_AGE       持久连接的最长保持秒数，默认 60
+    DATABASE_POOLER             经 PgBouncer（事务池模式）连接时设为 pgbouncer
+    DJANGO_CACHE_LOCATION       memcached://host:port，默认 memcached://127.0.0.1:11211
+    DJANGO_API_CACHE_DIR        设置后响应缓存改用该目录下的文件缓存，登录限流和 token 吊销仍用 memcached
+    DJANGO_MEDIA_ACCEL_MODE     x-accel-redirect 或 x-sendfile
+    DJANGO_TRUSTED_PROXY_IPS    逗号分隔，反向代理的地址，默认 127.0.0.1,::1；登录限流按 X-Forwarded-For 区分客户端
+    DJANGO_LOG_LEVEL            默认 INFO
+    DJANGO_ASYNC_DB_WORKERS / DJANGO_ASYNC_FILE_WORKERS  ASGI 部署的线程池大小
+    DJANGO_METRICS_DIR          各工作进程写指标文件的目录，默认 BASE_DIR/metrics
+    DJANGO_METRICS_TOKEN        Prometheus 抓取 /metrics 时使用的 Bearer 令牌
+    DJANGO_METRICS_ALLOWED_IPS  逗号分隔，可直接访问 /metrics 的地址，默认为空；经反向代理时不要填代理地址
+    DJANGO_SLOW_REQUEST_THRESHOLD  慢请求日志的阈值（秒），不设置则关闭
+    DJANGO_PROFILE_DIR / DJANGO_PROFILE_SAMPLE_RATE  请求采样分析的记录目录（默认 BASE_DIR/profiles）和随机抽样比例
+"""
+import os
+
+from django.core.exceptions import ImproperlyConfigured
+
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR, LOGGING, REST_FRAMEWORK
+
+
+NON_ATOMIC_CACHE_BACKENDS = (
+    'django.core.cache.backends.filebased.FileBasedCache',
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def env(name, default=None):
+    return os.environ.get(name, default)
+
+
+def env_bool(name, default=False):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def env_list(name, default=()):
+    value = os.environ.get(name)
+    if not value:
+        return list(default)
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+SECRET_KEY = env('DJANGO_SECRET_KEY')
+if not SECRET_KEY:
+    raise ImproperlyConfigured('生产环境必须设置 DJANGO_SECRET_KEY')
+
+# DEBUG 开启时每条 SQL 都记录在 connection.queries 中，长驻进程内存持续增长
+DEBUG = env_bool('DJANGO_DEBUG')
+ALLOWED_HOSTS = env_list('DJANGO_ALLOWED_HOSTS', ['localhost'])
+
+CORS_ALLOW_ALL_ORIGINS = False
+CORS_ALLOWED_ORIGINS = env_list('DJANGO_CORS_ALLOWED_ORIGINS')
+CSRF_TRUSTED_ORIGINS = CORS_ALLOWED_ORIGINS
+
+SESSION_COOKIE_SECURE = env_bool('DJANGO_SECURE_COOKIES', True)
+CSRF_COOKIE_SECURE = SESSION_COOKIE_SECURE
+
+# 数据库
+DATABASE_ENGINE = env('DATABASE_ENGINE', 'sqlite')
+CONN_MAX_AGE = env_int('DATABASE_CONN_MAX_AGE', 60)
+
+if DATABASE_ENGINE == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': env('SQLITE_PATH', str(BASE_DIR / 'db.sqlite3')),
+            # 写锁被占用时等待的秒数，超时才报 database is locked
+            'OPTIONS': {'timeout': env_int('SQLITE_BUSY_TIMEOUT', 20)},
+            'CONN_MAX_AGE': CONN_MAX_AGE,
+        }
+    }
+    # 由 myapp.signals.configure_sqlite 在每个新连接上执行。
+    # WAL 模式下读不阻塞写、写不阻塞读；synchronous=NORMAL 在 WAL 下不会损坏数据库，只可能丢失最后的事务
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -env_int('SQLITE_CACHE_KB', 20000),
+        'temp_store': 'MEMORY',
+        'mmap_size': env_int('SQLITE_MMAP_SIZE', 256 * 1024 * 1024),
+        'wal_autocheckpoint': 1000,
+    }
+elif DATABASE_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': env('POSTGRES_DB', 'course_design'),
+            'USER': env('POSTGRES_USER', 'postgres'),
+            'PASSWORD': env('POSTGRES_PASSWORD', ''),
+            'HOST': env('POSTGRES_HOST', 'localhost'),
+            'PORT': env('POSTGRES_PORT', '5432'),
+            # 每个工作线程保持一条连接，跨请求复用，避免每个请求重新建立连接
+            'CONN_MAX_AGE': CONN_MAX_AGE,
+            'OPTIONS': {'connect_timeout': env_int('POSTGRES_CONNECT_TIMEOUT', 5)},
+        }
+    }
+    if env('DATABASE_POOLER') == 'pgbouncer':
+        # 连接池由 PgBouncer 提供。事务池模式下同一连接会被不同客户端复用，
+        # 不能使用跨事务的服务端游标（QuerySet.iterator() 默认会用）
+        DATABASES['default']['DISABLE_SERVER_SIDE_CURSORS'] = True
+else:
+    raise ImproperlyConfigured('DATABASE_ENGINE 只能是 sqlite 或 postgresql')
+
+# 缓存：响应缓存、token 吊销和登录限流都要求多个工作进程共享同一缓存。
+# 登录限流的计数和 token 吊销标记须用原子 add / incr 且不会随机淘汰条目的后端：
+# 文件缓存的 incr 是先读后写，并发时丢失计数；超过 MAX_ENTRIES 时随机删除三分之一的条目，吊销标记可能被删。
+CACHE_LOCATION = env('DJANGO_CACHE_LOCATION', 'memcached://127.0.0.1:11211')
+if not CACHE_LOCATION.startswith('memcached://'):
+    raise ImproperlyConfigured('DJANGO_CACHE_LOCATION 须为 memcached://host:port，登录限流和 token 吊销需要原子计数的共享缓存')
+CACHES = {
+    alias: {
+        'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+        'LOCATION': CACHE_LOCATION[len('memcached://'):],
+        'KEY_PREFIX': alias,
+    }
+    for alias in ('default', 'api')
+}
+if env('DJANGO_API_CACHE_DIR'):
+    # 响应缓存只按代数读写，不需要原子操作
+    CACHES['api'] = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': env('DJANGO_API_CACHE_DIR'),
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    }
+for _alias in (RATELIMIT_CACHE_ALIAS, TOKEN_REVOCATION_CACHE_ALIAS):  # noqa: F405
+    if CACHES[_alias]['BACKEND'] in NON_ATOMIC_CACHE_BACKENDS:
+        raise ImproperlyConfigured('缓存 %s 用于登录限流或 token 吊销，不能使用 %s' % (_alias, CACHES[_alias]['BACKEND']))
+CACHES['api']['TIMEOUT'] = 300
+
+MEDIA_ROOT = env('DJANGO_MEDIA_ROOT', MEDIA_ROOT)  # noqa: F405
+MEDIA_ACCEL_MODE = env('DJANGO_MEDIA_ACCEL_MODE') or None
+# 前端 nginx 须设置 proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for
+TRUSTED_PROXY_IPS = env_list('DJANGO_TRUSTED_PROXY_IPS', ['127.0.0.1', '::1'])
+
+# ASGI 部署：数据库池的每个线程保持一条持久连接，线程数不应超过数据库（或 PgBouncer）允许的连接数
+ASYNC_DB_WORKERS = env_int('DJANGO_ASYNC_DB_WORKERS', ASYNC_DB_WORKERS)  # noqa: F405
+ASYNC_FILE_WORKERS = env_int('DJANGO_ASYNC_FILE_WORKERS', ASYNC_FILE_WORKERS)  # noqa: F405
+
+# 请求指标：同一台机器上的所有工作进程共用一个目录，部署新版本时可清空
+METRICS_DIR = env('DJANGO_METRICS_DIR', str(BASE_DIR / 'metrics'))
+# 经 nginx 等反向代理时所有请求的 REMOTE_ADDR 都是 127.0.0.1，默认不按地址放行，抓取时带 METRICS_TOKEN
+METRICS_ALLOWED_IPS = env_list('DJANGO_METRICS_ALLOWED_IPS')
+METRICS_TOKEN = env('DJANGO_METRICS_TOKEN') or None
+SLOW_REQUEST_THRESHOLD = float(env('DJANGO_SLOW_REQUEST_THRESHOLD')) if env('DJANGO_SLOW_REQUEST_THRESHOLD') else None
+
+# 请求采样分析记录：各工作进程共用一个目录，/api/profiles/ 才能看到全部记录
+PROFILE_DIR = env('DJANGO_PROFILE_DIR', str(BASE_DIR / 'profiles'))
+PROFILE_SAMPLE_RATE = float(env('DJANGO_PROFILE_SAMPLE_RATE', '0'))
+
+# 只输出 JSON，不渲染可浏览 API 页面
+REST_FRAMEWORK = dict(REST_FRAMEWORK, DEFAULT_RENDERER_CLASSES=['rest_framework.renderers.JSONRenderer'])
+
+LOG_LEVEL = env('DJANGO_LOG_LEVEL', 'INFO')
+LOGGING = dict(LOGGING, loggers={
+    name: dict(config, level=LOG_LEVEL) for name, config in LOGGING['loggers'].items()
+})
@@ -0,0 +1,10 @@
+"""ASGI 部署的 URL 配置：异步视图优先匹配，其余与 course_design.urls 相同"""
+from django.urls import include, path
+
+from myapp.urls import async_urlpatterns
+
+from . import urls
+
+urlpatterns = [
+    path('api/', include(async_urlpatterns)),
+] + urls.urlpatterns
@@ -0,0 +1,152 @@
+"""异步视图使用的有界线程池
+
+Django 3.2 的 ORM 只能同步调用，而 ASGI 下 sync_to_async(thread_sensitive=True) 的调用
+全部排队在同一个线程上。这里用两个固定大小的线程池承接阻塞操作：
+
+- 数据库池（ASYNC_DB_WORKERS）：每个线程持有自己的数据库连接，线程数就是每个进程的连接上限，
+  相当于连接池；每次调用前后按 CONN_MAX_AGE 检查连接，与请求开始 / 结束时的处理一致。
+- 文件池（ASYNC_FILE_WORKERS）：媒体文件的 stat / read。慢磁盘或慢客户端只占用该池的线程，
+  不阻塞事件循环，也不占用数据库池。
+
+WSGI 下请求本身占有一个线程，run_db 直接回到该线程执行。
+"""
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections
+
+from . import profiling
+
+_executors = {}
+_lock = threading.Lock()
+
+
+def get_executor(name):
+    with _lock:
+        executor = _executors.get(name)
+        if executor is None:
+            workers = settings.ASYNC_DB_WORKERS if name == 'db' else settings.ASYNC_FILE_WORKERS
+            executor = _executors[name] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='aio-%s' % name)
+        return executor
+
+
+def _sampled(func, *args, **kwargs):
+    with profiling.sampled_thread():
+        return func(*args, **kwargs)
+
+
+async def run_in(name, func, *args, **kwargs):
+    # 带上调用方的 context，线程中的查询能计入当前请求的指标（见 myapp.metrics），
+    # 被分析的请求在线程中的执行也能被采样（见 myapp.profiling）
+    context = contextvars.copy_context()
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(name),
+                                      functools.partial(context.run, _sampled, func, *args, **kwargs))
+
+
+async def run_file_io(func, *args, **kwargs):
+    return await run_in('file', func, *args, **kwargs)
+
+
+def _with_connection(func, *args, **kwargs):
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run_db(request, func, *args, **kwargs):
+    """在数据库池中执行 func；WSGI 请求回到请求线程执行"""
+    if not isinstance(request, ASGIRequest):
+        return await sync_to_async(func, thread_sensitive=True)(*args, **kwargs)
+    return await run_in('db', _with_connection, func, *args, **kwargs)
+
+
+async def iterate(iterator):
+    """在文件池中逐块推进同步迭代器"""
+    sentinel = object()
+    while True:
+        chunk = await run_file_io(next, iterator, sentinel)
+        if chunk is sentinel:
+            return
+        yield chunk
+
+
+def _pump(iterator, close, deliver, slots, stopped):
+    try:
+        for chunk in iterator:
+            slots.acquire()
+            if stopped.is_set():
+                break
+            deliver(chunk)
+    except Exception as e:
+        deliver(_Failure(e))
+    else:
+        deliver(_DONE)
+    finally:
+        if close is not None:
+            close()
+
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+
+_DONE = object()
+
+
+async def iterate_db(request, iterator, close=None, buffer=4):
+    """在数据库池中推进可能访问数据库的同步迭代器（如查询 .iterator() 生成的流式响应）
+
+    整个迭代在同一个线程中进行，游标所在的连接不会中途被其他请求使用或关闭；
+    结束或中途停止时在该线程调用 close，释放游标后才关闭连接。
+    最多预先取出 buffer 块，客户端读得慢时数据库线程等待，断开时停止迭代。
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    slots = threading.Semaphore(buffer)
+    stopped = threading.Event()
+
+    def deliver(item):
+        loop.call_soon_threadsafe(queue.put_nowait, item)
+
+    producer = asyncio.ensure_future(run_db(request, _pump, iter(iterator), close, deliver, slots, stopped))
+    try:
+        while True:
+            item = await queue.get()
+            if item is _DONE:
+                break
+            if isinstance(item, _Failure):
+                raise item.error
+            slots.release()
+            yield item
+    finally:
+        stopped.set()
+        slots.release()
+        # 等迭代结束再返回，之后 response.close() 才能关闭生成器
+        await asyncio.gather(producer, return_exceptions=True)
+
+
+def async_view(view):
+    """把同步视图包装为异步视图，整个视图（认证、查询、渲染）在数据库池中执行"""
+    def render(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        if hasattr(response, 'render') and callable(response.render):
+            response = response.render()
+        return response
+
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        return await run_db(request, render, request, *args, **kwargs)
+
+    # csrf_exempt 装饰器会把视图变成同步函数，这里直接复制标记
+    wrapper.csrf_exempt = getattr(view, 'csrf_exempt', False)
+    return wrapper
@@ -0,0 +1,72 @@
+"""ASGI 部署使用的处理器
+
+在 Django 3.2 的 ASGIHandler 上做两处调整：
+- 请求使用 ASGI_ROOT_URLCONF，调查列表 / 详情和媒体文件交给异步视图（见 course_design.urls_asgi）；
+- 流式响应异步迭代发送。Django 3.2 在事件循环中同步迭代流式响应，读文件会阻塞所有连接，
+  访问数据库（如导出）则会抛出 SynchronousOnlyOperation。带有 async_streaming_content 的响应
+  （见 myapp.fileserve.RangeStreamingResponse）直接使用，其余的在数据库池中迭代（见 myapp.aio.iterate_db）。
+"""
+import functools
+
+import django
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers import asgi
+
+from . import aio
+
+
+class ASGIHandler(asgi.ASGIHandler):
+    def create_request(self, scope, body_file):
+        request, error_response = super().create_request(scope, body_file)
+        if request is not None and settings.ASGI_ROOT_URLCONF:
+            request.urlconf = settings.ASGI_ROOT_URLCONF
+        return request, error_response
+
+    async def get_response_async(self, request):
+        response = await super().get_response_async(request)
+        if response.streaming and getattr(response, 'async_streaming_content', None) is None:
+            response.async_streaming_content = aio.iterate_db(
+                request, response.streaming_content, close=functools.partial(close_content, response))
+        return response
+
+    async def send_response(self, response, send):
+        content = getattr(response, 'async_streaming_content', None)
+        if content is None:
+            return await super().send_response(response, send)
+
+        # 与 Django 的 send_response 相同，只是流式内容改为异步迭代
+        response_headers = []
+        for header, value in response.items():
+            if isinstance(header, str):
+                header = header.encode('ascii')
+            if isinstance(value, str):
+                value = value.encode('latin1')
+            response_headers.append((bytes(header), bytes(value)))
+        for c in response.cookies.values():
+            response_headers.append((b'Set-Cookie', c.output(header='').encode('ascii').strip()))
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': response_headers,
+        })
+        try:
+            async for part in content:
+                for chunk, _ in self.chunk_bytes(part):
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        finally:
+            # 客户端断开等异常时也要关闭文件
+            await content.aclose()
+        await send({'type': 'http.response.body'})
+        await sync_to_async(response.close, thread_sensitive=True)()
+
+
+def close_content(response):
+    """关闭流式响应的生成器；之后 response.close() 再次关闭不会有影响"""
+    for closer in response._resource_closers:
+        closer()
+
+
+def get_asgi_application():
+    django.setup(set_prefix=False)
+    return ASGIHandler()
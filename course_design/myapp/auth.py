@@ -1,8 +1,10 @@
-from django.contrib.auth import authenticate, login as auth_login
+from django.contrib.auth import authenticate, login as auth_login, logout as auth_logout
 from rest_framework import status, permissions
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
-from .serializers import UserSerializer, UserRegisterSerializer
+from .serializers import UserProfileSerializer
+from .middleware import mark_session_refreshed
+from . import ratelimit
 import logging
 import traceback
 from drf_yasg.utils import swagger_auto_schema
@@ -10,72 +12,6 @@ from drf_yasg import openapi
 
 logger = logging.getLogger(__name__)
 
-@swagger_auto_schema(
-    method='post',
-    request_body=openapi.Schema(
-        type=openapi.TYPE_OBJECT,
-        required=['username', 'display_name', 'password'],
-        properties={
-            'username': openapi.Schema(type=openapi.TYPE_STRING, description='用户ID (4-20位字母或数字)'),
-            'display_name': openapi.Schema(type=openapi.TYPE_STRING, description='显示名称'),
-            'password': openapi.Schema(type=openapi.TYPE_STRING, description='密码 (8-20位，必须包含字母和数字)'),
-        }
-    ),
-    responses={
-        201: openapi.Response(
-            description='注册成功',
-            schema=openapi.Schema(
-                type=openapi.TYPE_OBJECT,
-                properties={
-                    'message': openapi.Schema(type=openapi.TYPE_STRING),
-                    'user': openapi.Schema(type=openapi.TYPE_OBJECT),
-                }
-            )
-        ),
-        400: openapi.Response(description='请求数据无效'),
-        500: openapi.Response(description='服务器错误'),
-    }
-)
-@api_view(['POST'])
-@permission_classes([permissions.AllowAny])
-def register(request):
-    """
-    用户注册 API
-    
-    注册新用户，需要提供：
-    * username: 用户ID (4-20位字母或数字)
-    * display_name: 显示名称
-    * password: 密码 (8-20位，必须包含字母和数字)
-    """
-    try:
-        # 记录请求数据（去除密码信息）
-        safe_data = request.data.copy()
-        if 'password' in safe_data:
-            safe_data['password'] = '******'
-        logger.info(f"收到注册请求: {safe_data}")
-        
-        serializer = UserRegisterSerializer(data=request.data)
-        if serializer.is_valid():
-            user = serializer.save()
-            auth_login(request, user)
-            
-            response_data = {
-                'message': '注册成功',
-                'user': UserSerializer(user).data
-            }
-            logger.info(f"用户注册成功: {user.username}")
-            return Response(response_data, status=status.HTTP_201_CREATED)
-        else:
-            logger.warning(f"注册数据验证失败: {serializer.errors}")
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-            
-    except Exception as e:
-        logger.error(f"注册过程中发生错误: {str(e)}")
-        logger.error(f"错误详情: {traceback.format_exc()}")
-        return Response({
-            'error': '注册失败，请稍后重试'
-        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
 @swagger_auto_schema(
     method='post',
     request_body=openapi.Schema(
@@ -98,6 +34,7 @@ def register(request):
             )
         ),
         401: openapi.Response(description='认证失败'),
+        429: openapi.Response(description='登录尝试过于频繁'),
         500: openapi.Response(description='服务器错误'),
     }
 )
@@ -112,23 +49,32 @@ def login(request):
     try:
         username = request.data.get('username', '')
         password = request.data.get('password', '')
+        if not isinstance(username, str) or not isinstance(password, str):
+            return Response({
+                'error': '用户名和密码必须是字符串'
+            }, status=status.HTTP_400_BAD_REQUEST)
         
         logger.info(f"尝试登录用户: {username}")
-        
-        # 验证用户
+
+        # 在计算密码哈希之前限流
+        wait = ratelimit.check_login(request, username)
+        if wait is not None:
+            logger.warning(f"登录尝试过于频繁: {username}")
+            return ratelimit.throttled_response(wait)
+
+        # 验证用户，密码算法或成本与当前配置不同时会自动重新哈希
         user = authenticate(username=username, password=password)
         
         if user is not None:
-            # 登录用户，这会创建会话
+            ratelimit.reset_login(request, username)
+            # 登录用户，这会创建会话；有效期为 SESSION_COOKIE_AGE，之后由 SlidingSessionMiddleware 续期
             auth_login(request, user)
-            
-            # 设置会话过期时间（7天）
-            request.session.set_expiry(60 * 60 * 24 * 7)
+            mark_session_refreshed(request.session)
             
             # 准备响应数据
             response_data = {
                 'message': '登录成功',
-                'user': UserSerializer(user).data
+                'user': UserProfileSerializer(user).data
             }
             logger.info(f"用户登录成功: {username}, 响应数据: {response_data}")
             return Response(response_data)
@@ -150,7 +96,7 @@ def login(request):
     responses={
         200: openapi.Response(
             description='获取用户信息成功',
-            schema=UserSerializer
+            schema=UserProfileSerializer
         ),
         401: openapi.Response(description='未登录'),
     }
@@ -169,10 +115,7 @@ def user_info(request):
                 'error': '未登录'
             }, status=status.HTTP_401_UNAUTHORIZED)
         
-        # 更新会话过期时间
-        request.session.set_expiry(60 * 60 * 24 * 7)  # 7天
-        
-        serializer = UserSerializer(request.user)
+        serializer = UserProfileSerializer(request.user)
         return Response(serializer.data)
     except Exception as e:
         logger.error(f"获取用户信息错误: {str(e)}")
@@ -189,7 +132,7 @@ def logout(request):
     """
     try:
         # 清除会话
-        request.session.flush()
+        auth_logout(request)
         return Response({'message': '登出成功'})
     except Exception as e:
         logger.error(f"登出错误: {str(e)}")
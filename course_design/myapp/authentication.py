@@ -0,0 +1,117 @@
+"""带进程内缓存的 Token 认证
+
+DRF 的 TokenAuthentication 每个请求都要查询一次 token 与 user 的关联。这里在进程内保存
+token -> user 的 LRU 缓存（容量 TOKEN_CACHE_SIZE，有效期 TOKEN_CACHE_TTL 秒）。
+
+Token 被删除（登出、过期、停用用户）时由信号调用 revoke()：除了清除本进程的缓存，
+还在共享缓存 caches[TOKEN_REVOCATION_CACHE_ALIAS] 中写入吊销标记，其他进程命中本地缓存时
+先检查该标记，因此吊销对所有进程立即生效。标记只需保留 TOKEN_CACHE_TTL 秒，
+更早缓存的条目已经过期，会重新查询数据库。多进程部署时该缓存须为 Redis 等共享后端。
+
+Token 自创建起 TOKEN_EXPIRE_AFTER 秒后过期，过期的 token 在使用时删除，
+其余的由 purge_expired_tokens 命令定期清理。
+"""
+import copy
+import datetime
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+
+class TokenCache:
+    """线程安全的 LRU 缓存，条目超过 TTL 视为不存在"""
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            cached_at, value = entry
+            if time.monotonic() - cached_at > settings.TOKEN_CACHE_TTL:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > settings.TOKEN_CACHE_SIZE:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+token_cache = TokenCache()
+
+
+def revocation_key(key):
+    # 不把 token 原文写入共享缓存
+    return 'token-revoked:%s' % hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def revoke(key):
+    token_cache.discard(key)
+    caches[settings.TOKEN_REVOCATION_CACHE_ALIAS].set(revocation_key(key), True, settings.TOKEN_CACHE_TTL)
+
+
+def is_revoked(key):
+    return caches[settings.TOKEN_REVOCATION_CACHE_ALIAS].get(revocation_key(key)) is not None
+
+
+def expiry_cutoff():
+    """早于该时间创建的 token 已过期"""
+    return timezone.now() - datetime.timedelta(seconds=settings.TOKEN_EXPIRE_AFTER)
+
+
+def is_expired(token):
+    return token.created < expiry_cutoff()
+
+
+def issue_token(user):
+    """取得用户的有效 token，已过期的换发新的"""
+    token, created = Token.objects.get_or_create(user=user)
+    if not created and is_expired(token):
+        token.delete()
+        token = Token.objects.create(user=user)
+    return token
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    def authenticate_credentials(self, key):
+        cached = token_cache.get(key)
+        if cached is not None:
+            user, token = cached
+            if not is_revoked(key) and not is_expired(token):
+                # 视图可能修改 request.user，每个请求使用独立的副本
+                return copy.copy(user), token
+            token_cache.discard(key)
+
+        user, token = super().authenticate_credentials(key)
+        if is_expired(token):
+            token.delete()
+            raise exceptions.AuthenticationFailed('令牌已过期，请重新登录')
+        token_cache.set(key, (user, token))
+        return copy.copy(user), token
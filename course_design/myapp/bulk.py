@@ -0,0 +1,298 @@
+"""批量创建、更新、删除
+
+请求体为 JSON 数组或 NDJSON。所有记录先统一校验，合法的记录按 BULK_CHUNK_SIZE 分块，
+每块在一个事务内用 bulk_create / bulk_update 写入；不合法的记录逐条返回错误，不影响其他记录。
+bulk_create / bulk_update 不会调用 save() 和模型信号，网格、全文索引、地图聚合、
+响应缓存、统计汇总和衍生任务由这里显式维护。
+"""
+import os
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import serializers, status
+from rest_framework.decorators import action
+from rest_framework.parsers import JSONParser
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+
+from . import caching, clustering, derivatives, search, stats
+from .models import Survey, MediaItem, DerivativeJob
+from .parsers import NDJSONParser
+from .storage import blob_storage
+
+
+def bulk_id(value):
+    """请求中的主键，不是整数时返回 None（bool 也不算）"""
+    return value if isinstance(value, int) and not isinstance(value, bool) else None
+
+
+def chunked(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def assign_bulk_pks(model, objs):
+    """补上 bulk_create 未回填的主键
+
+    Django 3.2 在 SQLite 上不回填主键。此时仍处于写事务中，SQLite 单写锁保证
+    没有其他连接插入，表中最大的 len(objs) 个主键即为本批记录，按插入顺序递增。
+    """
+    if not objs or objs[0].pk is not None:
+        return
+    ids = list(model.objects.order_by('-pk').values_list('pk', flat=True)[:len(objs)])
+    for obj, pk in zip(objs, reversed(ids)):
+        obj.pk = pk
+
+
+class BulkMediaItemSerializer(serializers.ModelSerializer):
+    """批量导入的媒体资料引用已在存储中的文件，survey 的存在性在 bulk 中一次性校验"""
+    survey = serializers.IntegerField()
+    file_path = serializers.CharField(max_length=255)
+
+    class Meta:
+        model = MediaItem
+        fields = ['id', 'survey', 'title', 'description', 'media_type', 'category', 'file_path']
+        read_only_fields = ['id']
+
+    def validate_file_path(self, value):
+        value = value.lstrip('/')
+        if value.startswith(settings.MEDIA_URL.lstrip('/')):
+            value = value[len(settings.MEDIA_URL.lstrip('/')):]
+        full_path = os.path.normpath(os.path.join(settings.MEDIA_ROOT, value))
+        if not full_path.startswith(os.path.normpath(settings.MEDIA_ROOT) + os.sep) or not os.path.isfile(full_path):
+            raise serializers.ValidationError('文件不存在')
+        if full_path.startswith(os.path.normpath(blob_storage.path(blob_storage.blob_dir)) + os.sep):
+            # 去重存储（含上传暂存目录）中的文件由 MediaBlob 计数引用，直接引用会在释放后指向已删除的文件
+            raise serializers.ValidationError('不能引用去重存储中的文件')
+        return value
+
+    def validate(self, attrs):
+        if self.instance is not None and 'file_path' in attrs:
+            # 文件由去重存储管理引用计数，批量更新只允许修改元数据
+            raise serializers.ValidationError({'file_path': '批量更新不能修改文件'})
+        return attrs
+
+    def validate_survey(self, value):
+        if value not in self.context['survey_ids']:
+            raise serializers.ValidationError('调查 %s 不存在' % value)
+        return value
+
+
+class BulkMixin:
+    """为 ModelViewSet 增加 /bulk/ 接口：POST 创建、PATCH 更新、DELETE 删除"""
+    bulk_serializer_class = None
+
+    def get_bulk_serializer_class(self):
+        return self.bulk_serializer_class or self.get_serializer_class()
+
+    def get_bulk_context(self, items):
+        return self.get_serializer_context()
+
+    def build_bulk_instance(self, validated_data):
+        return self.queryset.model(**validated_data)
+
+    def after_bulk_write(self, objs, created):
+        """写入一块记录之后维护派生数据，在该块的事务内调用"""
+
+    @action(detail=False, methods=['post', 'patch', 'delete'], url_path='bulk',
+            parser_classes=[JSONParser, NDJSONParser], permission_classes=[IsAuthenticated])
+    def bulk(self, request):
+        items = request.data
+        if request.method == 'DELETE' and isinstance(items, dict):
+            items = items.get('ids')
+        if not isinstance(items, list):
+            return Response({'error': '请求体应为数组或 NDJSON'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > settings.BULK_MAX_ITEMS:
+            return Response({'error': '单次最多 %d 条' % settings.BULK_MAX_ITEMS},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        if request.method == 'POST':
+            results = self.perform_bulk_create(items)
+        elif request.method == 'PATCH':
+            results = self.perform_bulk_update(items)
+        else:
+            results = self.perform_bulk_delete(items)
+
+        failed = sum(1 for r in results if 'errors' in r)
+        code = status.HTTP_400_BAD_REQUEST if failed and failed == len(results) else status.HTTP_200_OK
+        return Response({'succeeded': len(results) - failed, 'failed': failed, 'results': results}, status=code)
+
+    def perform_bulk_create(self, items):
+        serializer_class = self.get_bulk_serializer_class()
+        context = self.get_bulk_context(items)
+        results = [None] * len(items)
+        valid = []
+        for index, item in enumerate(items):
+            serializer = serializer_class(data=item, context=context)
+            if serializer.is_valid():
+                valid.append((index, self.build_bulk_instance(serializer.validated_data)))
+            else:
+                results[index] = {'index': index, 'errors': serializer.errors}
+
+        model = self.queryset.model
+        for chunk in chunked(valid, settings.BULK_CHUNK_SIZE):
+            objs = [obj for _, obj in chunk]
+            with transaction.atomic():
+                model.objects.bulk_create(objs)
+                assign_bulk_pks(model, objs)
+                self.after_bulk_write(objs, created=True)
+            for index, obj in chunk:
+                results[index] = {'index': index, 'id': obj.pk}
+        return results
+
+    def perform_bulk_update(self, items):
+        serializer_class = self.get_bulk_serializer_class()
+        context = self.get_bulk_context(items)
+        model = self.queryset.model
+        ids = [bulk_id(item.get('id')) if isinstance(item, dict) else None for item in items]
+        existing = model.objects.in_bulk([pk for pk in ids if pk is not None])
+
+        results = [None] * len(items)
+        valid = []
+        for index, (item, pk) in enumerate(zip(items, ids)):
+            if pk is None:
+                results[index] = {'index': index, 'errors': {'id': ['id 必须是整数']}}
+                continue
+            instance = existing.get(pk)
+            if instance is None:
+                results[index] = {'index': index, 'errors': {'id': ['记录不存在']}}
+                continue
+            serializer = serializer_class(instance, data=item, partial=True, context=context)
+            if not serializer.is_valid():
+                results[index] = {'index': index, 'errors': serializer.errors}
+                continue
+            instance._bulk_old_values = {
+                f: getattr(instance, model._meta.get_field(f).attname) for f in serializer.validated_data}
+            self.apply_bulk_update(instance, serializer.validated_data)
+            valid.append((index, instance, set(serializer.validated_data)))
+
+        for chunk in chunked(valid, settings.BULK_CHUNK_SIZE):
+            objs = [obj for _, obj, _ in chunk]
+            fields = set().union(*(f for _, _, f in chunk))
+            if hasattr(model, 'updated_at'):
+                # bulk_update 不会触发 auto_now
+                now = timezone.now()
+                for obj in objs:
+                    obj.updated_at = now
+                fields.add('updated_at')
+            with transaction.atomic():
+                self.prepare_bulk_update(objs, fields)
+                if fields:
+                    model.objects.bulk_update(objs, sorted(fields))
+                self.after_bulk_write(objs, created=False)
+            for index, obj, _ in chunk:
+                results[index] = {'index': index, 'id': obj.pk}
+        return results
+
+    def apply_bulk_update(self, instance, validated_data):
+        for field, value in validated_data.items():
+            setattr(instance, field, value)
+
+    def prepare_bulk_update(self, objs, fields):
+        """bulk_update 之前调整实例或要写入的字段"""
+
+    def perform_bulk_delete(self, items):
+        model = self.queryset.model
+        ids = [bulk_id(pk) for pk in items]
+        found = set(model.objects.filter(pk__in=[pk for pk in ids if pk is not None]).values_list('pk', flat=True))
+        results = []
+        for index, pk in enumerate(ids):
+            if pk is None:
+                results.append({'index': index, 'errors': {'id': ['id 必须是整数']}})
+            elif pk in found:
+                results.append({'index': index, 'id': pk})
+            else:
+                results.append({'index': index, 'errors': {'id': ['记录不存在']}})
+        for chunk in chunked(sorted(found), settings.BULK_CHUNK_SIZE):
+            with transaction.atomic():
+                # 逐条触发 post_delete 信号，文件引用、索引和缓存随之更新
+                model.objects.filter(pk__in=chunk).delete()
+        return results
+
+
+class SurveyBulkMixin(BulkMixin):
+    def build_bulk_instance(self, validated_data):
+        survey = Survey(investigator=self.request.user, **validated_data)
+        survey.update_grid_cell()
+        return survey
+
+    def prepare_bulk_update(self, objs, fields):
+        if fields & {'longitude', 'latitude'}:
+            for obj in objs:
+                obj.update_grid_cell()
+            fields.update(('grid_x', 'grid_y'))
+
+    def after_bulk_write(self, objs, created):
+        points = set()
+        caching.invalidate_surveys([survey.pk for survey in objs])
+        for survey in objs:
+            search.index_survey(survey)
+            old = getattr(survey, '_bulk_old_values', {})
+            if created:
+                points.add((survey.longitude, survey.latitude))
+            elif 'longitude' in old or 'latitude' in old:
+                points.add((old.get('longitude', survey.longitude), old.get('latitude', survey.latitude)))
+                points.add((survey.longitude, survey.latitude))
+        if points:
+            # clustering.invalidate 按缩放级别分批删除，SQL 条件长度与本块的点数无关
+            transaction.on_commit(lambda: clustering.invalidate(points))
+        if created:
+            delta = Counter()
+            for survey in objs:
+                delta.update(stats.survey_counters(survey.investigator_id, survey.created_at))
+            stats.record(delta)
+
+
+class MediaItemBulkMixin(BulkMixin):
+    bulk_serializer_class = BulkMediaItemSerializer
+
+    def get_bulk_context(self, items):
+        context = super().get_bulk_context(items)
+        survey_ids = {bulk_id(item.get('survey')) for item in items if isinstance(item, dict)}
+        survey_ids.discard(None)
+        context['survey_ids'] = set(Survey.objects.filter(pk__in=survey_ids).values_list('pk', flat=True))
+        return context
+
+    def build_bulk_instance(self, validated_data):
+        validated_data['survey_id'] = validated_data.pop('survey')
+        return MediaItem(**validated_data)
+
+    def apply_bulk_update(self, instance, validated_data):
+        validated_data = dict(validated_data)
+        if 'survey' in validated_data:
+            instance.survey_id = validated_data.pop('survey')
+        super().apply_bulk_update(instance, validated_data)
+
+    def after_bulk_write(self, objs, created):
+        survey_ids = set()
+        for media_item in objs:
+            search.index_media_item(media_item)
+            survey_ids.add(media_item.survey_id)
+            old_survey_id = getattr(media_item, '_bulk_old_values', {}).get('survey')
+            if old_survey_id is not None:
+                survey_ids.add(old_survey_id)
+        caching.invalidate_surveys(survey_ids)
+        self.update_bulk_stats(objs, created)
+        if created:
+            jobs = [DerivativeJob(media_item=m) for m in objs if m.media_type in derivatives.DERIVATIVE_MEDIA_TYPES]
+            if jobs:
+                transaction.on_commit(lambda: DerivativeJob.objects.bulk_create(jobs))
+
+    def update_bulk_stats(self, objs, created):
+        if not created:
+            # 批量更新不能替换文件，只有所属调查、类型或分类变化时统计才变
+            objs = [m for m in objs if getattr(m, '_bulk_old_values', {}).keys() & {'survey', 'media_type', 'category'}]
+        delta = Counter()
+        for media_item, size in zip(objs, stats.media_sizes(objs)):
+            new = stats.media_counters(media_item.survey_id, media_item.media_type, media_item.category, size)
+            if created:
+                delta.update(new)
+                continue
+            old_values = media_item._bulk_old_values
+            old = stats.media_counters(
+                old_values.get('survey', media_item.survey_id), old_values.get('media_type', media_item.media_type),
+                old_values.get('category', media_item.category), size)
+            delta.update(stats.difference(old, new))
+        stats.record(delta)
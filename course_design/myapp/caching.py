@@ -0,0 +1,140 @@
+"""读接口的响应缓存
+
+缓存后端使用 Django 的 caches[API_CACHE_ALIAS]，可配置为本地内存、文件或 Redis。
+失效采用代数（generation）计数：每个调查和调查列表各有一个代数，缓存键包含相关代数，
+Survey / MediaItem 变化时由信号递增代数，旧条目自然失效，无需枚举删除。
+代数在事务提交后才递增：提交前递增的话，并发请求可能在新代数下缓存未提交前的数据，直到过期都不会更新。
+多进程部署时应使用文件或 Redis 等共享后端，否则失效只在本进程生效。
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+
+LIST_GENERATION = 'gen:survey-list'
+
+
+def get_cache():
+    return caches[settings.API_CACHE_ALIAS]
+
+
+def survey_generation_key(survey_id):
+    return 'gen:survey:%s' % survey_id
+
+
+def new_generation():
+    # 以毫秒时间戳为初值：代数键被淘汰后重新生成的值不会与旧条目的代数重合
+    return int(time.time() * 1000)
+
+
+def get_generations(keys):
+    cache = get_cache()
+    values = cache.get_many(keys)
+    for key in keys:
+        if key not in values:
+            cache.add(key, new_generation(), timeout=None)
+            values[key] = cache.get(key)
+    return [values[key] for key in keys]
+
+
+def bump(*keys):
+    """递增代数，使依赖这些键的缓存条目失效"""
+    cache = get_cache()
+    for key in keys:
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, new_generation(), timeout=None)
+
+
+def invalidate_survey(survey_id):
+    invalidate_surveys([survey_id])
+
+
+def invalidate_surveys(survey_ids):
+    """使调查列表和这些调查的详情失效，在当前事务提交后执行"""
+    keys = [LIST_GENERATION] + [survey_generation_key(pk) for pk in survey_ids]
+    transaction.on_commit(lambda: bump(*keys))
+
+
+def auth_scope(request):
+    """按权限范围区分缓存，同一范围内的用户看到相同的响应"""
+    user = request.user
+    if not user.is_authenticated:
+        return 'anon'
+    return 'staff' if user.is_staff else 'user'
+
+
+def make_etag(content):
+    return '"%s"' % hashlib.sha1(content).hexdigest()
+
+
+def etag_matches(request, etag):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if not if_none_match:
+        return False
+    etags = parse_etags(if_none_match)
+    return '*' in etags or etag in etags
+
+
+class CachedResponseMixin:
+    """为 list / retrieve 提供响应缓存与 ETag
+
+    视图通过 get_cache_generation_keys() 声明响应依赖哪些代数键。
+    """
+    cached_actions = ('list', 'retrieve')
+
+    def get_cache_generation_keys(self):
+        if self.action == 'retrieve':
+            return [survey_generation_key(self.kwargs[self.lookup_url_kwarg or self.lookup_field])]
+        return [LIST_GENERATION]
+
+    def get_response_cache_key(self, request):
+        generations = get_generations(self.get_cache_generation_keys())
+        params = sorted(request.query_params.lists())
+        raw = repr((
+            self.action, request.get_host(), request.path, params, auth_scope(request),
+            request.accepted_renderer.format, generations,
+        ))
+        return 'response:%s' % hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def dispatch_cached(self, handler, request, *args, **kwargs):
+        self._response_cache_key = self.get_response_cache_key(request)
+        cached = get_cache().get(self._response_cache_key)
+        if cached is None:
+            return handler(request, *args, **kwargs)
+        content, content_type, etag = cached
+        if etag_matches(request, etag):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(content, content_type=content_type)
+        response['ETag'] = etag
+        response['X-Cache'] = 'HIT'
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.dispatch_cached(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.dispatch_cached(super().retrieve, request, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        key = getattr(self, '_response_cache_key', None)
+        if key and self.action in self.cached_actions and response.status_code == 200 \
+                and not response.has_header('X-Cache'):
+            response.render()
+            etag = make_etag(response.content)
+            get_cache().set(key, (response.content, response['Content-Type'], etag))
+            response['ETag'] = etag
+            response['X-Cache'] = 'MISS'
+            if etag_matches(request, etag):
+                response = HttpResponseNotModified()
+                response['ETag'] = etag
+        patch_vary_headers(response, ('Authorization', 'Cookie'))
+        return response
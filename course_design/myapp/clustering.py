@@ -0,0 +1,171 @@
+"""调查点的服务端地图聚合
+
+按 Web 墨卡托瓦片组织：缩放级别 z 下，每个瓦片再细分为 2^CELL_BITS × 2^CELL_BITS 个格子，
+同一格子内的点合并为一个聚合（数量、质心、外包框）。格子由 SQL 的 CASE 表达式按边界划分，
+在数据库中 GROUP BY 聚合，低缩放级别的瓦片也不必把调查点逐条读入 Python。
+
+瓦片结果（包括空瓦片）存入 ClusterTile，请求时只计算缺失或超过 CLUSTER_TILE_TTL 的瓦片。
+Survey 变化时删除其所在的 CLUSTER_INVALIDATE_MIN_ZOOM 到 CLUSTER_CACHE_MAX_ZOOM 级瓦片；
+更低级别的瓦片覆盖大片区域，几乎每次写入都会命中，只按 TTL 刷新。
+计算与删除并发时可能存下旧结果，同样最多在 TTL 内可见。
+
+只保存不超过 CLUSTER_CACHE_MAX_ZOOM 级的瓦片，更高级别的瓦片范围很小，每次直接计算。
+"""
+import datetime
+import math
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Avg, Case, Count, IntegerField, Max, Min, Q, Value, When
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from . import geo
+from .models import Survey, ClusterTile
+
+MAX_ZOOM = 18
+CELL_BITS = 3
+MAX_LATITUDE = 85.05112878
+# 单次请求最多覆盖的瓦片数，防止低缩放级别下请求过大的视口
+MAX_TILES = 64
+# 删除瓦片时每条 SQL 涉及的瓦片数，避免条件过长超出 SQLite 的表达式深度限制
+INVALIDATE_BATCH = 100
+
+
+def tile_xy(longitude, latitude, zoom):
+    """坐标在缩放级别 zoom 下所在的瓦片"""
+    n = 2 ** zoom
+    lat = math.radians(max(min(latitude, MAX_LATITUDE), -MAX_LATITUDE))
+    x = int((longitude + 180.0) / 360.0 * n)
+    y = int((1.0 - math.log(math.tan(lat) + 1.0 / math.cos(lat)) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tile_bounds(tile_x, tile_y, zoom):
+    """瓦片的经纬度范围 (min_lon, min_lat, max_lon, max_lat)"""
+    n = 2 ** zoom
+
+    def lat(y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2.0 * y / n))))
+
+    min_lat = lat(tile_y + 1) if tile_y + 1 < n else -90.0
+    max_lat = lat(tile_y) if tile_y > 0 else 90.0
+    return tile_x / n * 360.0 - 180.0, min_lat, (tile_x + 1) / n * 360.0 - 180.0, max_lat
+
+
+def tile_q(zoom, tile_x, tile_y):
+    """瓦片范围的过滤条件，与 tile_xy 一致：西、北边界属于本瓦片，东、南边界属于相邻瓦片"""
+    n = 2 ** zoom
+    min_lon, min_lat, max_lon, max_lat = tile_bounds(tile_x, tile_y, zoom)
+    query = Q()
+    if tile_x > 0:
+        query &= Q(longitude__gte=min_lon)
+    if tile_x < n - 1:
+        query &= Q(longitude__lt=max_lon)
+    if tile_y > 0:
+        query &= Q(latitude__lte=max_lat)
+    if tile_y < n - 1:
+        query &= Q(latitude__gt=min_lat)
+    return query
+
+
+def cell_index(zoom, tile_x, tile_y):
+    """瓦片内格子的列号、行号（0 到 2^CELL_BITS - 1）的 CASE 表达式"""
+    size = 2 ** CELL_BITS
+    cell_zoom = zoom + CELL_BITS
+    column = Case(*[When(longitude__lt=tile_bounds(tile_x * size + i + 1, 0, cell_zoom)[0], then=Value(i))
+                    for i in range(size - 1)], default=Value(size - 1), output_field=IntegerField())
+    row = Case(*[When(latitude__gt=tile_bounds(0, tile_y * size + i + 1, cell_zoom)[3], then=Value(i))
+                 for i in range(size - 1)], default=Value(size - 1), output_field=IntegerField())
+    return column, row
+
+
+def compute_tile(zoom, tile_x, tile_y):
+    """在数据库中按格子聚合一个瓦片内的调查点"""
+    column, row = cell_index(zoom, tile_x, tile_y)
+    # 先按网格索引取候选行，落在瓦片边界上的点再由 tile_q 只归属一个瓦片
+    points = geo.filter_bbox(Survey.objects.all(), *tile_bounds(tile_x, tile_y, zoom))
+    cells = points.filter(tile_q(zoom, tile_x, tile_y)) \
+        .annotate(cell_x=column, cell_y=row).order_by() \
+        .values('cell_x', 'cell_y') \
+        .annotate(count=Count('id'), avg_lon=Avg('longitude'), avg_lat=Avg('latitude'), first_id=Min('id'),
+                  min_lon=Min('longitude'), min_lat=Min('latitude'),
+                  max_lon=Max('longitude'), max_lat=Max('latitude'))
+
+    clusters = []
+    for cell in cells.order_by('cell_x', 'cell_y'):
+        cluster = {
+            'count': cell['count'],
+            'longitude': cell['avg_lon'],
+            'latitude': cell['avg_lat'],
+            'bounds': [cell['min_lon'], cell['min_lat'], cell['max_lon'], cell['max_lat']],
+        }
+        if cell['count'] == 1:
+            cluster['survey_id'] = cell['first_id']
+        clusters.append(cluster)
+    return clusters
+
+
+def viewport_tiles(zoom, min_lon, min_lat, max_lon, max_lat):
+    if min_lon > max_lon:
+        return viewport_tiles(zoom, min_lon, min_lat, 180.0, max_lat) + \
+            viewport_tiles(zoom, -180.0, min_lat, max_lon, max_lat)
+    x0, y0 = tile_xy(min_lon, max_lat, zoom)
+    x1, y1 = tile_xy(max_lon, min_lat, zoom)
+    return [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+
+def get_clusters(zoom, bbox):
+    """返回视口内的聚合，缺失的瓦片即时计算并保存"""
+    zoom = min(zoom, MAX_ZOOM)
+    tiles = viewport_tiles(zoom, *bbox)
+    if len(tiles) > MAX_TILES:
+        raise ValidationError({'bbox': '视口在该缩放级别下过大'})
+
+    store = zoom <= settings.CLUSTER_CACHE_MAX_ZOOM
+    cached = {}
+    if store:
+        query = Q()
+        for x, y in tiles:
+            query |= Q(tile_x=x, tile_y=y)
+        fresh_since = timezone.now() - datetime.timedelta(seconds=settings.CLUSTER_TILE_TTL)
+        cached = {(t.tile_x, t.tile_y): t.clusters
+                  for t in ClusterTile.objects.filter(query, zoom=zoom, updated_at__gte=fresh_since)}
+
+    clusters = []
+    for x, y in tiles:
+        tile_clusters = cached.get((x, y))
+        if tile_clusters is None:
+            tile_clusters = compute_tile(zoom, x, y)
+            if store:
+                save_tile(zoom, x, y, tile_clusters)
+        clusters.extend(tile_clusters)
+    return {'zoom': zoom, 'clusters': clusters}
+
+
+def save_tile(zoom, tile_x, tile_y, clusters):
+    """保存或刷新过期的瓦片；空瓦片同样保存，免得每次请求都重新查询"""
+    try:
+        with transaction.atomic():
+            ClusterTile.objects.update_or_create(zoom=zoom, tile_x=tile_x, tile_y=tile_y,
+                                                 defaults={'clusters': clusters})
+    except IntegrityError:
+        # 并发请求已写入同一瓦片
+        pass
+
+
+def invalidate(points):
+    """删除包含这些坐标的 CLUSTER_INVALIDATE_MIN_ZOOM 级及以上的瓦片
+
+    按缩放级别分批，每批用 tile_x IN / tile_y IN 删除，批内行列组合出的其他瓦片也会被删除，下次请求时重新计算。
+    """
+    tiles = {}
+    for longitude, latitude in points:
+        for zoom in range(settings.CLUSTER_INVALIDATE_MIN_ZOOM, min(MAX_ZOOM, settings.CLUSTER_CACHE_MAX_ZOOM) + 1):
+            tiles.setdefault(zoom, set()).add(tile_xy(longitude, latitude, zoom))
+    for zoom, keys in tiles.items():
+        keys = sorted(keys)
+        for i in range(0, len(keys), INVALIDATE_BATCH):
+            batch = keys[i:i + INVALIDATE_BATCH]
+            ClusterTile.objects.filter(zoom=zoom, tile_x__in={x for x, _ in batch},
+                                       tile_y__in={y for _, y in batch}).delete()
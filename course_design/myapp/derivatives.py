@@ -0,0 +1,165 @@
+"""媒体衍生文件的生成与任务队列
+
+图片依赖 Pillow 生成缩略图和网页尺寸图；视频封面和音频波形图依赖 ffmpeg。
+依赖缺失时任务记为失败并写明原因，不影响上传本身。
+"""
+import io
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import MediaDerivative, DerivativeJob
+
+logger = logging.getLogger(__name__)
+
+# 需要生成衍生文件的媒体类型
+DERIVATIVE_MEDIA_TYPES = ('IMAGE', 'VIDEO', 'AUDIO')
+
+MAX_ATTEMPTS = 3
+
+
+class DerivativeError(Exception):
+    pass
+
+
+def enqueue(media_item):
+    """为媒体资料排入一个生成任务"""
+    if media_item.media_type in DERIVATIVE_MEDIA_TYPES:
+        return DerivativeJob.objects.create(media_item=media_item)
+    return None
+
+
+def claim_jobs(limit):
+    """领取最多 limit 个任务
+
+    通过带状态条件的 UPDATE 抢占，多个 worker 并发领取时每个任务只会被一个拿到；
+    处理超时的 RUNNING 任务视为 worker 已崩溃，可被重新领取；
+    失败后等待重试的任务按 DERIVATIVE_RETRY_DELAY 指数退避，第 n 次重试在上次失败 DELAY × 2^(n-1) 秒后才可领取。
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.DERIVATIVE_JOB_TIMEOUT)
+    ready = Q(attempts=0)
+    for attempts in range(1, MAX_ATTEMPTS):
+        delay = settings.DERIVATIVE_RETRY_DELAY * 2 ** (attempts - 1)
+        ready |= Q(attempts=attempts, updated_at__lte=now - timedelta(seconds=delay))
+    candidates = DerivativeJob.objects.filter(ready, status='PENDING') | \
+        DerivativeJob.objects.filter(status='RUNNING', locked_at__lt=stale)
+    claimed = []
+    for job in candidates.order_by('created_at').values('id', 'status', 'locked_at')[:limit * 2]:
+        if DerivativeJob.objects.filter(pk=job['id'], status=job['status'], locked_at=job['locked_at']) \
+                .update(status='RUNNING', locked_at=now):
+            claimed.append(job['id'])
+            if len(claimed) >= limit:
+                break
+    return claimed
+
+
+def process_job(job_id):
+    """执行一个已领取的任务，返回最终状态；媒体资料已删除（任务随之级联删除）时返回 'DELETED'"""
+    try:
+        job = DerivativeJob.objects.select_related('media_item').get(pk=job_id)
+    except DerivativeJob.DoesNotExist:
+        return 'DELETED'
+    try:
+        generate_derivatives(job.media_item)
+    except Exception as e:
+        logger.warning('生成衍生文件失败 media_item=%s: %s', job.media_item_id, e)
+        attempts = job.attempts + 1
+        # 缺少依赖之类的确定性错误不再重试
+        retry = attempts < MAX_ATTEMPTS and not isinstance(e, DerivativeError)
+        status = 'PENDING' if retry else 'FAILED'
+        DerivativeJob.objects.filter(pk=job_id).update(
+            status=status, attempts=attempts, error=str(e), locked_at=None, updated_at=timezone.now())
+        return status
+    DerivativeJob.objects.filter(pk=job_id).update(
+        status='DONE', attempts=job.attempts + 1, error='', locked_at=None, updated_at=timezone.now())
+    return 'DONE'
+
+
+def generate_derivatives(media_item):
+    source = media_item.file_path.path
+    if media_item.media_type == 'IMAGE':
+        with open(source, 'rb') as f:
+            outputs = resize_image(f, ('thumb', 'web'))
+    elif media_item.media_type == 'VIDEO':
+        frame = run_ffmpeg([
+            '-ss', str(settings.DERIVATIVE_POSTER_OFFSET), '-i', source,
+            '-frames:v', '1', '-f', 'image2', '-c:v', 'png',
+        ])
+        outputs = resize_image(io.BytesIO(frame), ('thumb', 'poster'))
+    elif media_item.media_type == 'AUDIO':
+        width, height = settings.DERIVATIVE_WAVEFORM_SIZE
+        image = run_ffmpeg([
+            '-i', source, '-filter_complex', 'showwavespic=s=%dx%d:split_channels=0' % (width, height),
+            '-frames:v', '1', '-f', 'image2', '-c:v', 'png',
+        ])
+        outputs = [('waveform', image, 'png', width, height)]
+    else:
+        return
+
+    for variant, data, ext, width, height in outputs:
+        save_derivative(media_item, variant, data, ext, width, height)
+
+
+def save_derivative(media_item, variant, data, ext, width, height):
+    name = '%s_%s.%s' % (media_item.pk, variant, ext)
+    with transaction.atomic():
+        derivative = MediaDerivative.objects.select_for_update() \
+            .filter(media_item=media_item, variant=variant).first()
+        if derivative is None:
+            derivative = MediaDerivative(media_item=media_item, variant=variant)
+        elif derivative.file:
+            derivative.file.delete(save=False)
+        derivative.width = width
+        derivative.height = height
+        derivative.file.save(name, ContentFile(data), save=False)
+        derivative.save()
+
+
+def resize_image(fileobj, variants):
+    """按 DERIVATIVE_SIZES 的最长边缩放，返回 (variant, 数据, 扩展名, 宽, 高) 列表"""
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        raise DerivativeError('未安装 Pillow，无法生成图片衍生文件')
+
+    outputs = []
+    with Image.open(fileobj) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        for variant in variants:
+            size = settings.DERIVATIVE_SIZES[variant]
+            resized = image.copy()
+            resized.thumbnail((size, size))
+            buf = io.BytesIO()
+            resized.save(buf, 'JPEG', quality=82, optimize=True, progressive=True)
+            outputs.append((variant, buf.getvalue(), 'jpg', resized.width, resized.height))
+    return outputs
+
+
+def run_ffmpeg(args):
+    """运行 ffmpeg 并返回输出文件内容"""
+    ffmpeg = shutil.which(settings.FFMPEG_BINARY)
+    if ffmpeg is None:
+        raise DerivativeError('未找到 ffmpeg，无法生成音视频衍生文件')
+    fd, output = tempfile.mkstemp(suffix='.png')
+    os.close(fd)
+    try:
+        subprocess.run([ffmpeg, '-y', '-loglevel', 'error'] + args + [output],
+                       check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=120)
+        with open(output, 'rb') as f:
+            return f.read()
+    except subprocess.CalledProcessError as e:
+        raise Exception('ffmpeg 执行失败: %s' % e.stderr.decode('utf-8', 'replace').strip())
+    finally:
+        os.remove(output)
@@ -0,0 +1,92 @@
+"""调查资料库的流式导出
+
+Survey 与 MediaItem 分别用 .iterator(chunk_size=...) 按主键顺序读取，
+在 Python 中做归并连接，内存占用与资料库大小无关。
+"""
+import csv
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Survey, MediaItem
+
+FORMATS = ('ndjson', 'csv', 'geojson')
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+    'csv': 'text/csv; charset=utf-8',
+    'geojson': 'application/geo+json; charset=utf-8',
+}
+CSV_FIELDS = ['id', 'name', 'longitude', 'latitude', 'start_date', 'end_date',
+              'investigator', 'created_at', 'updated_at', 'media_count']
+
+SURVEY_FIELDS = ('id', 'name', 'longitude', 'latitude', 'start_date', 'end_date',
+                 'investigator__username', 'created_at', 'updated_at')
+MEDIA_FIELDS = ('id', 'survey_id', 'title', 'description', 'media_type', 'category',
+                'file_path', 'mime_type', 'file_size', 'width', 'height', 'duration', 'created_at')
+
+
+def iter_surveys(queryset=None, include_media=True, url_builder=None):
+    """按主键顺序逐条产出调查记录（dict），media_items 为该调查的媒体列表"""
+    chunk_size = settings.EXPORT_CHUNK_SIZE
+    if queryset is None:
+        queryset = Survey.objects.all()
+    surveys = queryset.order_by('pk').values(*SURVEY_FIELDS).iterator(chunk_size=chunk_size)
+    media = MediaItem.objects.filter(survey__in=queryset.values('pk')) \
+        .order_by('survey_id', 'pk').values(*MEDIA_FIELDS).iterator(chunk_size=chunk_size)
+    pending = next(media, None)
+
+    for survey in surveys:
+        survey['investigator'] = survey.pop('investigator__username')
+        items = []
+        while pending is not None and pending['survey_id'] <= survey['id']:
+            if pending['survey_id'] == survey['id']:
+                item = pending
+                del item['survey_id']
+                if url_builder is not None and item['file_path']:
+                    item['url'] = url_builder(settings.MEDIA_URL + item['file_path'])
+                items.append(item)
+            pending = next(media, None)
+        survey['media_count'] = len(items)
+        if include_media:
+            survey['media_items'] = items
+        yield survey
+
+
+def dumps(obj):
+    return json.dumps(obj, cls=DjangoJSONEncoder, ensure_ascii=False)
+
+
+class Echo:
+    """csv.writer 需要一个带 write 的对象，这里直接返回写入的内容"""
+
+    def write(self, value):
+        return value
+
+
+def render(fmt, surveys):
+    """把调查记录流转换为指定格式的文本块流"""
+    if fmt == 'ndjson':
+        for survey in surveys:
+            yield dumps(survey) + '\n'
+    elif fmt == 'csv':
+        writer = csv.DictWriter(Echo(), fieldnames=CSV_FIELDS, extrasaction='ignore')
+        # 带 BOM，便于 Excel 正确识别中文
+        yield '﻿' + writer.writeheader()
+        for survey in surveys:
+            yield writer.writerow(survey)
+    elif fmt == 'geojson':
+        yield '{"type": "FeatureCollection", "features": ['
+        separator = ''
+        for survey in surveys:
+            feature = {
+                'type': 'Feature',
+                'id': survey['id'],
+                'geometry': {'type': 'Point', 'coordinates': [survey.pop('longitude'), survey.pop('latitude')]},
+                'properties': survey,
+            }
+            yield separator + dumps(feature)
+            separator = ',\n'
+        yield ']}\n'
+    else:
+        raise ValueError('unsupported format: %s' % fmt)
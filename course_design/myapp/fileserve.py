@@ -0,0 +1,220 @@
+"""媒体文件投递的辅助函数：Range 解析、条件请求校验和代理加速
+
+range_response 返回的 RangeStreamingResponse 在 WSGI 下同步迭代；ASGI 下由 myapp.asgi.ASGIHandler
+通过 async_streaming_content 发送，文件读取在 myapp.aio 的文件池中进行，不阻塞事件循环。
+"""
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+
+from . import aio
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+
+
+def make_etag(stat_result):
+    """根据文件大小和修改时间生成 ETag，不读取文件内容"""
+    return '"%x-%x"' % (int(stat_result.st_mtime), stat_result.st_size)
+
+
+def parse_range_header(header, size):
+    """解析单段 Range 头，返回 (start, end) 闭区间
+
+    没有 Range 头或格式不支持（如多段范围）时返回 None，调用方应返回完整文件；
+    范围无法满足时抛出 ValueError。
+    """
+    if not header:
+        return None
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        # bytes=-N 表示最后 N 个字节
+        length = int(end)
+        if length == 0 or size == 0:
+            raise ValueError('unsatisfiable range')
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = int(end) if end else size - 1
+    if start >= size or end < start:
+        raise ValueError('unsatisfiable range')
+    return start, min(end, size - 1)
+
+
+def if_range_matches(request, etag, last_modified):
+    """If-Range 与当前文件版本不一致时应忽略 Range，返回完整文件"""
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == int(last_modified)
+
+
+def file_range_iterator(path, start, length, chunk_size=CHUNK_SIZE):
+    """按块读取文件的指定区间"""
+    with open(path, 'rb') as f:
+        yield from read_range(f, start, length, chunk_size)
+
+
+def read_range(f, start, length, chunk_size=CHUNK_SIZE):
+    f.seek(start)
+    remaining = length
+    while remaining > 0:
+        data = f.read(min(chunk_size, remaining))
+        if not data:
+            break
+        remaining -= len(data)
+        yield data
+
+
+def open_file(full_path):
+    """打开要投递的文件，不存在时抛出 Http404；在生成响应之前调用，避免发出响应头后才发现文件缺失"""
+    try:
+        return open(full_path, 'rb')
+    except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
+        raise Http404("File not found")
+
+
+class FileRange:
+    """文件的指定区间，可同步或异步迭代；异步迭代时打开和读取在文件池中执行
+
+    source 为路径或已打开的文件（见 open_file），传入的文件在迭代结束或 close() 时关闭。
+    """
+
+    def __init__(self, source, start, length, chunk_size=CHUNK_SIZE):
+        self.file = None if isinstance(source, (str, os.PathLike)) else source
+        self.path = source if self.file is None else None
+        self.start = start
+        self.length = length
+        self.chunk_size = chunk_size
+
+    def __iter__(self):
+        if self.file is None:
+            return file_range_iterator(self.path, self.start, self.length, self.chunk_size)
+        return self._iter_file()
+
+    def _iter_file(self):
+        try:
+            yield from read_range(self.file, self.start, self.length, self.chunk_size)
+        finally:
+            self.file.close()
+
+    async def __aiter__(self):
+        f = self.file
+        if f is None:
+            f = await aio.run_file_io(open, self.path, 'rb')
+        try:
+            f.seek(self.start)
+            remaining = self.length
+            while remaining > 0:
+                data = await aio.run_file_io(f.read, min(self.chunk_size, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+                yield data
+        finally:
+            f.close()
+
+    def close(self):
+        # 响应没有发送内容（如 HEAD 请求）时由 response.close() 调用
+        if self.file is not None:
+            self.file.close()
+
+
+class RangeStreamingResponse(StreamingHttpResponse):
+    """内容可异步迭代的流式响应
+
+    内容本身支持异步迭代（FileRange）时直接使用，否则在文件池中逐块推进同步迭代器，
+    因此内容只能读取文件，不能访问数据库。
+    """
+
+    def _set_streaming_content(self, value):
+        self._async_source = value if hasattr(value, '__aiter__') else None
+        super()._set_streaming_content(value)
+
+    @property
+    def async_streaming_content(self):
+        if self._async_source is not None:
+            return self._async_source.__aiter__()
+        return aio.iterate(self._iterator)
+
+
+def accel_response(full_path, relative_path):
+    """把文件传输交给前端代理，返回 None 表示未启用加速"""
+    mode = getattr(settings, 'MEDIA_ACCEL_MODE', None)
+    if mode == 'x-accel-redirect':
+        response = HttpResponse()
+        prefix = settings.MEDIA_ACCEL_REDIRECT_PREFIX.rstrip('/')
+        response['X-Accel-Redirect'] = '%s/%s' % (prefix, quote(relative_path))
+        return response
+    if mode == 'x-sendfile':
+        response = HttpResponse()
+        response['X-Sendfile'] = full_path
+        return response
+    return None
+
+
+def range_response(request, size, etag, last_modified, iterator_factory):
+    """按 Range 头返回完整内容（200）、部分内容（206）或 416
+
+    iterator_factory(start, length) 产出内容中该区间的字节，只能读取文件（见 RangeStreamingResponse）。
+    """
+    try:
+        byte_range = parse_range_header(request.META.get('HTTP_RANGE'), size)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = 'bytes */%d' % size
+        return response
+    if byte_range is not None and not if_range_matches(request, etag, last_modified):
+        byte_range = None
+
+    if byte_range is None:
+        response = RangeStreamingResponse(iterator_factory(0, size))
+        response['Content-Length'] = str(size)
+    else:
+        start, end = byte_range
+        length = end - start + 1
+        response = RangeStreamingResponse(iterator_factory(start, length), status=206)
+        response['Content-Length'] = str(length)
+        response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, size)
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def serve_file(request, full_path, relative_path, stat_result, content_type=None):
+    """支持条件请求、字节范围和代理加速的文件响应"""
+    return serve_content(request, full_path, relative_path, stat_result.st_size,
+                         make_etag(stat_result), stat_result.st_mtime, content_type)
+
+
+def serve_content(request, full_path, relative_path, size, etag, last_modified, content_type=None, fileobj=None):
+    """与 serve_file 相同，大小和版本信息由调用方给出（如数据库中已记录的元数据），不再 stat 文件
+
+    fileobj 为调用方已打开的文件（见 open_file），用于发送内容；不发送内容时在这里关闭。
+    """
+    response = get_conditional_response(request, etag=etag, last_modified=int(last_modified))
+    if response is None:
+        response = accel_response(full_path, relative_path)
+    if response is None:
+        response = range_response(request, size, etag, last_modified,
+                                  lambda start, length: FileRange(fileobj or full_path, start, length))
+    if fileobj is not None and not response.streaming:
+        fileobj.close()
+    if response.status_code == 416:
+        return response
+
+    if content_type and response.status_code != 304:
+        response['Content-Type'] = content_type
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    return response
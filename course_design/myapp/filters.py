@@ -0,0 +1,63 @@
+"""列表接口的服务端过滤（django-filter）
+
+调查按媒体类型 / 分类过滤时用 EXISTS 相关子查询判断是否有符合条件的媒体，
+不连接媒体表，结果不会重复，也无需 DISTINCT；子查询走 mediaitem_survey_type_idx。
+同时给出 media_type 和 category 时要求同一条媒体同时满足两者。
+"""
+from django.db.models import Exists, OuterRef
+from django_filters import rest_framework as filters
+
+from .models import Survey, MediaItem
+
+
+class SurveyFilter(filters.FilterSet):
+    """?investigator=&date_from=&date_to=&media_type=&category=&has_media=&created_after=&created_before=
+
+    date_from / date_to 按调查时间段与给定区间有重叠过滤，可只给一端。
+    media_type、category 可重复给出多个值，满足其一即可。
+    """
+    investigator = filters.NumberFilter(field_name='investigator_id')
+    date_from = filters.DateFilter(field_name='end_date', lookup_expr='gte')
+    date_to = filters.DateFilter(field_name='start_date', lookup_expr='lte')
+    created_after = filters.IsoDateTimeFilter(field_name='created_at', lookup_expr='gte')
+    created_before = filters.IsoDateTimeFilter(field_name='created_at', lookup_expr='lt')
+    media_type = filters.MultipleChoiceFilter(choices=MediaItem.MEDIA_TYPES, method='filter_media')
+    category = filters.MultipleChoiceFilter(choices=MediaItem.CATEGORY_TYPES, method='filter_media')
+    has_media = filters.BooleanFilter(method='filter_has_media')
+
+    class Meta:
+        model = Survey
+        fields = []
+
+    def filter_media(self, queryset, name, value):
+        # 由 filter_queryset 合并成一个子查询
+        return queryset
+
+    def filter_has_media(self, queryset, name, value):
+        exists = Exists(MediaItem.objects.filter(survey=OuterRef('pk')))
+        return queryset.filter(exists if value else ~exists)
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        conditions = {}
+        for name in ('media_type', 'category'):
+            values = self.form.cleaned_data.get(name)
+            if values:
+                conditions['%s__in' % name] = values
+        if conditions:
+            queryset = queryset.filter(Exists(MediaItem.objects.filter(survey=OuterRef('pk'), **conditions)))
+        return queryset
+
+
+class MediaItemFilter(filters.FilterSet):
+    """?survey=&investigator=&media_type=&category=&created_after=&created_before="""
+    survey = filters.NumberFilter(field_name='survey_id')
+    investigator = filters.NumberFilter(field_name='survey__investigator_id')
+    media_type = filters.MultipleChoiceFilter(choices=MediaItem.MEDIA_TYPES)
+    category = filters.MultipleChoiceFilter(choices=MediaItem.CATEGORY_TYPES)
+    created_after = filters.IsoDateTimeFilter(field_name='created_at', lookup_expr='gte')
+    created_before = filters.IsoDateTimeFilter(field_name='created_at', lookup_expr='lt')
+
+    class Meta:
+        model = MediaItem
+        fields = []
@@ -0,0 +1,107 @@
+"""调查坐标的空间索引与查询
+
+不依赖 GIS 扩展：把经纬度按 GRID_SIZE 度划分为整数网格，Survey 上保存所在网格的
+(grid_y, grid_x) 并建立组合索引。范围查询先按网格区间命中候选行，再用精确坐标过滤，
+SQLite 和 PostgreSQL 上都只扫描候选网格内的索引项。
+"""
+import math
+
+from django.db.models import F, Q
+from django.db.models.functions import ASin, Cos, Power, Radians, Sin, Sqrt
+from rest_framework.exceptions import ValidationError
+
+# 网格边长（度），约 11 公里；修改后需要重新计算已有数据的网格
+GRID_SIZE = 0.1
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = 111.32
+
+
+def grid_cell(longitude, latitude):
+    """返回坐标所在网格 (grid_x, grid_y)"""
+    return (
+        int(math.floor((longitude + 180.0) / GRID_SIZE)),
+        int(math.floor((latitude + 90.0) / GRID_SIZE)),
+    )
+
+
+def parse_float(value, name, low, high):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise ValidationError({name: '必须是数字'})
+    if not low <= value <= high or math.isnan(value):
+        raise ValidationError({name: '超出范围 [%s, %s]' % (low, high)})
+    return value
+
+
+def parse_bbox(value):
+    """解析 bbox=最小经度,最小纬度,最大经度,最大纬度"""
+    parts = value.split(',')
+    if len(parts) != 4:
+        raise ValidationError({'bbox': '格式应为 min_lon,min_lat,max_lon,max_lat'})
+    min_lon = parse_float(parts[0], 'bbox', -180, 180)
+    min_lat = parse_float(parts[1], 'bbox', -90, 90)
+    max_lon = parse_float(parts[2], 'bbox', -180, 180)
+    max_lat = parse_float(parts[3], 'bbox', -90, 90)
+    if min_lat > max_lat:
+        raise ValidationError({'bbox': '最小纬度不能大于最大纬度'})
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def bbox_q(min_lon, min_lat, max_lon, max_lat):
+    """矩形范围条件；min_lon > max_lon 表示跨越 180 度经线"""
+    if min_lon > max_lon:
+        return bbox_q(min_lon, min_lat, 180.0, max_lat) | bbox_q(-180.0, min_lat, max_lon, max_lat)
+    x0, y0 = grid_cell(min_lon, min_lat)
+    x1, y1 = grid_cell(max_lon, max_lat)
+    return Q(
+        grid_y__range=(y0, y1), grid_x__range=(x0, x1),
+        latitude__range=(min_lat, max_lat), longitude__range=(min_lon, max_lon),
+    )
+
+
+def filter_bbox(queryset, min_lon, min_lat, max_lon, max_lat):
+    return queryset.filter(bbox_q(min_lon, min_lat, max_lon, max_lat))
+
+
+def filter_radius(queryset, latitude, longitude, radius_km):
+    """按圆形范围过滤，并附加 distance_km（大圆距离）"""
+    dlat = radius_km / KM_PER_DEGREE
+    cos_lat = math.cos(math.radians(latitude))
+    if cos_lat < 1e-6 or radius_km / (KM_PER_DEGREE * cos_lat) >= 180:
+        dlon = 180.0
+    else:
+        dlon = radius_km / (KM_PER_DEGREE * cos_lat)
+
+    min_lat, max_lat = max(latitude - dlat, -90.0), min(latitude + dlat, 90.0)
+    if dlon >= 180.0 or min_lat == -90.0 or max_lat == 90.0:
+        # 覆盖极点或整圈经度时只按纬度带取候选
+        queryset = filter_bbox(queryset, -180.0, min_lat, 180.0, max_lat)
+    else:
+        min_lon = (longitude - dlon + 540.0) % 360.0 - 180.0
+        max_lon = (longitude + dlon + 540.0) % 360.0 - 180.0
+        queryset = filter_bbox(queryset, min_lon, min_lat, max_lon, max_lat)
+
+    # haversine 公式；SQLite 上这些数学函数由 Django 注册
+    lat1, lon1 = math.radians(latitude), math.radians(longitude)
+    lat2, lon2 = Radians(F('latitude')), Radians(F('longitude'))
+    a = Power(Sin((lat2 - lat1) / 2), 2) + \
+        math.cos(lat1) * Cos(lat2) * Power(Sin((lon2 - lon1) / 2), 2)
+    distance = 2 * EARTH_RADIUS_KM * ASin(Sqrt(a))
+    return queryset.annotate(distance_km=distance).filter(distance_km__lte=radius_km)
+
+
+def filter_queryset(queryset, params):
+    """按请求参数应用 bbox 和 lat/lon/radius 过滤"""
+    bbox = params.get('bbox')
+    if bbox:
+        queryset = filter_bbox(queryset, *parse_bbox(bbox))
+    radius = params.get('radius')
+    if radius:
+        queryset = filter_radius(
+            queryset,
+            parse_float(params.get('lat'), 'lat', -90, 90),
+            parse_float(params.get('lon'), 'lon', -180, 180),
+            parse_float(radius, 'radius', 0, 20000),
+        )
+    return queryset
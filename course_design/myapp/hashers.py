@@ -0,0 +1,22 @@
+"""可配置计算成本的密码哈希
+
+Django 在校验密码时，若哈希算法不是 PASSWORD_HASHERS 的第一项或成本参数与当前配置不同，
+会用第一项重新哈希并保存。这里的哈希类从设置读取成本，调整 PASSWORD_PBKDF2_ITERATIONS
+或 PASSWORD_BCRYPT_ROUNDS 后，用户下次登录成功时即按新成本重新保存。
+"""
+from django.conf import settings
+from django.contrib.auth.hashers import BCryptSHA256PasswordHasher, PBKDF2PasswordHasher
+
+
+class ConfigurablePBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    @property
+    def iterations(self):
+        return settings.PASSWORD_PBKDF2_ITERATIONS
+
+
+class ConfigurableBCryptSHA256PasswordHasher(BCryptSHA256PasswordHasher):
+    """需要安装 bcrypt"""
+
+    @property
+    def rounds(self):
+        return settings.PASSWORD_BCRYPT_ROUNDS
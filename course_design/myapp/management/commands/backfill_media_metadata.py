@@ -0,0 +1,81 @@
+import multiprocessing
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import Q
+from django.utils._os import safe_join
+
+from myapp import caching, mediainfo
+from myapp.models import MediaItem
+
+FIELDS = ['mime_type', 'file_size', 'checksum'] + list(mediainfo.FIELDS)
+
+
+def init_worker():
+    # fork 出来的子进程不能复用父进程的数据库连接；子进程只读文件，不访问数据库
+    connections.close_all()
+
+
+def describe(name):
+    try:
+        return name, mediainfo.describe(safe_join(settings.MEDIA_ROOT, name)), None
+    except (OSError, SuspiciousFileOperation) as e:
+        return name, None, str(e)
+
+
+class Command(BaseCommand):
+    help = '为已有的媒体资料回填文件大小、MIME 类型、SHA-256、尺寸和时长，用进程池并行读取文件'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=multiprocessing.cpu_count(),
+                            help='工作进程数，默认等于 CPU 核数')
+        parser.add_argument('--batch-size', type=int, default=200,
+                            help='每批读取和更新的媒体数')
+        parser.add_argument('--all', action='store_true',
+                            help='重新计算全部媒体，默认只处理缺少元数据的')
+
+    def handle(self, *args, **options):
+        queryset = MediaItem.objects.all()
+        if not options['all']:
+            queryset = queryset.filter(Q(file_size__isnull=True) | Q(checksum=''))
+        processes = max(1, options['processes'])
+        updated = failed = 0
+        connections.close_all()
+        pool = multiprocessing.Pool(processes, initializer=init_worker)
+        try:
+            last_pk = 0
+            while True:
+                # 按主键分批，处理失败的记录不会被反复选中
+                batch = list(queryset.filter(pk__gt=last_pk).order_by('pk')
+                             .only('id', 'survey_id', 'file_path')[:options['batch_size']])
+                if not batch:
+                    break
+                last_pk = batch[-1].pk
+                # 去重存储中多条媒体可能共用一个文件，每个文件只读一次
+                names = {item.file_path.name for item in batch if item.file_path.name}
+                results = {}
+                for name, info, error in pool.imap_unordered(describe, names):
+                    if info is None:
+                        self.stderr.write('%s: %s' % (name, error))
+                    else:
+                        results[name] = info
+                changed = []
+                for item in batch:
+                    info = results.get(item.file_path.name)
+                    if info is None:
+                        failed += 1
+                        continue
+                    for field, value in info.items():
+                        setattr(item, field, value)
+                    changed.append(item)
+                MediaItem.objects.bulk_update(changed, FIELDS)
+                # bulk_update 不触发信号，响应缓存中的媒体资料需显式失效
+                caching.invalidate_surveys({item.survey_id for item in changed})
+                updated += len(changed)
+                self.stdout.write('已处理至 id=%d' % last_pk)
+        finally:
+            pool.close()
+            pool.join()
+        self.stdout.write(self.style.SUCCESS('已回填 %d 条，失败 %d 条' % (updated, failed)))
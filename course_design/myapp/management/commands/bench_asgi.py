@@ -0,0 +1,186 @@
+import asyncio
+import datetime
+import io
+import logging
+import os
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+
+from myapp.asgi import ASGIHandler
+from myapp.models import Survey, UserProfile
+
+BENCH_USERNAME = 'asgi-bench'
+BENCH_DIR = 'bench-asgi'
+BENCH_FILE = 'media.bin'
+BENCH_FILE_SIZE = 1024 * 1024
+
+
+class Command(BaseCommand):
+    help = ('ASGI（myapp.asgi）与 WSGI 部署在进程内的负载对比：调查列表、调查详情、慢客户端下载媒体文件。'
+            'WSGI 模拟固定线程数的线程池服务器，慢客户端按块阻塞写；ASGI 在单个事件循环中处理全部连接')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=32, help='并发客户端数')
+        parser.add_argument('--requests', type=int, default=320, help='每个场景的请求总数')
+        parser.add_argument('--workers', type=int, default=8, help='WSGI 服务器的线程数')
+        parser.add_argument('--slow-client-ms', type=float, default=5.0, help='慢客户端每收到 64KB 的等待（毫秒）')
+
+    def handle(self, *args, **options):
+        self.options = options
+        survey_id = self.setup()
+        scenarios = [
+            # 附加随机参数使每次请求都未命中响应缓存
+            ('调查列表', lambda i: '/api/surveys/?page_size=20&n=%d' % i, False),
+            ('调查详情', lambda i: '/api/surveys/%d/?n=%d' % (survey_id, i), False),
+            ('媒体下载（慢客户端）', lambda i: '/api/media/%s/%s' % (BENCH_DIR, BENCH_FILE), True),
+        ]
+        logging.disable(logging.WARNING)
+        try:
+            self.stdout.write('%-20s %6s %10s %10s %10s %6s' % ('场景', '部署', '请求/秒', 'p50(ms)', 'p95(ms)', '失败'))
+            base = 0
+            for name, url, slow in scenarios:
+                for mode, run in (('WSGI', self.run_wsgi), ('ASGI', self.run_asgi)):
+                    # 两种部署使用不同的参数，互不命中对方写入的缓存；序号 -1 用于预热
+                    base += self.options['requests'] + 1
+                    rate, latencies, failures = run(lambda i, base=base: url(base + i), slow)
+                    self.stdout.write('%-20s %6s %10.1f %10.1f %10.1f %6d' % (
+                        name, mode, rate, percentile(latencies, 50), percentile(latencies, 95), failures))
+        finally:
+            logging.disable(logging.NOTSET)
+            self.teardown()
+
+    def setup(self):
+        self.teardown()
+        user = UserProfile.objects.create_user(username=BENCH_USERNAME, password=None)
+        today = datetime.date.today()
+        surveys = [Survey.objects.create(name='基准%d' % i, longitude=100.0, latitude=25.0,
+                                         start_date=today, end_date=today, investigator=user)
+                   for i in range(50)]
+        os.makedirs(os.path.join(settings.MEDIA_ROOT, BENCH_DIR), exist_ok=True)
+        with open(os.path.join(settings.MEDIA_ROOT, BENCH_DIR, BENCH_FILE), 'wb') as f:
+            f.write(os.urandom(BENCH_FILE_SIZE))
+        return surveys[0].pk
+
+    def teardown(self):
+        UserProfile.objects.filter(username=BENCH_USERNAME).delete()
+        shutil.rmtree(os.path.join(settings.MEDIA_ROOT, BENCH_DIR), ignore_errors=True)
+
+    def run_wsgi(self, url, slow):
+        handler = WSGIHandler()
+        delay = self.options['slow_client_ms'] / 1000 if slow else 0
+        server = ThreadPoolExecutor(max_workers=self.options['workers'])
+
+        def serve(path):
+            status = []
+            result = handler(wsgi_environ(path), lambda s, headers: status.append(s))
+            try:
+                for _ in result:
+                    # 线程池服务器在发送完响应前一直占用该线程
+                    if delay:
+                        time.sleep(delay)
+            finally:
+                result.close()
+            return status[0].startswith('200')
+
+        server.submit(serve, url(-1)).result()
+
+        def client(indexes, latencies, failures):
+            for i in indexes:
+                started = time.perf_counter()
+                if not server.submit(serve, url(i)).result():
+                    failures.append(i)
+                latencies.append(time.perf_counter() - started)
+
+        return self.run_clients(lambda indexes, latencies, failures: threading.Thread(
+            target=client, args=(indexes, latencies, failures)), server)
+
+    def run_asgi(self, url, slow):
+        application = ASGIHandler()
+        delay = self.options['slow_client_ms'] / 1000 if slow else 0
+
+        async def request(path):
+            messages = []
+
+            async def receive():
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    messages.append(message['status'])
+                elif delay and message.get('body'):
+                    await asyncio.sleep(delay)
+
+            await application(asgi_scope(path), receive, send)
+            return messages[0] == 200
+
+        async def client(indexes, latencies, failures):
+            for i in indexes:
+                started = time.perf_counter()
+                if not await request(url(i)):
+                    failures.append(i)
+                latencies.append(time.perf_counter() - started)
+
+        async def main(groups):
+            await request(url(-1))
+            latencies, failures = [], []
+            started = time.perf_counter()
+            await asyncio.gather(*(client(indexes, latencies, failures) for indexes in groups))
+            return time.perf_counter() - started, latencies, failures
+
+        elapsed, latencies, failures = asyncio.run(main(self.client_groups()))
+        return len(latencies) / elapsed, latencies, len(failures)
+
+    def client_groups(self):
+        concurrency = self.options['concurrency']
+        return [range(c, self.options['requests'], concurrency) for c in range(concurrency)]
+
+    def run_clients(self, make_thread, server):
+        latencies, failures = [], []
+        threads = [make_thread(indexes, latencies, failures) for indexes in self.client_groups()]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        server.shutdown()
+        return len(latencies) / elapsed, latencies, len(failures)
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))] * 1000
+
+
+def split(path):
+    parts = urlsplit(path)
+    return parts.path, parts.query
+
+
+def wsgi_environ(path):
+    path, query = split(path)
+    return {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query, 'SCRIPT_NAME': '',
+        'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'HTTP_HOST': 'localhost', 'REMOTE_ADDR': '127.0.0.1',
+        'wsgi.input': io.BytesIO(b''), 'wsgi.url_scheme': 'http', 'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False, 'wsgi.version': (1, 0),
+    }
+
+
+def asgi_scope(path):
+    path, query = split(path)
+    return {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'query_string': query.encode(), 'root_path': '',
+        'headers': [(b'host', b'localhost')], 'client': ('127.0.0.1', 0), 'server': ('localhost', 80),
+    }
@@ -0,0 +1,92 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+
+from myapp.models import UserProfile
+
+BENCH_USERNAME = 'session-bench'
+BENCH_PASSWORD = 'bench-pass-1234'
+
+# (名称, SESSION_ENGINE, SESSION_SAVE_EVERY_REQUEST)
+CONFIGS = [
+    ('db + 每请求保存', 'django.contrib.sessions.backends.db', True),
+    ('db + 间隔续期', 'django.contrib.sessions.backends.db', False),
+    ('cache + 间隔续期', 'django.contrib.sessions.backends.cache', False),
+    ('signed_cookies + 间隔续期', 'django.contrib.sessions.backends.signed_cookies', False),
+]
+
+
+class Command(BaseCommand):
+    help = '并发会话下 /api/auth/user/ 的读吞吐基准，对比各会话配置（在临时测试数据库中运行，不改动现有数据）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=8, help='并发会话数（每个会话一个线程）')
+        parser.add_argument('--requests', type=int, default=200, help='每个会话的请求数')
+
+    def handle(self, *args, **options):
+        # 与 manage.py test 一样切换到单独创建的测试数据库，结束后销毁
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self.bench(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def bench(self, options):
+        UserProfile.objects.create_user(username=BENCH_USERNAME, password=BENCH_PASSWORD)
+        # 登录接口逐次记录日志，基准期间关闭，免得淹没结果
+        logging.disable(logging.INFO)
+        try:
+            self.stdout.write('%-28s %10s %10s %8s' % ('配置', '请求/秒', '会话写入', '失败'))
+            for name, engine, save_every_request in CONFIGS:
+                # 基准需要反复登录，放宽登录限流
+                with override_settings(SESSION_ENGINE=engine, SESSION_SAVE_EVERY_REQUEST=save_every_request,
+                                       LOGIN_RATE_LIMITS={'username': (10 ** 6, 60), 'ip': (10 ** 6, 60)}):
+                    rate, writes, failures = self.run(options['clients'], options['requests'])
+                self.stdout.write('%-28s %10.1f %10d %8d' % (name, rate, writes, failures))
+        finally:
+            logging.disable(logging.NOTSET)
+
+    def run(self, client_count, request_count):
+        clients = []
+        for _ in range(client_count):
+            client = Client(HTTP_HOST='localhost', raise_request_exception=False)
+            response = client.post('/api/auth/session/login/',
+                                   {'username': BENCH_USERNAME, 'password': BENCH_PASSWORD},
+                                   content_type='application/json')
+            if response.status_code != 200:
+                raise RuntimeError('登录失败: %s' % response.content)
+            clients.append(client)
+
+        results = []
+        lock = threading.Lock()
+
+        def worker(client):
+            writes = failures = 0
+            try:
+                for _ in range(request_count):
+                    response = client.get('/api/auth/user/')
+                    if response.status_code != 200:
+                        failures += 1
+                    # 响应重新下发会话 Cookie 即表示会话被保存了一次
+                    if settings.SESSION_COOKIE_NAME in response.cookies:
+                        writes += 1
+            finally:
+                connection.close()
+            with lock:
+                results.append((writes, failures))
+
+        threads = [threading.Thread(target=worker, args=(client,)) for client in clients]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        total = client_count * request_count
+        return total / elapsed, sum(w for w, _ in results), sum(f for _, f in results)
@@ -0,0 +1,52 @@
+import multiprocessing
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from myapp import derivatives
+
+
+def init_worker():
+    # fork 出来的子进程不能复用父进程的数据库连接
+    connections.close_all()
+
+
+def run_job(job_id):
+    try:
+        return job_id, derivatives.process_job(job_id)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = '从数据库任务队列中领取任务，用进程池生成缩略图、封面和波形图'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=multiprocessing.cpu_count(),
+                            help='工作进程数，默认等于 CPU 核数')
+        parser.add_argument('--poll-interval', type=float, default=2.0,
+                            help='队列为空时的轮询间隔（秒）')
+        parser.add_argument('--once', action='store_true',
+                            help='处理完当前队列后退出')
+
+    def handle(self, *args, **options):
+        processes = max(1, options['processes'])
+        connections.close_all()
+        pool = multiprocessing.Pool(processes, initializer=init_worker)
+        self.stdout.write('derivative worker 启动，进程数 %d' % processes)
+        try:
+            while True:
+                job_ids = derivatives.claim_jobs(processes)
+                if not job_ids:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+                for job_id, status in pool.imap_unordered(run_job, job_ids):
+                    self.stdout.write('任务 %s: %s' % (job_id, status))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            pool.close()
+            pool.join()
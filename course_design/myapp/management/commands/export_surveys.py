@@ -0,0 +1,25 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from myapp import export
+
+
+class Command(BaseCommand):
+    help = '流式导出全部调查及媒体资料为 NDJSON / CSV / GeoJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=export.FORMATS, default='ndjson')
+        parser.add_argument('--output', '-o', help='输出文件，默认写到标准输出')
+        parser.add_argument('--no-media', action='store_true', help='不包含媒体列表')
+
+    def handle(self, *args, **options):
+        surveys = export.iter_surveys(include_media=not options['no_media'])
+        # CSV 由 csv 模块控制换行，打开文件时不做换行转换
+        out = open(options['output'], 'w', encoding='utf-8', newline='') if options['output'] else sys.stdout
+        try:
+            for chunk in export.render(options['format'], surveys):
+                out.write(chunk)
+        finally:
+            if out is not sys.stdout:
+                out.close()
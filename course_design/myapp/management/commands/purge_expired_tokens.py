@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from rest_framework.authtoken.models import Token
+
+from myapp.authentication import expiry_cutoff
+
+
+class Command(BaseCommand):
+    help = '删除已过期的认证令牌'
+
+    def handle(self, *args, **options):
+        deleted, _ = Token.objects.filter(created__lt=expiry_cutoff()).delete()
+        self.stdout.write(self.style.SUCCESS('已删除 %d 个过期令牌' % deleted))
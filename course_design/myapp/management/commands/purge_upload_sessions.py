@@ -0,0 +1,41 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from myapp.models import UploadSession
+from myapp.storage import blob_storage
+
+
+class Command(BaseCommand):
+    help = ('删除已过期的未完成上传会话及其暂存文件，'
+            '并删除超过 CHUNKED_UPLOAD_SESSION_TTL 仍没有对应会话的暂存文件（进程中断后残留）')
+
+    def handle(self, *args, **options):
+        sessions = 0
+        for session in UploadSession.objects.filter(status='OPEN', expires_at__lte=timezone.now()).iterator():
+            # 条件删除：同时被提交的会话状态已变，不会删除
+            deleted, _ = UploadSession.objects.filter(
+                pk=session.pk, status='OPEN', expires_at__lte=timezone.now()).delete()
+            if deleted:
+                session.remove_staging_file()
+                sessions += 1
+
+        staging_root = blob_storage.staging_root()
+        open_files = {os.path.basename(session.staging_path)
+                      for session in UploadSession.objects.filter(status='OPEN').only('id')}
+        cutoff = time.time() - settings.CHUNKED_UPLOAD_SESSION_TTL
+        files = 0
+        for name in os.listdir(staging_root) if os.path.isdir(staging_root) else []:
+            path = os.path.join(staging_root, name)
+            if name in open_files or not os.path.isfile(path):
+                continue
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    files += 1
+            except FileNotFoundError:
+                continue
+        self.stdout.write(self.style.SUCCESS('已删除 %d 个过期上传会话、%d 个残留暂存文件' % (sessions, files)))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from myapp import stats
+
+
+class Command(BaseCommand):
+    help = '按原始数据重新计算统计汇总，校正信号增量维护中产生的偏差'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='只报告偏差，不写入')
+
+    def handle(self, *args, **options):
+        drift = stats.reconcile(dry_run=options['dry_run'])
+        for dimension, key, current, expected in drift:
+            self.stdout.write('%s:%s %d -> %d' % (dimension, key, current, expected))
+        verb = '发现' if options['dry_run'] else '已校正'
+        self.stdout.write(self.style.SUCCESS('%s %d 处偏差' % (verb, len(drift))))
@@ -0,0 +1,149 @@
+"""媒体文件的尺寸与时长
+
+上传时（myapp.signals.store_media_blob）和回填命令（backfill_media_metadata）调用，结果保存在 MediaItem 上，
+列表和文件投递直接读取字段，不再访问文件系统。
+常见图片格式和 WAV 直接解析文件头；其余音视频调用 ffprobe，未安装时对应字段留空。
+"""
+import hashlib
+import json
+import logging
+import shutil
+import struct
+import subprocess
+
+from django.conf import settings
+
+from . import uploads
+
+logger = logging.getLogger(__name__)
+
+# 扫描 JPEG 帧头时最多读取的字节数，EXIF 缩略图较大时 SOF 可能在较后的位置
+JPEG_SCAN_LIMIT = 1024 * 1024
+
+FIELDS = ('width', 'height', 'duration')
+
+
+def image_size(f, mime_type):
+    """解析图片文件头，返回 (宽, 高)，不支持的格式返回 None"""
+    f.seek(0)
+    header = f.read(32)
+    if mime_type == 'image/png' and header[12:16] == b'IHDR':
+        return struct.unpack('>II', header[16:24])
+    if mime_type == 'image/gif':
+        return struct.unpack('<HH', header[6:10])
+    if mime_type == 'image/bmp':
+        width, height = struct.unpack('<ii', header[18:26])
+        return width, abs(height)
+    if mime_type == 'image/webp':
+        chunk = header[12:16]
+        if chunk == b'VP8 ':
+            width, height = struct.unpack('<HH', header[26:30])
+            return width & 0x3fff, height & 0x3fff
+        if chunk == b'VP8L':
+            b = header[21:25]
+            return 1 + (((b[1] & 0x3f) << 8) | b[0]), 1 + (((b[3] & 0x0f) << 10) | (b[2] << 2) | (b[1] >> 6))
+        if chunk == b'VP8X':
+            return 1 + int.from_bytes(header[24:27], 'little'), 1 + int.from_bytes(header[27:30], 'little')
+    if mime_type == 'image/jpeg':
+        return jpeg_size(f)
+    return None
+
+
+def jpeg_size(f):
+    """逐个跳过 JPEG 段，读取第一个 SOF 段中的尺寸"""
+    f.seek(2)
+    while f.tell() < JPEG_SCAN_LIMIT:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xff:
+            return None
+        if marker[1] == 0xff:
+            # 填充字节
+            f.seek(-1, 1)
+            continue
+        if marker[1] == 0x01 or 0xd0 <= marker[1] <= 0xd7:
+            continue
+        length = struct.unpack('>H', f.read(2))[0]
+        if 0xc0 <= marker[1] <= 0xcf and marker[1] not in (0xc4, 0xc8, 0xcc):
+            height, width = struct.unpack('>xHH', f.read(5))
+            return width, height
+        f.seek(length - 2, 1)
+    return None
+
+
+def wav_duration(f):
+    """按 fmt 块的字节率和 data 块的长度计算 WAV 时长（秒）"""
+    f.seek(12)
+    byte_rate = None
+    while True:
+        chunk = f.read(8)
+        if len(chunk) < 8:
+            return None
+        chunk_id, length = struct.unpack('<4sI', chunk)
+        if chunk_id == b'fmt ':
+            byte_rate = struct.unpack('<8xI', f.read(12))[0]
+            f.seek(length - 12 + (length & 1), 1)
+        elif chunk_id == b'data':
+            return length / byte_rate if byte_rate else None
+        else:
+            f.seek(length + (length & 1), 1)
+
+
+def ffprobe(path):
+    """调用 ffprobe 读取时长和视频尺寸，失败时返回空字典"""
+    binary = shutil.which(settings.FFPROBE_BINARY)
+    if binary is None:
+        return {}
+    try:
+        result = subprocess.run(
+            [binary, '-v', 'error', '-print_format', 'json', '-show_format', '-show_streams', path],
+            check=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=60)
+        data = json.loads(result.stdout)
+    except (subprocess.SubprocessError, OSError, ValueError) as e:
+        logger.warning('ffprobe 读取失败 %s: %s', path, e)
+        return {}
+    info = {}
+    duration = data.get('format', {}).get('duration')
+    if duration not in (None, 'N/A'):
+        info['duration'] = float(duration)
+    for stream in data.get('streams', []):
+        if stream.get('codec_type') == 'video' and stream.get('width'):
+            info['width'], info['height'] = stream['width'], stream['height']
+            break
+    return info
+
+
+def probe(path, mime_type):
+    """返回 {'width', 'height', 'duration'}，无法得出的为 None"""
+    info = dict.fromkeys(FIELDS)
+    kind = (mime_type or '').split('/')[0]
+    try:
+        with open(path, 'rb') as f:
+            if kind == 'image':
+                size = image_size(f, mime_type)
+                if size is not None:
+                    info['width'], info['height'] = size
+            elif mime_type == 'audio/wav':
+                info['duration'] = wav_duration(f)
+    except (OSError, struct.error, ZeroDivisionError) as e:
+        logger.warning('解析媒体文件失败 %s: %s', path, e)
+    if kind == 'video' or (kind == 'audio' and info['duration'] is None):
+        info.update(ffprobe(path))
+    return info
+
+
+def describe(path):
+    """读取整个文件，得出 MediaItem 上的全部元数据字段（回填用）"""
+    sha256 = hashlib.sha256()
+    size = 0
+    header = b''
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(uploads.CHUNK_SIZE)
+            if not data:
+                break
+            if len(header) < uploads.HEADER_SIZE:
+                header += data[:uploads.HEADER_SIZE - len(header)]
+            sha256.update(data)
+            size += len(data)
+    mime_type = uploads.sniff(header) or ''
+    return dict(probe(path, mime_type), mime_type=mime_type, file_size=size, checksum=sha256.hexdigest())
@@ -0,0 +1,382 @@
+"""请求级性能指标
+
+RequestMetricsMiddleware 按视图（URL 名称）记录请求数、耗时直方图、SQL 条数与耗时、请求体和响应体字节数。
+每个进程在内存中累计，由后台线程每隔 METRICS_FLUSH_INTERVAL 写入 METRICS_DIR/<pid>-<启动时间>.json，
+请求路径上（包括 ASGI 的事件循环）不写文件；文件名带上启动时间，PID 被复用时新进程不会覆盖旧进程的累计值。
+/metrics 合并目录下所有进程的文件，输出 Prometheus 文本格式。POSIX 上读取时把已退出进程的文件并入 retired.json
+后删除，计数不会因进程退出而回落；其他平台上这些文件保留，需要时在所有工作进程停止后清空该目录。
+
+SQL 通过数据库连接的 execute_wrapper 计入当前请求：当前请求保存在 contextvar 中，
+ASGI 下在 myapp.aio 线程池执行的查询同样能计入（run_in 会带上调用方的 context）。
+设置 SLOW_REQUEST_THRESHOLD 后，超时的请求连同最慢的几条 SQL 写入 myapp.slow_requests 日志。
+
+/metrics 只对以下请求开放：带 Authorization: Bearer <METRICS_TOKEN>、管理员会话、来自 METRICS_ALLOWED_IPS。
+经反向代理部署时 REMOTE_ADDR 都是代理的地址，METRICS_ALLOWED_IPS 应留空，改用 METRICS_TOKEN。
+"""
+import asyncio
+import atexit
+import contextvars
+import glob
+import hmac
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from django.conf import settings
+from django.utils.deprecation import MiddlewareMixin
+
+slow_logger = logging.getLogger('myapp.slow_requests')
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRICS = {
+    'http_requests_total': ('counter', '请求数'),
+    'http_request_duration_seconds': ('histogram', '请求处理耗时（秒），流式响应不含发送时间'),
+    'http_request_db_queries_total': ('counter', '执行的 SQL 条数'),
+    'http_request_db_seconds_total': ('counter', 'SQL 执行总耗时（秒）'),
+    'http_request_bytes_total': ('counter', '请求体字节数（上传）'),
+    'http_response_bytes_total': ('counter', '响应体字节数'),
+}
+
+RETIRED_FILE = 'retired.json'
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    """一个请求执行的 SQL 统计；只在需要写慢请求日志时保留 SQL 文本"""
+
+    def __init__(self, keep_sql=False):
+        self.queries = 0
+        self.query_time = 0.0
+        self.statements = [] if keep_sql else None
+
+
+def record_query(execute, sql, params, many, context):
+    current = _current.get()
+    if current is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        current.queries += 1
+        current.query_time += elapsed
+        if current.statements is not None:
+            current.statements.append((elapsed, sql))
+
+
+def install(connection):
+    """为新建的数据库连接挂上 record_query（见 myapp.signals）"""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_query)
+
+
+class Registry:
+    """本进程累计的指标"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flusher = None
+        self.reset()
+
+    def reset(self):
+        self.pid = os.getpid()
+        self.started = time.time_ns()
+        self.counters = defaultdict(float)
+        self.histograms = {}
+        self.dirty = False
+
+    @property
+    def filename(self):
+        return '%d-%d.json' % (self.pid, self.started)
+
+    def check_fork(self):
+        # fork 出的子进程从父进程继承了计数，清零后单独累计，避免重复计算；父进程的写入线程不会带到子进程
+        if self.pid != os.getpid():
+            self.reset()
+            self.flusher = None
+
+    def start_flusher(self):
+        if self.flusher is None:
+            self.flusher = threading.Thread(target=self.run_flusher, name='metrics-flush', daemon=True)
+            self.flusher.start()
+
+    def run_flusher(self):
+        while True:
+            time.sleep(settings.METRICS_FLUSH_INTERVAL)
+            if self.dirty:
+                self.flush()
+
+    def inc(self, name, labels, value=1):
+        self.counters[(name, labels)] += value
+
+    def observe(self, name, labels, value):
+        histogram = self.histograms.get((name, labels))
+        if histogram is None:
+            histogram = self.histograms[(name, labels)] = [[0] * len(DURATION_BUCKETS), 0.0, 0]
+        for i, bound in enumerate(DURATION_BUCKETS):
+            if value <= bound:
+                histogram[0][i] += 1
+                break
+        histogram[1] += value
+        histogram[2] += 1
+
+    def record(self, view, method, status, duration, metrics, request_bytes, response_bytes):
+        with self.lock:
+            self.check_fork()
+            labels = (('view', view), ('method', method))
+            self.inc('http_requests_total', labels + (('status', str(status)),))
+            self.observe('http_request_duration_seconds', labels, duration)
+            view_labels = (('view', view),)
+            self.inc('http_request_db_queries_total', view_labels, metrics.queries)
+            self.inc('http_request_db_seconds_total', view_labels, metrics.query_time)
+            self.inc('http_request_bytes_total', view_labels, request_bytes)
+            self.inc('http_response_bytes_total', view_labels, response_bytes)
+            self.dirty = True
+            self.start_flusher()
+
+    def add_response_bytes(self, view, size):
+        """流式响应发送完毕后补记字节数"""
+        with self.lock:
+            self.check_fork()
+            self.inc('http_response_bytes_total', (('view', view),), size)
+            self.dirty = True
+            self.start_flusher()
+
+    def flush(self):
+        """写入本进程的文件，由写入线程定期调用，/metrics 读取前也会调用"""
+        with self.lock:
+            self.check_fork()
+            self.dirty = False
+            data = as_snapshot(self.counters, self.histograms)
+            filename = self.filename
+        write_file(filename, data)
+
+
+registry = Registry()
+
+
+@atexit.register
+def flush_at_exit():
+    if registry.dirty and registry.pid == os.getpid():
+        registry.flush()
+
+
+def write_file(filename, data):
+    """先写临时文件再替换，读取方不会读到半个文件"""
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=settings.METRICS_DIR, prefix='.tmp-')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    os.replace(path, os.path.join(settings.METRICS_DIR, filename))
+
+
+def process_exited(filename):
+    """文件名中的进程是否已退出；无法判断时视为仍在运行"""
+    pid = filename.split('-', 1)[0].split('.', 1)[0]
+    if fcntl is None or not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except OSError:
+        return False
+    return False
+
+
+def merge(data, counters, histograms):
+    for name, labels, value in data['counters']:
+        counters[(name, tuple(sorted(labels.items())))] += value
+    for name, labels, buckets, total, count in data['histograms']:
+        key = (name, tuple(sorted(labels.items())))
+        merged = histograms.setdefault(key, [[0] * len(DURATION_BUCKETS), 0.0, 0])
+        merged[0] = [a + b for a, b in zip(merged[0], buckets)]
+        merged[1] += total
+        merged[2] += count
+
+
+def as_snapshot(counters, histograms):
+    return {
+        'counters': [[name, dict(labels), value] for (name, labels), value in counters.items()],
+        'histograms': [[name, dict(labels)] + [list(h[0]), h[1], h[2]] for (name, labels), h in histograms.items()],
+    }
+
+
+def read_file(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def collect():
+    """合并所有进程的指标，并把已退出进程的文件并入 RETIRED_FILE
+
+    合并在目录锁内进行：并入与删除之间，其他读取方不会既读不到旧文件又读不到 RETIRED_FILE 中的新值。
+    """
+    registry.flush()
+    if fcntl is None:
+        return read_all(retire=False)
+    with open(os.path.join(settings.METRICS_DIR, '.lock'), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return read_all(retire=True)
+
+
+def read_all(retire):
+    counters = defaultdict(float)
+    histograms = {}
+    retired_counters = defaultdict(float)
+    retired_histograms = {}
+    exited = []
+    for path in glob.glob(os.path.join(settings.METRICS_DIR, '*.json')):
+        data = read_file(path)
+        if data is None:
+            continue
+        merge(data, counters, histograms)
+        name = os.path.basename(path)
+        if retire and (name == RETIRED_FILE or process_exited(name)):
+            merge(data, retired_counters, retired_histograms)
+            if name != RETIRED_FILE:
+                exited.append(path)
+    if exited:
+        write_file(RETIRED_FILE, as_snapshot(retired_counters, retired_histograms))
+        for path in exited:
+            os.remove(path)
+    return counters, histograms
+
+
+def format_labels(labels):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{%s}' % ','.join('%s="%s"' % (k, escape(v)) for k, v in labels) if labels else ''
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else '%d' % value
+
+
+def render():
+    """Prometheus 文本格式（0.0.4）"""
+    counters, histograms = collect()
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        lines.append('# HELP %s %s' % (name, help_text))
+        lines.append('# TYPE %s %s' % (name, kind))
+        if kind == 'counter':
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append('%s%s %s' % (name, format_labels(labels), format_value(value)))
+            continue
+        for (metric, labels), (buckets, total, count) in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, n in zip(DURATION_BUCKETS, buckets):
+                cumulative += n
+                lines.append('%s_bucket%s %d' % (name, format_labels(labels + (('le', repr(bound)),)), cumulative))
+            lines.append('%s_bucket%s %d' % (name, format_labels(labels + (('le', '+Inf'),)), count))
+            lines.append('%s_sum%s %s' % (name, format_labels(labels), format_value(total)))
+            lines.append('%s_count%s %d' % (name, format_labels(labels), count))
+    return '\n'.join(lines) + '\n'
+
+
+def scrape_allowed(request):
+    """是否允许读取 /metrics"""
+    token = settings.METRICS_TOKEN
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    if token and authorization.startswith('Bearer ') and \
+            hmac.compare_digest(authorization[len('Bearer '):].encode(), token.encode()):
+        return True
+    if request.user.is_staff:
+        return True
+    return request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return '<unresolved>'
+    return match.view_name or match.route or '<unnamed>'
+
+
+def counting(content, view):
+    """包装未声明 Content-Length 的流式响应，发送完毕后记录字节数"""
+    size = 0
+    try:
+        for chunk in content:
+            size += len(chunk)
+            yield chunk
+    finally:
+        registry.add_response_bytes(view, size)
+
+
+class RequestMetricsMiddleware(MiddlewareMixin):
+    """记录每个请求的指标，应放在 MIDDLEWARE 的最前面以计入其余中间件的耗时
+
+    与 SlidingSessionMiddleware 一样同时支持同步和异步调用。
+    """
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        metrics, token, started = self.begin()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics, started)
+
+    async def __acall__(self, request):
+        metrics, token, started = self.begin()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics, started)
+
+    def begin(self):
+        metrics = RequestMetrics(keep_sql=settings.SLOW_REQUEST_THRESHOLD is not None)
+        return metrics, _current.set(metrics), time.perf_counter()
+
+    def finish(self, request, response, metrics, started):
+        duration = time.perf_counter() - started
+        view = view_name(request)
+        try:
+            request_bytes = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            request_bytes = 0
+        if not response.streaming:
+            response_bytes = len(response.content)
+        elif response.has_header('Content-Length'):
+            response_bytes = int(response['Content-Length'])
+        else:
+            response_bytes = 0
+            response.streaming_content = counting(response.streaming_content, view)
+        registry.record(view, request.method, response.status_code, duration, metrics,
+                        request_bytes, response_bytes)
+
+        threshold = settings.SLOW_REQUEST_THRESHOLD
+        if threshold is not None and duration >= threshold:
+            log_slow_request(request, view, response.status_code, duration, metrics)
+        return response
+
+
+def log_slow_request(request, view, status, duration, metrics):
+    slowest = sorted(metrics.statements, reverse=True)[:settings.SLOW_REQUEST_SQL_LIMIT]
+    slow_logger.warning(
+        '慢请求 %s %s (%s) %d 耗时 %.3fs，SQL %d 条共 %.3fs%s',
+        request.method, request.get_full_path(), view, status, duration, metrics.queries, metrics.query_time,
+        ''.join('\n  %.3fs %s' % (elapsed, sql) for elapsed, sql in slowest))
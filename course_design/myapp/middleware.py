@@ -0,0 +1,31 @@
+"""项目中间件"""
+import time
+
+from django.conf import settings
+from django.utils.deprecation import MiddlewareMixin
+
+SESSION_REFRESHED_KEY = '_refreshed_at'
+
+
+def mark_session_refreshed(session):
+    """记录刷新时间，修改会话使其在本次响应中保存并重新计算过期时间"""
+    session[SESSION_REFRESHED_KEY] = int(time.time())
+
+
+class SlidingSessionMiddleware(MiddlewareMixin):
+    """会话滑动过期
+
+    SESSION_SAVE_EVERY_REQUEST 会让每个请求都写一次会话。这里改为只在距上次刷新超过
+    SESSION_REFRESH_INTERVAL 秒时才修改会话，由 SessionMiddleware 保存并续期 Cookie；
+    间隔内的读请求不产生任何写入。须放在 SessionMiddleware 之后。
+    基于 MiddlewareMixin 同时支持同步和异步调用，ASGI 下不会迫使整个中间件链退回同步模式。
+    """
+
+    def process_request(self, request):
+        # 没有会话 Cookie 的请求不加载会话
+        if settings.SESSION_COOKIE_NAME in request.COOKIES:
+            session = request.session
+            if session.keys():
+                refreshed_at = session.get(SESSION_REFRESHED_KEY, 0)
+                if time.time() - refreshed_at >= settings.SESSION_REFRESH_INTERVAL:
+                    mark_session_refreshed(session)
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0003_auto_20241209_2327'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='survey',
+            index=models.Index(fields=['-created_at', '-id'], name='survey_created_id_idx'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+import myapp.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0004_survey_created_id_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True, verbose_name='SHA-256')),
+                ('file', models.FileField(max_length=255, storage=myapp.storage.ContentAddressedStorage(), upload_to='', verbose_name='文件')),
+                ('size', models.BigIntegerField(verbose_name='文件大小')),
+                ('ref_count', models.PositiveIntegerField(default=0, verbose_name='引用数')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+            ],
+            options={
+                'verbose_name': '媒体文件',
+                'verbose_name_plural': '媒体文件',
+            },
+        ),
+        migrations.AlterField(
+            model_name='mediaitem',
+            name='file_path',
+            field=models.FileField(max_length=255, upload_to='survey_files/%Y/%m/', verbose_name='文件路径'),
+        ),
+        migrations.AddField(
+            model_name='mediaitem',
+            name='blob',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='media_items', to='myapp.mediablob', verbose_name='文件内容'),
+        ),
+    ]
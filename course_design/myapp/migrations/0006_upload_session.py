@@ -0,0 +1,49 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0005_mediablob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('title', models.CharField(max_length=200, verbose_name='标题')),
+                ('description', models.TextField(blank=True, verbose_name='描述')),
+                ('media_type', models.CharField(choices=[('IMAGE', '图片'), ('AUDIO', '音频'), ('VIDEO', '视频'), ('DOCUMENT', '文档')], max_length=10, verbose_name='媒体类型')),
+                ('category', models.CharField(choices=[('FOLKLORE', '风土人情'), ('INTERVIEW', '访谈记录'), ('LITERATURE', '文献资料')], max_length=10, verbose_name='资料分类')),
+                ('filename', models.CharField(max_length=255, verbose_name='原始文件名')),
+                ('total_size', models.BigIntegerField(verbose_name='文件大小')),
+                ('chunk_size', models.PositiveIntegerField(verbose_name='分块大小')),
+                ('status', models.CharField(choices=[('OPEN', '上传中'), ('COMMITTED', '已完成')], default='OPEN', max_length=10, verbose_name='状态')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+                ('media_item', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='myapp.mediaitem', verbose_name='媒体资料')),
+                ('survey', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='upload_sessions', to='myapp.survey', verbose_name='所属调查')),
+            ],
+            options={
+                'verbose_name': '上传会话',
+                'verbose_name_plural': '上传会话',
+            },
+        ),
+        migrations.CreateModel(
+            name='UploadChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveIntegerField(verbose_name='分块序号')),
+                ('sha256', models.CharField(max_length=64, verbose_name='SHA-256')),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='myapp.uploadsession', verbose_name='上传会话')),
+            ],
+            options={
+                'unique_together': {('session', 'index')},
+            },
+        ),
+    ]
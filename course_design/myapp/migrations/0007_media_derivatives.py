@@ -0,0 +1,52 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0006_upload_session'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DerivativeJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('PENDING', '等待中'), ('RUNNING', '处理中'), ('DONE', '已完成'), ('FAILED', '失败')], default='PENDING', max_length=10, verbose_name='状态')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='尝试次数')),
+                ('error', models.TextField(blank=True, verbose_name='错误信息')),
+                ('locked_at', models.DateTimeField(blank=True, null=True, verbose_name='领取时间')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+                ('media_item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='derivative_jobs', to='myapp.mediaitem', verbose_name='媒体资料')),
+            ],
+            options={
+                'verbose_name': '衍生任务',
+                'verbose_name_plural': '衍生任务',
+            },
+        ),
+        migrations.CreateModel(
+            name='MediaDerivative',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('variant', models.CharField(choices=[('thumb', '缩略图'), ('web', '网页尺寸'), ('poster', '视频封面'), ('waveform', '音频波形')], max_length=10, verbose_name='版本')),
+                ('file', models.FileField(max_length=255, upload_to='derivatives/%Y/%m/', verbose_name='文件')),
+                ('width', models.PositiveIntegerField(verbose_name='宽度')),
+                ('height', models.PositiveIntegerField(verbose_name='高度')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('media_item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='derivatives', to='myapp.mediaitem', verbose_name='媒体资料')),
+            ],
+            options={
+                'verbose_name': '衍生文件',
+                'verbose_name_plural': '衍生文件',
+                'unique_together': {('media_item', 'variant')},
+            },
+        ),
+        migrations.AddIndex(
+            model_name='derivativejob',
+            index=models.Index(fields=['status', 'created_at'], name='derivjob_status_idx'),
+        ),
+    ]
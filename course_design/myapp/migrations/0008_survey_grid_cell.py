@@ -0,0 +1,36 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:26
+
+from django.db import migrations, models
+
+
+def fill_grid_cells(apps, schema_editor):
+    from myapp.geo import grid_cell
+    Survey = apps.get_model('myapp', 'Survey')
+    for survey in Survey.objects.only('id', 'longitude', 'latitude').iterator():
+        grid_x, grid_y = grid_cell(survey.longitude, survey.latitude)
+        Survey.objects.filter(pk=survey.pk).update(grid_x=grid_x, grid_y=grid_y)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0007_media_derivatives'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='survey',
+            name='grid_x',
+            field=models.IntegerField(default=0, editable=False, verbose_name='网格X'),
+        ),
+        migrations.AddField(
+            model_name='survey',
+            name='grid_y',
+            field=models.IntegerField(default=0, editable=False, verbose_name='网格Y'),
+        ),
+        migrations.AddIndex(
+            model_name='survey',
+            index=models.Index(fields=['grid_y', 'grid_x'], name='survey_grid_idx'),
+        ),
+        migrations.RunPython(fill_grid_cells, migrations.RunPython.noop),
+    ]
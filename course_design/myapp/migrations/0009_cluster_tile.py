@@ -0,0 +1,29 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0008_survey_grid_cell'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClusterTile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('zoom', models.PositiveSmallIntegerField(verbose_name='缩放级别')),
+                ('tile_x', models.IntegerField(verbose_name='瓦片X')),
+                ('tile_y', models.IntegerField(verbose_name='瓦片Y')),
+                ('clusters', models.JSONField(default=list, verbose_name='聚合结果')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+            ],
+            options={
+                'verbose_name': '聚合瓦片',
+                'verbose_name_plural': '聚合瓦片',
+                'unique_together': {('zoom', 'tile_x', 'tile_y')},
+            },
+        ),
+    ]
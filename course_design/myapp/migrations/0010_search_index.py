@@ -0,0 +1,68 @@
+import re
+
+from django.db import migrations
+
+# 迁移写入索引时的分词规则（myapp.search 当时的版本），此处保留副本，
+# 以后修改 myapp.search 不会改变本迁移的行为；规则变化时由新的迁移重建索引
+CJK_RE = re.compile(r'[㐀-䶿一-鿿豈-﫿]+')
+TOKEN_RE = re.compile(r'[㐀-䶿一-鿿豈-﫿]+|[^\W_]+')
+
+
+def tokenize(text):
+    tokens = []
+    for match in TOKEN_RE.finditer(text or ''):
+        word = match.group()
+        if CJK_RE.fullmatch(word):
+            if len(word) == 1:
+                tokens.append(word)
+            else:
+                tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+        else:
+            tokens.append(word.lower())
+    return tokens
+
+
+def cjk_chars(text):
+    return [c for run in CJK_RE.findall(text or '') for c in run]
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE myapp_search_index USING fts5("
+        "kind UNINDEXED, survey_id UNINDEXED, title, body, chars, "
+        "tokenize='unicode61 remove_diacritics 2')"
+    )
+    Survey = apps.get_model('myapp', 'Survey')
+    MediaItem = apps.get_model('myapp', 'MediaItem')
+    rows = [
+        (s.pk * 2, 'survey', s.pk, s.name, '')
+        for s in Survey.objects.only('id', 'name').iterator()
+    ] + [
+        (m.pk * 2 + 1, 'media', m.survey_id, m.title, m.description)
+        for m in MediaItem.objects.only('id', 'survey_id', 'title', 'description').iterator()
+    ]
+    with schema_editor.connection.cursor() as cursor:
+        for rowid, kind, survey_id, title, body in rows:
+            cursor.execute(
+                'INSERT INTO myapp_search_index (rowid, kind, survey_id, title, body, chars) '
+                'VALUES (%s, %s, %s, %s, %s, %s)',
+                [rowid, kind, survey_id, ' '.join(tokenize(title)), ' '.join(tokenize(body)),
+                 ' '.join(cjk_chars(title) + cjk_chars(body))])
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS myapp_search_index')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0009_cluster_tile'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
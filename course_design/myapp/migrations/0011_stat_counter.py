@@ -0,0 +1,45 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:38
+
+from django.db import migrations, models
+
+
+def fill_stat_counters(apps, schema_editor):
+    from myapp.stats import compute
+    StatCounter = apps.get_model('myapp', 'StatCounter')
+    counters = compute(apps.get_model('myapp', 'Survey'), apps.get_model('myapp', 'MediaItem'))
+    StatCounter.objects.bulk_create(
+        [StatCounter(dimension=dimension, key=key, value=value)
+         for (dimension, key), value in counters.items() if value],
+        batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0010_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dimension', models.CharField(max_length=20, verbose_name='维度')),
+                ('key', models.CharField(max_length=64, verbose_name='键')),
+                ('value', models.BigIntegerField(default=0, verbose_name='值')),
+            ],
+            options={
+                'verbose_name': '统计计数',
+                'verbose_name_plural': '统计计数',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='statcounter',
+            index=models.Index(fields=['dimension', '-value'], name='statcounter_rank_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='statcounter',
+            unique_together={('dimension', 'key')},
+        ),
+        migrations.RunPython(fill_stat_counters, migrations.RunPython.noop),
+    ]
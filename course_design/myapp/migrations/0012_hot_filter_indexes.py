@@ -0,0 +1,50 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:46
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0011_stat_counter'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='mediaitem',
+            index=models.Index(fields=['survey', 'media_type', 'category'], name='mediaitem_survey_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mediaitem',
+            index=models.Index(fields=['media_type', 'category'], name='mediaitem_type_category_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mediaitem',
+            index=models.Index(fields=['category'], name='mediaitem_category_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='survey',
+            index=models.Index(fields=['investigator', '-created_at', '-id'], name='survey_investigator_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='survey',
+            index=models.Index(fields=['start_date', 'end_date'], name='survey_period_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='survey',
+            index=models.Index(fields=['end_date'], name='survey_end_date_idx'),
+        ),
+        # 先建复合索引，再删除被其前缀覆盖的外键单列索引
+        migrations.AlterField(
+            model_name='mediaitem',
+            name='survey',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='media_items', to='myapp.survey', verbose_name='所属调查'),
+        ),
+        migrations.AlterField(
+            model_name='survey',
+            name='investigator',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='调查人'),
+        ),
+    ]
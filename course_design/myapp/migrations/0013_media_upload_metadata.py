@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0012_hot_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediaitem',
+            name='checksum',
+            field=models.CharField(blank=True, editable=False, max_length=64, verbose_name='SHA-256'),
+        ),
+        migrations.AddField(
+            model_name='mediaitem',
+            name='file_size',
+            field=models.BigIntegerField(blank=True, editable=False, null=True, verbose_name='文件大小'),
+        ),
+        migrations.AddField(
+            model_name='mediaitem',
+            name='mime_type',
+            field=models.CharField(blank=True, editable=False, max_length=100, verbose_name='MIME 类型'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 3.2.25 on 2026-10-18 18:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0013_media_upload_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediaitem',
+            name='duration',
+            field=models.FloatField(blank=True, editable=False, null=True, verbose_name='时长（秒）'),
+        ),
+        migrations.AddField(
+            model_name='mediaitem',
+            name='height',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='高度'),
+        ),
+        migrations.AddField(
+            model_name='mediaitem',
+            name='width',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='宽度'),
+        ),
+        migrations.AddIndex(
+            model_name='mediaitem',
+            index=models.Index(fields=['file_path'], name='mediaitem_file_path_idx'),
+        ),
+    ]
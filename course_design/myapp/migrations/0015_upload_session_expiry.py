@@ -0,0 +1,21 @@
+# Generated by Django 3.2.25 on 2026-10-19 02:50
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0014_media_dimensions'),
+    ]
+
+    operations = [
+        # 已有的未完成会话视为已过期，由 purge_upload_sessions 清理
+        migrations.AddField(
+            model_name='uploadsession',
+            name='expires_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='过期时间'),
+            preserve_default=False,
+        ),
+    ]
@@ -1,6 +1,16 @@
-from django.db import models
+import datetime
+import os
+import uuid
+
+from django.conf import settings
+from django.db import connections, models, transaction, IntegrityError
+from django.db.models import F
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth.base_user import BaseUserManager
+from django.utils import timezone
+
+from . import geo
+from .storage import blob_storage
 
 class UserManager(BaseUserManager):
     def create_user(self, username, display_name, password=None, **extra_fields):
@@ -36,13 +46,94 @@ class Survey(models.Model):
     latitude = models.FloatField(verbose_name='纬度')
     start_date = models.DateField(verbose_name='开始日期')
     end_date = models.DateField(verbose_name='结束日期')
-    investigator = models.ForeignKey(UserProfile, on_delete=models.CASCADE, verbose_name='调查人')
+    # 单列索引由 survey_investigator_idx 的前缀代替
+    investigator = models.ForeignKey(UserProfile, on_delete=models.CASCADE, db_index=False, verbose_name='调查人')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')
+    # 空间索引网格，由经纬度计算得出，见 myapp.geo
+    grid_x = models.IntegerField(default=0, editable=False, verbose_name='网格X')
+    grid_y = models.IntegerField(default=0, editable=False, verbose_name='网格Y')
+
+    class Meta:
+        indexes = [
+            # 游标分页按 (created_at, id) 倒序取数
+            models.Index(fields=['-created_at', '-id'], name='survey_created_id_idx'),
+            models.Index(fields=['grid_y', 'grid_x'], name='survey_grid_idx'),
+            # 按调查人过滤并按创建时间倒序（我的调查、调查人筛选）
+            models.Index(fields=['investigator', '-created_at', '-id'], name='survey_investigator_idx'),
+            # 调查时间段的重叠查询（start_date <= 结束 且 end_date >= 开始）及后台日期筛选
+            models.Index(fields=['start_date', 'end_date'], name='survey_period_idx'),
+            models.Index(fields=['end_date'], name='survey_end_date_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+    def update_grid_cell(self):
+        self.grid_x, self.grid_y = geo.grid_cell(self.longitude, self.latitude)
+
+    def save(self, *args, **kwargs):
+        self.update_grid_cell()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'longitude', 'latitude'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'grid_x', 'grid_y'}
+        super().save(*args, **kwargs)
+
+class MediaBlobManager(models.Manager):
+    def acquire(self, content):
+        """保存上传内容并返回对应的 MediaBlob，内容相同时复用已有文件并增加引用"""
+        staged = blob_storage.stage(content)
+        name = None
+        try:
+            while True:
+                # 单条 UPDATE 原子地增加引用，与 release 中的条件删除互斥
+                with transaction.atomic():
+                    if self.filter(sha256=staged.digest).update(ref_count=F('ref_count') + 1):
+                        return self.get(sha256=staged.digest)
+                if name is None:
+                    name = blob_storage.blob_name(staged.digest, content.name)
+                    blob_storage.commit(staged, name)
+                try:
+                    with transaction.atomic():
+                        blob = self.create(sha256=staged.digest, file=name, size=staged.size, ref_count=1)
+                except IntegrityError:
+                    # 并发上传了相同内容，改为引用对方的记录
+                    continue
+                staged.owned = False
+                return blob
+        finally:
+            blob_storage.discard(staged)
+
+    def release(self, blob_id):
+        """减少引用，归零时删除记录并在事务提交后删除文件"""
+        with transaction.atomic():
+            self.filter(pk=blob_id, ref_count__gt=0).update(ref_count=F('ref_count') - 1)
+            blob = self.filter(pk=blob_id, ref_count__lte=0).first()
+            if blob is None:
+                return
+            # 条件删除：若期间有新的引用，ref_count 已大于 0，不会删除
+            deleted, _ = self.filter(pk=blob_id, ref_count__lte=0).delete()
+            if deleted:
+                name = blob.file.name
+                transaction.on_commit(lambda: blob_storage.delete(name))
+
+class MediaBlob(models.Model):
+    """按内容去重的媒体文件，多个 MediaItem 可共享同一份文件"""
+    sha256 = models.CharField(max_length=64, unique=True, verbose_name='SHA-256')
+    file = models.FileField(storage=blob_storage, max_length=255, verbose_name='文件')
+    size = models.BigIntegerField(verbose_name='文件大小')
+    ref_count = models.PositiveIntegerField(default=0, verbose_name='引用数')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
+
+    objects = MediaBlobManager()
+
+    class Meta:
+        verbose_name = '媒体文件'
+        verbose_name_plural = verbose_name
+
+    def __str__(self):
+        return self.sha256
+
 class MediaItem(models.Model):
     """媒体资料模型"""
     MEDIA_TYPES = (
@@ -58,13 +149,254 @@ class MediaItem(models.Model):
         ('LITERATURE', '文献资料'),
     )
 
-    survey = models.ForeignKey(Survey, on_delete=models.CASCADE, related_name='media_items', verbose_name='所属调查')
+    # 单列索引由 mediaitem_survey_type_idx 的前缀代替
+    survey = models.ForeignKey(Survey, on_delete=models.CASCADE, related_name='media_items', db_index=False,
+                               verbose_name='所属调查')
     title = models.CharField(max_length=200, verbose_name='标题')
     description = models.TextField(blank=True, verbose_name='描述')
     media_type = models.CharField(max_length=10, choices=MEDIA_TYPES, verbose_name='媒体类型')
     category = models.CharField(max_length=10, choices=CATEGORY_TYPES, verbose_name='资料分类')
-    file_path = models.FileField(upload_to='survey_files/%Y/%m/', verbose_name='文件路径')
+    file_path = models.FileField(upload_to='survey_files/%Y/%m/', max_length=255, verbose_name='文件路径')
+    blob = models.ForeignKey(MediaBlob, null=True, blank=True, editable=False, on_delete=models.PROTECT,
+                             related_name='media_items', verbose_name='文件内容')
+    # 上传时按文件内容得出（见 myapp.uploads），不信任客户端声明
+    mime_type = models.CharField(max_length=100, blank=True, editable=False, verbose_name='MIME 类型')
+    file_size = models.BigIntegerField(null=True, blank=True, editable=False, verbose_name='文件大小')
+    checksum = models.CharField(max_length=64, blank=True, editable=False, verbose_name='SHA-256')
+    # 见 myapp.mediainfo，无法得出时为空
+    width = models.PositiveIntegerField(null=True, blank=True, editable=False, verbose_name='宽度')
+    height = models.PositiveIntegerField(null=True, blank=True, editable=False, verbose_name='高度')
+    duration = models.FloatField(null=True, blank=True, editable=False, verbose_name='时长（秒）')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
-    
+
+    class Meta:
+        indexes = [
+            # 按调查列出媒体，可再按类型、分类过滤（媒体列表、打包下载）
+            models.Index(fields=['survey', 'media_type', 'category'], name='mediaitem_survey_type_idx'),
+            # 不限调查的类型 / 分类筛选（后台 list_filter、媒体列表过滤）
+            models.Index(fields=['media_type', 'category'], name='mediaitem_type_category_idx'),
+            models.Index(fields=['category'], name='mediaitem_category_idx'),
+            # 投递媒体文件时按路径取元数据
+            models.Index(fields=['file_path'], name='mediaitem_file_path_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        """pre_save 信号（signals.store_media_blob）取得的文件引用与写入同在一个事务中，保存失败时一并回滚"""
+        try:
+            with transaction.atomic():
+                super().save(*args, **kwargs)
+        except Exception:
+            name = self.blob.file.name if self.blob_id else None
+            if name and not MediaBlob.objects.filter(file=name).exists():
+                # 新建的 MediaBlob 已随事务回滚，但文件已移入去重存储
+                blob_storage.delete(name)
+            raise
+
     def __str__(self):
         return self.title
+
+class UploadSession(models.Model):
+    """分块断点续传的上传会话
+
+    分块直接写入暂存文件的对应偏移处，提交时该文件被重命名进去重存储，
+    不会再复制一遍完整内容。暂存文件按完整大小预先分配，超过 expires_at 仍未提交的会话
+    由 purge_upload_sessions 命令连同暂存文件删除。
+    """
+    STATUS_CHOICES = (
+        ('OPEN', '上传中'),
+        ('COMMITTED', '已完成'),
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    survey = models.ForeignKey(Survey, on_delete=models.CASCADE, related_name='upload_sessions', verbose_name='所属调查')
+    title = models.CharField(max_length=200, verbose_name='标题')
+    description = models.TextField(blank=True, verbose_name='描述')
+    media_type = models.CharField(max_length=10, choices=MediaItem.MEDIA_TYPES, verbose_name='媒体类型')
+    category = models.CharField(max_length=10, choices=MediaItem.CATEGORY_TYPES, verbose_name='资料分类')
+    filename = models.CharField(max_length=255, verbose_name='原始文件名')
+    total_size = models.BigIntegerField(verbose_name='文件大小')
+    chunk_size = models.PositiveIntegerField(verbose_name='分块大小')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='OPEN', verbose_name='状态')
+    media_item = models.ForeignKey(MediaItem, null=True, blank=True, on_delete=models.SET_NULL, verbose_name='媒体资料')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')
+    # 创建和每收到一个分块时顺延 CHUNKED_UPLOAD_SESSION_TTL
+    expires_at = models.DateTimeField(verbose_name='过期时间')
+
+    class Meta:
+        verbose_name = '上传会话'
+        verbose_name_plural = verbose_name
+
+    def __str__(self):
+        return self.filename
+
+    @staticmethod
+    def new_expiry():
+        return timezone.now() + datetime.timedelta(seconds=settings.CHUNKED_UPLOAD_SESSION_TTL)
+
+    @property
+    def expired(self):
+        return self.status == 'OPEN' and self.expires_at <= timezone.now()
+
+    @property
+    def chunk_count(self):
+        return max(1, -(-self.total_size // self.chunk_size))
+
+    @property
+    def staging_path(self):
+        return os.path.join(blob_storage.staging_dir(), 'upload-%s' % self.id.hex)
+
+    def chunk_length(self, index):
+        """第 index 块应有的字节数，最后一块可能较短"""
+        return min(self.chunk_size, self.total_size - index * self.chunk_size)
+
+    def remove_staging_file(self):
+        if os.path.exists(self.staging_path):
+            os.remove(self.staging_path)
+
+class UploadChunk(models.Model):
+    """已校验写入的分块，每块一行，避免并发上传时互相覆盖进度"""
+    session = models.ForeignKey(UploadSession, on_delete=models.CASCADE, related_name='chunks', verbose_name='上传会话')
+    index = models.PositiveIntegerField(verbose_name='分块序号')
+    sha256 = models.CharField(max_length=64, verbose_name='SHA-256')
+
+    class Meta:
+        unique_together = ('session', 'index')
+
+class MediaDerivative(models.Model):
+    """媒体资料的衍生版本：缩略图、网页尺寸图、视频封面、音频波形图"""
+    VARIANT_TYPES = (
+        ('thumb', '缩略图'),
+        ('web', '网页尺寸'),
+        ('poster', '视频封面'),
+        ('waveform', '音频波形'),
+    )
+
+    media_item = models.ForeignKey(MediaItem, on_delete=models.CASCADE, related_name='derivatives', verbose_name='媒体资料')
+    variant = models.CharField(max_length=10, choices=VARIANT_TYPES, verbose_name='版本')
+    file = models.FileField(upload_to='derivatives/%Y/%m/', max_length=255, verbose_name='文件')
+    width = models.PositiveIntegerField(verbose_name='宽度')
+    height = models.PositiveIntegerField(verbose_name='高度')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
+
+    class Meta:
+        verbose_name = '衍生文件'
+        verbose_name_plural = verbose_name
+        unique_together = ('media_item', 'variant')
+
+    def __str__(self):
+        return '%s (%s)' % (self.media_item, self.variant)
+
+class DerivativeJob(models.Model):
+    """衍生文件生成任务，存放在数据库中，由 derivative_worker 进程池消费"""
+    STATUS_CHOICES = (
+        ('PENDING', '等待中'),
+        ('RUNNING', '处理中'),
+        ('DONE', '已完成'),
+        ('FAILED', '失败'),
+    )
+
+    media_item = models.ForeignKey(MediaItem, on_delete=models.CASCADE, related_name='derivative_jobs', verbose_name='媒体资料')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='PENDING', verbose_name='状态')
+    attempts = models.PositiveIntegerField(default=0, verbose_name='尝试次数')
+    error = models.TextField(blank=True, verbose_name='错误信息')
+    locked_at = models.DateTimeField(null=True, blank=True, verbose_name='领取时间')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')
+
+    class Meta:
+        verbose_name = '衍生任务'
+        verbose_name_plural = verbose_name
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='derivjob_status_idx'),
+        ]
+
+    def __str__(self):
+        return '%s #%s' % (self.media_item, self.pk)
+
+class ClusterTile(models.Model):
+    """地图聚合的预计算瓦片
+
+    每行保存某缩放级别下一个 Web 墨卡托瓦片内的聚合结果，由 myapp.clustering 按需计算；
+    Survey 新增、移动或删除时只删除受影响的瓦片，下次请求时重新计算。
+    """
+    zoom = models.PositiveSmallIntegerField(verbose_name='缩放级别')
+    tile_x = models.IntegerField(verbose_name='瓦片X')
+    tile_y = models.IntegerField(verbose_name='瓦片Y')
+    clusters = models.JSONField(default=list, verbose_name='聚合结果')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')
+
+    class Meta:
+        verbose_name = '聚合瓦片'
+        verbose_name_plural = verbose_name
+        unique_together = ('zoom', 'tile_x', 'tile_y')
+
+class StatCounterManager(models.Manager):
+    def add(self, dimension, key, delta):
+        """原子地累加计数，行不存在时创建"""
+        if not delta:
+            return
+        while True:
+            if self.filter(dimension=dimension, key=key).update(value=F('value') + delta):
+                return
+            if delta < 0:
+                # 行已随调查删除或汇总已偏离，留给校正命令处理
+                return
+            try:
+                with transaction.atomic(using=self.db):
+                    self.create(dimension=dimension, key=key, value=delta)
+                return
+            except IntegrityError:
+                # 并发创建了同一行，改为累加
+                continue
+
+    def add_many(self, deltas):
+        """批量累加 {(dimension, key): delta}
+
+        正增量在 SQLite / PostgreSQL 上合并为一条 INSERT ... ON CONFLICT DO UPDATE，
+        负增量逐键 UPDATE，不为其创建行。
+        """
+        increments = []
+        for (dimension, key), delta in sorted(deltas.items()):
+            if delta > 0:
+                increments.append((dimension, key, delta))
+            elif delta < 0:
+                self.add(dimension, key, delta)
+        if not increments:
+            return
+        connection = connections[self.db]
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            for dimension, key, delta in increments:
+                self.add(dimension, key, delta)
+            return
+        qn = connection.ops.quote_name
+        table = qn(self.model._meta.db_table)
+        sql = 'INSERT INTO {table} ({dimension}, {key}, {value}) VALUES {rows} ' \
+              'ON CONFLICT ({dimension}, {key}) DO UPDATE SET {value} = {table}.{value} + excluded.{value}'.format(
+                  table=table, dimension=qn('dimension'), key=qn('key'), value=qn('value'),
+                  rows=', '.join(['(%s, %s, %s)'] * len(increments)))
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [param for row in increments for param in row])
+
+class StatCounter(models.Model):
+    """统计汇总表
+
+    每行是某个维度下一个键的计数，由 Survey / MediaItem 的信号增量维护（见 myapp.stats），
+    统计接口直接读取，不做整表聚合；reconcile_statistics 命令定期按原始数据校正。
+    """
+    dimension = models.CharField(max_length=20, verbose_name='维度')
+    key = models.CharField(max_length=64, verbose_name='键')
+    value = models.BigIntegerField(default=0, verbose_name='值')
+
+    objects = StatCounterManager()
+
+    class Meta:
+        verbose_name = '统计计数'
+        verbose_name_plural = verbose_name
+        unique_together = ('dimension', 'key')
+        indexes = [
+            models.Index(fields=['dimension', '-value'], name='statcounter_rank_idx'),
+        ]
+
+    def __str__(self):
+        return '%s:%s=%s' % (self.dimension, self.key, self.value)
@@ -0,0 +1,13 @@
+from rest_framework.pagination import CursorPagination
+
+
+class SurveyCursorPagination(CursorPagination):
+    """调查记录的游标分页
+
+    按 (created_at, id) 倒序做键集分页，由 Survey 上的组合索引支撑，
+    翻页深度不影响查询耗时。
+    """
+    ordering = ('-created_at', '-id')
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
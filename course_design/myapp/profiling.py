@@ -0,0 +1,257 @@
+"""单个请求的采样分析
+
+带 X-Profile: 1 请求头或 ?profile=1 参数的请求（仅管理员），以及按 PROFILE_SAMPLE_RATE 随机抽中的请求，
+在处理期间由后台线程每隔 PROFILE_SAMPLE_INTERVAL 秒记录一次调用栈。结果保存为 PROFILE_DIR 下的 JSON 文件，
+超过 PROFILE_MAX_TRACES 个时删除最旧的；响应头 X-Profile-Id 给出记录编号，
+可在 /api/profiles/ 浏览，/api/profiles/<id>/collapsed/ 下载折叠栈（flamegraph.pl、speedscope 可直接读取）。
+
+WSGI 下采样请求线程；ASGI 下采样在 myapp.aio 线程池中执行该请求工作的线程，以及执行同步视图的线程。
+"""
+import asyncio
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from importlib import import_module
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.contrib import auth
+from django.utils import timezone
+from django.utils.deprecation import MiddlewareMixin
+from rest_framework import exceptions
+
+from . import aio
+from .authentication import CachedTokenAuthentication
+from .metrics import view_name
+
+logger = logging.getLogger(__name__)
+
+TRACE_ID_RE = re.compile(r'^\d{19}-[0-9a-f]{8}$')
+
+_sampler = contextvars.ContextVar('profile_sampler', default=None)
+
+
+@functools.lru_cache(maxsize=4096)
+def short_filename(filename):
+    """去掉 sys.path 中的前缀，如 myapp/views.py、django/db/models/query.py"""
+    for prefix in sorted(sys.path, key=len, reverse=True):
+        if prefix and filename.startswith(prefix + os.sep):
+            return filename[len(prefix) + 1:]
+    return filename
+
+
+def frame_label(frame):
+    code = frame.f_code
+    # 折叠栈格式以 ; 分隔各层，以最后一个空格分隔次数
+    return '%s (%s:%d)' % (code.co_name, short_filename(code.co_filename).replace(';', ':'), code.co_firstlineno)
+
+
+def collapse(frame):
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+class Sampler(threading.Thread):
+    """定时记录 threads 中各线程的调用栈"""
+
+    def __init__(self, interval, threads=()):
+        super().__init__(name='profile-sampler', daemon=True)
+        self.interval = interval
+        self.threads = set(threads)
+        self.stacks = Counter()
+        self.samples = 0
+        self.finished = threading.Event()
+
+    def run(self):
+        while not self.finished.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id in list(self.threads):
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    self.stacks[collapse(frame)] += 1
+            self.samples += 1
+
+    def stop(self):
+        self.finished.set()
+        self.join()
+
+
+@contextlib.contextmanager
+def sampled_thread():
+    """当前线程在执行被分析请求的工作时加入采样（myapp.aio.run_in 调用）"""
+    sampler = _sampler.get()
+    if sampler is None:
+        yield
+        return
+    thread_id = threading.get_ident()
+    sampler.threads.add(thread_id)
+    try:
+        yield
+    finally:
+        sampler.threads.discard(thread_id)
+
+
+def requested(request):
+    return request.META.get('HTTP_X_PROFILE') == '1' or request.GET.get('profile') == '1'
+
+
+def save_trace(trace):
+    """写入一条记录，并删除超出 PROFILE_MAX_TRACES 的最旧记录"""
+    os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=settings.PROFILE_DIR, prefix='.tmp-')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(trace, f)
+    os.replace(path, os.path.join(settings.PROFILE_DIR, trace['id'] + '.json'))
+    # 编号以纳秒时间戳开头，按文件名排序即按时间排序
+    for trace_id in list_trace_ids()[settings.PROFILE_MAX_TRACES:]:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(os.path.join(settings.PROFILE_DIR, trace_id + '.json'))
+
+
+def list_trace_ids():
+    """按时间从新到旧"""
+    try:
+        names = os.listdir(settings.PROFILE_DIR)
+    except FileNotFoundError:
+        return []
+    return sorted((name[:-5] for name in names if name.endswith('.json') and not name.startswith('.')),
+                  reverse=True)
+
+
+def load_trace(trace_id):
+    """读取一条记录，不存在时返回 None"""
+    if not TRACE_ID_RE.match(trace_id):
+        return None
+    try:
+        with open(os.path.join(settings.PROFILE_DIR, trace_id + '.json')) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def top_frames(trace, limit=20):
+    """按自身耗时（位于栈顶的采样数）排序的函数"""
+    counts = Counter()
+    for stack, count in trace['stacks'].items():
+        counts[stack.rsplit(';', 1)[-1]] += count
+    total = sum(counts.values()) or 1
+    return [{'frame': frame, 'samples': count, 'ratio': round(count / total, 4)}
+            for frame, count in counts.most_common(limit)]
+
+
+def collapsed(trace):
+    return ''.join('%s %d\n' % (stack, count) for stack, count in
+                   sorted(trace['stacks'].items(), key=lambda item: item[1], reverse=True))
+
+
+def requesting_user(request):
+    """在认证中间件和 DRF 之前确定请求者：先看 Token，再看会话 Cookie，都没有时返回 None"""
+    try:
+        result = CachedTokenAuthentication().authenticate(request)
+    except exceptions.AuthenticationFailed:
+        return None
+    if result is not None:
+        return result[0]
+    session_key = request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    if not session_key:
+        return None
+    session = import_module(settings.SESSION_ENGINE).SessionStore(session_key)
+    user = auth.get_user(SimpleNamespace(session=session))
+    return user if user.is_authenticated else None
+
+
+def staff_user(request):
+    user = requesting_user(request)
+    return user if user is not None and user.is_staff else None
+
+
+class ProfilingMiddleware(MiddlewareMixin):
+    """按请求开启采样分析，同时支持同步和异步调用
+
+    带标记的请求先认证（Token 或会话），只有管理员才开始采样，其余请求忽略标记，不产生任何采样开销。
+    ASGI 下同步视图在 asgiref 的线程中执行，process_view 在该线程中调用，借此把它加入采样；
+    该线程由所有同步视图共用，同一时段内其他请求的同步代码也可能出现在记录中。
+    """
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        user = staff_user(request) if requested(request) else None
+        sampler = self.begin(user, threading.get_ident())
+        if sampler is None:
+            return self.get_response(request)
+        token = _sampler.set(sampler)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _sampler.reset(token)
+            sampler.stop()
+        return self.finish(request, response, sampler, user, started)
+
+    async def __acall__(self, request):
+        user = await aio.run_db(request, staff_user, request) if requested(request) else None
+        sampler = self.begin(user)
+        if sampler is None:
+            return await self.get_response(request)
+        token = _sampler.set(sampler)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _sampler.reset(token)
+            sampler.stop()
+        return self.finish(request, response, sampler, user, started)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        sampler = _sampler.get()
+        if sampler is not None:
+            sampler.threads.add(threading.get_ident())
+
+    def begin(self, user, *threads):
+        if user is None and not (settings.PROFILE_SAMPLE_RATE and random.random() < settings.PROFILE_SAMPLE_RATE):
+            return None
+        sampler = Sampler(settings.PROFILE_SAMPLE_INTERVAL, threads)
+        sampler.start()
+        return sampler
+
+    def finish(self, request, response, sampler, user, started):
+        duration = time.perf_counter() - started
+        flagged = user is not None
+        if user is None:
+            user = getattr(request, 'user', None)
+        trace = {
+            'id': '%019d-%s' % (time.time_ns(), uuid.uuid4().hex[:8]),
+            'created_at': timezone.now().isoformat(),
+            'method': request.method,
+            'path': request.get_full_path(),
+            'view': view_name(request),
+            'status': response.status_code,
+            'duration': duration,
+            'user': user.get_username() if user is not None and user.is_authenticated else None,
+            'trigger': 'flag' if flagged else 'sample',
+            'interval': sampler.interval,
+            'samples': sampler.samples,
+            'stacks': dict(sampler.stacks),
+        }
+        try:
+            save_trace(trace)
+        except OSError as e:
+            logger.warning('保存分析记录失败: %s', e)
+            return response
+        response['X-Profile-Id'] = trace['id']
+        return response
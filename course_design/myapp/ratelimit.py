@@ -0,0 +1,113 @@
+"""登录限流
+
+滑动窗口计数：按固定窗口分桶计数，估计值 = 上一窗口计数 × 上一窗口仍在滑动窗口内的比例 + 当前窗口计数，
+每个键只需两个计数器。计数存放在 caches[RATELIMIT_CACHE_ALIAS] 中，
+后端可按部署选择本地内存、文件或 Redis；多进程部署应使用共享后端。
+在调用 authenticate（计算密码哈希）之前检查，超限的请求不消耗哈希计算。
+经反向代理部署时 REMOTE_ADDR 是代理的地址，来自 TRUSTED_PROXY_IPS 的请求按 X-Forwarded-For 取客户端地址，
+否则所有用户共用一个 IP 计数。
+"""
+import hashlib
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import status
+from rest_framework.response import Response
+
+
+def get_cache():
+    return caches[settings.RATELIMIT_CACHE_ALIAS]
+
+
+def bucket_keys(key, window, now):
+    current = int(now // window)
+    return 'rl:%s:%d' % (key, current - 1), 'rl:%s:%d' % (key, current), now - current * window
+
+
+def window_counts(key, window, now):
+    """返回 (上一窗口计数, 当前窗口计数, 当前窗口已过去的秒数)"""
+    previous_key, current_key, elapsed = bucket_keys(key, window, now)
+    counts = get_cache().get_many([previous_key, current_key])
+    return counts.get(previous_key, 0), counts.get(current_key, 0), elapsed
+
+
+def estimate(previous, current, elapsed, window):
+    """滑动窗口内的估计次数"""
+    return previous * (window - elapsed) / window + current
+
+
+def retry_after(previous, current, elapsed, limit, window):
+    """估计值降到限额以下还需等待的秒数"""
+    if current >= limit:
+        # 当前窗口结束后它成为上一窗口，还要再滑出 1 - limit / current 的比例
+        return math.ceil(window - elapsed + window * (1 - limit / current))
+    # 当前窗口内等待上一窗口的计数衰减到 limit - current 以下
+    return max(1, math.ceil((previous * (window - elapsed) - (limit - current) * window) / previous))
+
+
+def record(key, window, now=None):
+    now = time.time() if now is None else now
+    _, current_key, _ = bucket_keys(key, window, now)
+    cache = get_cache()
+    cache.add(current_key, 0, timeout=2 * window)
+    try:
+        cache.incr(current_key)
+    except ValueError:
+        # 计数器刚好过期
+        cache.set(current_key, 1, timeout=2 * window)
+
+
+def client_ip(request):
+    """客户端地址：从右向左跳过 X-Forwarded-For 中的可信代理，取第一个不可信的地址"""
+    ip = request.META.get('REMOTE_ADDR', '')
+    trusted = settings.TRUSTED_PROXY_IPS
+    if ip not in trusted:
+        return ip
+    forwarded = [part.strip() for part in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if part.strip()]
+    for address in reversed(forwarded):
+        if address not in trusted:
+            return address
+    return forwarded[0] if forwarded else ip
+
+
+def login_keys(request, username):
+    """按用户名和客户端 IP 分别限流，返回 [(键, 限额, 窗口秒数), ...]"""
+    limits = settings.LOGIN_RATE_LIMITS
+    username = (username or '').strip().lower()
+    ip = client_ip(request)
+    digest = hashlib.sha1(username.encode('utf-8')).hexdigest()
+    return [
+        ('login:user:%s' % digest,) + tuple(limits['username']),
+        ('login:ip:%s' % ip,) + tuple(limits['ip']),
+    ]
+
+
+def check_login(request, username):
+    """登录尝试计数；超限时不计数，返回需等待的秒数，否则返回 None"""
+    now = time.time()
+    keys = login_keys(request, username)
+    waits = []
+    for key, limit, window in keys:
+        previous, current, elapsed = window_counts(key, window, now)
+        if estimate(previous, current, elapsed, window) >= limit:
+            waits.append(retry_after(previous, current, elapsed, limit, window))
+    if waits:
+        return max(waits)
+    for key, _, window in keys:
+        record(key, window, now)
+    return None
+
+
+def reset_login(request, username):
+    """登录成功后清除该用户名的计数，IP 的计数保留"""
+    key, _, window = login_keys(request, username)[0]
+    previous_key, current_key, _ = bucket_keys(key, window, time.time())
+    get_cache().delete_many([previous_key, current_key])
+
+
+def throttled_response(wait):
+    response = Response({'error': '登录尝试过于频繁，请 %d 秒后再试' % wait}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+    response['Retry-After'] = str(wait)
+    return response
@@ -0,0 +1,148 @@
+"""调查与媒体资料的全文检索
+
+SQLite 上使用 FTS5 倒排索引。FTS5 自带的分词器会把连续的汉字当作一个词，
+因此写入前先在 Python 中分词：汉字按二元组（bigram）切分，单字另外写入 chars 列，
+拉丁字母和数字按单词切分并转小写。查询使用同样的规则，多字词转为相邻 bigram 的短语查询。
+其他数据库退化为 LIKE 查询。
+"""
+import re
+
+from django.db import connection
+
+from .models import Survey, MediaItem
+
+TABLE = 'myapp_search_index'
+
+# 各列在 bm25 中的权重：kind, survey_id 不参与打分；标题权重最高
+BM25_WEIGHTS = '0.0, 0.0, 10.0, 3.0, 1.0'
+
+CJK_RE = re.compile(r'[㐀-䶿一-鿿豈-﫿]+')
+TOKEN_RE = re.compile(r'[㐀-䶿一-鿿豈-﫿]+|[^\W_]+')
+
+KIND_SURVEY = 'survey'
+KIND_MEDIA = 'media'
+
+
+def is_fts_enabled():
+    return connection.vendor == 'sqlite'
+
+
+def tokenize(text):
+    """切分为索引词：汉字 bigram，其余按单词"""
+    tokens = []
+    for match in TOKEN_RE.finditer(text or ''):
+        word = match.group()
+        if CJK_RE.fullmatch(word):
+            if len(word) == 1:
+                tokens.append(word)
+            else:
+                tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+        else:
+            tokens.append(word.lower())
+    return tokens
+
+
+def cjk_chars(text):
+    return [c for run in CJK_RE.findall(text or '') for c in run]
+
+
+def row_id(kind, pk):
+    # survey 与 media 共用一张表，用 rowid 奇偶区分，便于按主键删除和更新
+    return pk * 2 if kind == KIND_SURVEY else pk * 2 + 1
+
+
+def index_document(kind, pk, survey_id, title, body=''):
+    if not is_fts_enabled():
+        return
+    rowid = row_id(kind, pk)
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM %s WHERE rowid = %%s' % TABLE, [rowid])
+        cursor.execute(
+            'INSERT INTO %s (rowid, kind, survey_id, title, body, chars) VALUES (%%s, %%s, %%s, %%s, %%s, %%s)' % TABLE,
+            [rowid, kind, survey_id, ' '.join(tokenize(title)), ' '.join(tokenize(body)),
+             ' '.join(cjk_chars(title) + cjk_chars(body))])
+
+
+def remove_document(kind, pk):
+    if not is_fts_enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM %s WHERE rowid = %%s' % TABLE, [row_id(kind, pk)])
+
+
+def index_survey(survey):
+    index_document(KIND_SURVEY, survey.pk, survey.pk, survey.name)
+
+
+def index_media_item(media_item):
+    index_document(KIND_MEDIA, media_item.pk, media_item.survey_id, media_item.title, media_item.description)
+
+
+def rebuild():
+    """重建全部索引"""
+    if not is_fts_enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM %s' % TABLE)
+    for survey in Survey.objects.only('id', 'name').iterator():
+        index_survey(survey)
+    for media_item in MediaItem.objects.only('id', 'survey_id', 'title', 'description').iterator():
+        index_media_item(media_item)
+
+
+def build_match_query(query):
+    """把用户输入转换为 FTS5 MATCH 表达式，各词之间为 AND"""
+    clauses = []
+    for term in query.split():
+        tokens = tokenize(term)
+        if not tokens:
+            continue
+        if len(tokens) == 1 and CJK_RE.fullmatch(tokens[0]) and len(tokens[0]) == 1:
+            clauses.append('chars : "%s"' % tokens[0])
+            continue
+        phrase = '"%s"' % ' '.join(tokens)
+        if not CJK_RE.fullmatch(tokens[-1]):
+            # 最后一个拉丁词按前缀匹配，便于边输入边搜索
+            phrase += '*'
+        clauses.append('{title body} : %s' % phrase)
+    return ' AND '.join(clauses)
+
+
+def search(query, kind=None, offset=0, limit=20):
+    """返回 (总数, [(kind, pk, score), ...])，按相关度排序"""
+    if not is_fts_enabled():
+        return fallback_search(query, kind, offset, limit)
+    match = build_match_query(query)
+    if not match:
+        return 0, []
+    where = '%s MATCH %%s' % TABLE
+    params = [match]
+    if kind:
+        where += ' AND kind = %s'
+        params.append(kind)
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT count(*) FROM %s WHERE %s' % (TABLE, where), params)
+        total = cursor.fetchone()[0]
+        cursor.execute(
+            'SELECT kind, rowid, bm25(%s, %s) AS score FROM %s WHERE %s ORDER BY score LIMIT %%s OFFSET %%s'
+            % (TABLE, BM25_WEIGHTS, TABLE, where),
+            params + [limit, offset])
+        rows = [(k, rowid // 2, -score) for k, rowid, score in cursor.fetchall()]
+    return total, rows
+
+
+def fallback_search(query, kind, offset, limit):
+    terms = query.split()
+    if not terms:
+        return 0, []
+    surveys = Survey.objects.all()
+    media_items = MediaItem.objects.all()
+    for term in terms:
+        surveys = surveys.filter(name__icontains=term)
+        media_items = media_items.filter(title__icontains=term) | media_items.filter(description__icontains=term)
+    rows = []
+    if kind in (None, KIND_SURVEY):
+        rows += [(KIND_SURVEY, pk, 1.0) for pk in surveys.order_by('-created_at').values_list('pk', flat=True)]
+    if kind in (None, KIND_MEDIA):
+        rows += [(KIND_MEDIA, pk, 1.0) for pk in media_items.order_by('-created_at').values_list('pk', flat=True)]
+    return len(rows), rows[offset:offset + limit]
@@ -1,5 +1,7 @@
 from rest_framework import serializers
-from .models import Survey, MediaItem, UserProfile
+from django.conf import settings
+from . import uploads
+from .models import Survey, MediaItem, UserProfile, UploadSession
 
 class UserProfileSerializer(serializers.ModelSerializer):
     class Meta:
@@ -7,9 +9,44 @@ class UserProfileSerializer(serializers.ModelSerializer):
         fields = ['id', 'username', 'phone']
 
 class MediaItemSerializer(serializers.ModelSerializer):
+    variants = serializers.SerializerMethodField()
+
     class Meta:
         model = MediaItem
-        fields = '__all__'
+        exclude = ['blob']
+
+    def validate(self, attrs):
+        """媒体类型以文件内容为准，与声明的 media_type 不符时拒绝"""
+        media_type = attrs.get('media_type', getattr(self.instance, 'media_type', None))
+        upload = attrs.get('file_path')
+        inspection = getattr(upload, 'inspection', None)
+        if inspection is not None:
+            mime_type = inspection.mime_type
+        elif upload is None and self.instance is not None:
+            mime_type = self.instance.mime_type
+        else:
+            mime_type = None
+        actual = uploads.media_type_for(mime_type)
+        if actual and media_type and actual != media_type:
+            raise serializers.ValidationError({
+                'media_type': '文件内容为%s（%s），与声明的媒体类型不符' % (
+                    dict(MediaItem.MEDIA_TYPES)[actual], mime_type)
+            })
+        return attrs
+
+    def get_variants(self, obj):
+        """已生成的衍生版本，如 {'thumb': {'url': ..., 'width': ..., 'height': ...}}"""
+        request = self.context.get('request')
+        variants = {}
+        # 使用 .all() 以便命中视图中的 prefetch_related
+        for derivative in obj.derivatives.all():
+            url = derivative.file.url
+            variants[derivative.variant] = {
+                'url': request.build_absolute_uri(url) if request else url,
+                'width': derivative.width,
+                'height': derivative.height,
+            }
+        return variants
 
 class SurveySerializer(serializers.ModelSerializer):
     media_items = MediaItemSerializer(many=True, read_only=True)
@@ -22,4 +59,58 @@ class SurveySerializer(serializers.ModelSerializer):
             'start_date', 'end_date', 'investigator', 
             'created_at', 'updated_at', 'media_items'
         ]
-        read_only_fields = ['investigator', 'created_at', 'updated_at']
\ No newline at end of file
+        read_only_fields = ['investigator', 'created_at', 'updated_at']
+
+class SurveyListSerializer(serializers.ModelSerializer):
+    """列表页使用的精简表示，只返回媒体数量而不嵌套媒体列表"""
+    investigator = UserProfileSerializer(read_only=True)
+    media_count = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Survey
+        fields = [
+            'id', 'name', 'longitude', 'latitude',
+            'start_date', 'end_date', 'investigator',
+            'created_at', 'updated_at', 'media_count'
+        ]
+        read_only_fields = fields
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    chunk_size = serializers.IntegerField(required=False)
+    chunk_count = serializers.IntegerField(read_only=True)
+    received_chunks = serializers.SerializerMethodField()
+
+    class Meta:
+        model = UploadSession
+        fields = [
+            'id', 'survey', 'title', 'description', 'media_type', 'category',
+            'filename', 'total_size', 'chunk_size', 'chunk_count',
+            'received_chunks', 'status', 'media_item', 'created_at', 'expires_at'
+        ]
+        read_only_fields = ['status', 'media_item', 'created_at', 'expires_at']
+
+    def get_received_chunks(self, obj):
+        return sorted(obj.chunks.values_list('index', flat=True))
+
+    def validate_total_size(self, value):
+        if value <= 0:
+            raise serializers.ValidationError('文件大小必须大于 0')
+        if value > settings.CHUNKED_UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError('文件过大')
+        return value
+
+    def validate_chunk_size(self, value):
+        if not settings.CHUNKED_UPLOAD_MIN_CHUNK_SIZE <= value <= settings.CHUNKED_UPLOAD_MAX_CHUNK_SIZE:
+            raise serializers.ValidationError('分块大小超出允许范围')
+        return value
+
+    def validate(self, attrs):
+        limit = uploads.size_limit(attrs.get('media_type'))
+        if limit is not None and attrs.get('total_size', 0) > limit:
+            raise serializers.ValidationError({'total_size': '该媒体类型的文件不能超过 %d 字节' % limit})
+        return attrs
+
+    def create(self, validated_data):
+        validated_data.setdefault('chunk_size', settings.CHUNKED_UPLOAD_CHUNK_SIZE)
+        return super().create(validated_data)
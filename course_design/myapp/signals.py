@@ -0,0 +1,240 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from . import authentication, caching, clustering, derivatives, mediainfo, metrics, search, stats, uploads
+from .models import Survey, MediaItem, MediaBlob, MediaDerivative, UserProfile
+from .serializers import UserProfileSerializer
+
+
+@receiver(pre_save, sender=MediaItem)
+def store_media_blob(sender, instance, raw=False, **kwargs):
+    """新上传的文件交给去重存储，保存为共享的 MediaBlob"""
+    if raw or not instance.file_path or instance.file_path._committed:
+        return
+    instance._released_blob_id = instance.blob_id if instance.pk else None
+    content = instance.file_path.file
+    # 经 MediaUploadHandler 接收的文件已检查过，其余（后台、脚本）读取文件头识别
+    inspection = getattr(content, 'inspection', None)
+    mime_type = inspection.mime_type if inspection else uploads.sniff_file(content)
+    blob = MediaBlob.objects.acquire(content)
+    instance._file_changed = True
+    instance.blob = blob
+    instance.mime_type = mime_type or ''
+    instance.file_size = blob.size
+    instance.checksum = blob.sha256
+    for field, value in mediainfo.probe(blob.file.path, instance.mime_type).items():
+        setattr(instance, field, value)
+    instance.file_path.name = blob.file.name
+    instance.file_path._committed = True
+
+
+@receiver(post_save, sender=MediaItem)
+def release_replaced_blob(sender, instance, **kwargs):
+    """更新时替换了文件，释放旧文件的引用"""
+    blob_id = getattr(instance, '_released_blob_id', None)
+    if blob_id:
+        instance._released_blob_id = None
+        MediaBlob.objects.release(blob_id)
+
+
+@receiver(post_save, sender=MediaItem)
+def enqueue_derivatives(sender, instance, **kwargs):
+    """文件有变化时排入衍生文件任务，事务提交后才入队，避免 worker 读到未提交的数据"""
+    if getattr(instance, '_file_changed', False):
+        instance._file_changed = False
+        transaction.on_commit(lambda: derivatives.enqueue(instance))
+
+
+@receiver(post_delete, sender=MediaItem)
+def release_media_blob(sender, instance, **kwargs):
+    if instance.blob_id:
+        MediaBlob.objects.release(instance.blob_id)
+
+
+@receiver(post_delete, sender=MediaDerivative)
+def delete_derivative_file(sender, instance, **kwargs):
+    if instance.file:
+        name = instance.file.name
+        storage = instance.file.storage
+        transaction.on_commit(lambda: storage.delete(name))
+
+
+@receiver(pre_save, sender=Survey)
+def remember_old_survey(sender, instance, raw=False, **kwargs):
+    """一次查询记下修改前的坐标和统计字段
+
+    坐标变化时新旧位置的聚合瓦片都要失效；统计按新旧计数器的差值增量更新。
+    """
+    instance._old_location = None
+    instance._old_stats = None
+    if not raw and instance.pk:
+        old = Survey.objects.filter(pk=instance.pk) \
+            .values_list('longitude', 'latitude', 'investigator_id', 'created_at').first()
+        if old is not None:
+            instance._old_location = old[:2]
+            instance._old_stats = stats.survey_counters(*old[2:])
+
+
+@receiver(post_save, sender=Survey)
+def invalidate_clusters_on_save(sender, instance, created, raw=False, **kwargs):
+    location = (instance.longitude, instance.latitude)
+    old_location = getattr(instance, '_old_location', None)
+    if created or raw:
+        points = [location]
+    elif old_location is not None and tuple(old_location) != location:
+        points = [tuple(old_location), location]
+    else:
+        return
+    transaction.on_commit(lambda: clustering.invalidate(points))
+
+
+@receiver(post_delete, sender=Survey)
+def invalidate_clusters_on_delete(sender, instance, **kwargs):
+    location = (instance.longitude, instance.latitude)
+    transaction.on_commit(lambda: clustering.invalidate([location]))
+
+
+@receiver(post_save, sender=Survey)
+def index_survey(sender, instance, **kwargs):
+    # 与数据写入在同一事务中更新索引
+    search.index_survey(instance)
+
+
+@receiver(post_delete, sender=Survey)
+def unindex_survey(sender, instance, **kwargs):
+    search.remove_document(search.KIND_SURVEY, instance.pk)
+
+
+@receiver(post_save, sender=MediaItem)
+def index_media_item(sender, instance, **kwargs):
+    search.index_media_item(instance)
+
+
+@receiver(post_delete, sender=MediaItem)
+def unindex_media_item(sender, instance, **kwargs):
+    search.remove_document(search.KIND_MEDIA, instance.pk)
+
+
+@receiver(post_save, sender=Survey)
+@receiver(post_delete, sender=Survey)
+def invalidate_survey_cache(sender, instance, **kwargs):
+    caching.invalidate_survey(instance.pk)
+
+
+@receiver(post_save, sender=MediaItem)
+@receiver(post_delete, sender=MediaItem)
+def invalidate_media_cache(sender, instance, **kwargs):
+    caching.invalidate_survey(instance.survey_id)
+
+
+@receiver(pre_save, sender=UserProfile)
+def remember_investigator_fields(sender, instance, raw=False, update_fields=None, **kwargs):
+    """调查的响应中嵌入了调查人（UserProfileSerializer），记下这些字段修改前的值"""
+    instance._old_investigator_fields = None
+    fields = [f for f in UserProfileSerializer.Meta.fields if f != 'id']
+    if raw or not instance.pk or (update_fields is not None and not set(update_fields) & set(fields)):
+        return
+    instance._old_investigator_fields = UserProfile.objects.filter(pk=instance.pk).values(*fields).first()
+
+
+@receiver(post_save, sender=UserProfile)
+def invalidate_investigator_cache(sender, instance, **kwargs):
+    old = getattr(instance, '_old_investigator_fields', None)
+    if old is None or all(getattr(instance, field) == value for field, value in old.items()):
+        return
+    caching.invalidate_surveys(Survey.objects.filter(investigator=instance).values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=MediaDerivative)
+@receiver(post_delete, sender=MediaDerivative)
+def invalidate_derivative_cache(sender, instance, **kwargs):
+    # 衍生文件出现在媒体资料的 variants 中
+    survey_id = MediaItem.objects.filter(pk=instance.media_item_id).values_list('survey_id', flat=True).first()
+    if survey_id is not None:
+        caching.invalidate_survey(survey_id)
+
+
+@receiver(post_save, sender=Survey)
+def update_survey_stats(sender, instance, created, **kwargs):
+    new = stats.survey_counters(instance.investigator_id, instance.created_at)
+    old = getattr(instance, '_old_stats', None)
+    stats.record(new if created or old is None else stats.difference(old, new))
+
+
+@receiver(post_delete, sender=Survey)
+def remove_survey_stats(sender, instance, **kwargs):
+    stats.record(stats.negate(stats.survey_counters(instance.investigator_id, instance.created_at)))
+    stats.forget_survey(instance.pk)
+
+
+@receiver(pre_save, sender=MediaItem)
+def remember_media_stats(sender, instance, raw=False, **kwargs):
+    instance._old_stats = None
+    if not raw and instance.pk:
+        old = MediaItem.objects.select_related('blob').filter(pk=instance.pk).first()
+        if old is not None:
+            instance._old_size = stats.media_size(old)
+            instance._old_file = (old.blob_id, old.file_path.name)
+            instance._old_stats = stats.media_counters(old.survey_id, old.media_type, old.category,
+                                                       instance._old_size)
+
+
+@receiver(post_save, sender=MediaItem)
+def update_media_stats(sender, instance, created, **kwargs):
+    old = getattr(instance, '_old_stats', None)
+    if not created and old is not None and instance._old_file == (instance.blob_id, instance.file_path.name):
+        # 文件未变，沿用修改前的大小
+        size = instance._old_size
+    else:
+        size = stats.media_size(instance)
+    new = stats.media_counters(instance.survey_id, instance.media_type, instance.category, size)
+    stats.record(new if created or old is None else stats.difference(old, new))
+
+
+@receiver(pre_delete, sender=MediaItem)
+def remember_media_size(sender, instance, **kwargs):
+    # post_delete 时文件引用可能已释放，这里先取大小
+    instance._stats_size = stats.media_size(instance)
+
+
+@receiver(post_delete, sender=MediaItem)
+def remove_media_stats(sender, instance, **kwargs):
+    size = getattr(instance, '_stats_size', 0)
+    stats.record(stats.negate(stats.media_counters(
+        instance.survey_id, instance.media_type, instance.category, size)))
+
+
+@receiver(post_delete, sender=Token)
+def revoke_token(sender, instance, **kwargs):
+    """登出或过期删除 token 后通知所有进程丢弃缓存
+
+    不等事务提交：即使回滚，多余的吊销标记也只会让其他进程多查一次数据库。
+    """
+    authentication.revoke(instance.key)
+
+
+@receiver(post_save, sender=UserProfile)
+def revoke_inactive_user_tokens(sender, instance, raw=False, **kwargs):
+    if not raw and not instance.is_active:
+        Token.objects.filter(user=instance).delete()
+
+
+@receiver(connection_created)
+def install_query_metrics(sender, connection, **kwargs):
+    """SQL 计入当前请求的指标（见 myapp.metrics）"""
+    metrics.install(connection)
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    """按 SQLITE_PRAGMAS 设置新建的 SQLite 连接"""
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', None)
+    if connection.vendor != 'sqlite' or not pragmas:
+        return
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute('PRAGMA %s = %s' % (name, value))
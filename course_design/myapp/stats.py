@@ -0,0 +1,203 @@
+"""统计汇总
+
+统计数据保存在 StatCounter 表中，每行为 (维度, 键, 值)。一条 Survey / MediaItem 对汇总的贡献
+用 survey_counters() / media_counters() 表示为 Counter，保存时写入新旧贡献之差，删除时减去贡献，
+因此统计接口只需读取少量汇总行。批量接口不触发信号，由 bulk 模块调用 record() 维护。
+汇总与原始数据可能因异常中断或直接改库而偏离，reconcile() 按原始数据重新计算并校正。
+"""
+from collections import Counter
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from .models import Survey, MediaItem, MediaBlob, StatCounter, UserProfile
+
+TOTAL = 'total'
+INVESTIGATOR = 'investigator'
+MONTH = 'month'
+MEDIA_TYPE = 'media_type'
+CATEGORY = 'category'
+SURVEY_MEDIA = 'survey_media'
+SURVEY_BYTES = 'survey_bytes'
+
+# 按调查细分的维度，行数随调查数量增长，接口只读取排名靠前的部分
+PER_SURVEY_DIMENSIONS = (SURVEY_MEDIA, SURVEY_BYTES)
+
+
+def month_key(value):
+    if settings.USE_TZ and timezone.is_aware(value):
+        value = timezone.localtime(value)
+    return value.strftime('%Y-%m')
+
+
+def survey_counters(investigator_id, created_at):
+    return Counter({
+        (TOTAL, 'surveys'): 1,
+        (INVESTIGATOR, str(investigator_id)): 1,
+        (MONTH, month_key(created_at)): 1,
+    })
+
+
+def media_counters(survey_id, media_type, category, size):
+    return Counter({
+        (TOTAL, 'media_items'): 1,
+        (TOTAL, 'storage_bytes'): size,
+        (MEDIA_TYPE, media_type): 1,
+        (CATEGORY, category): 1,
+        (SURVEY_MEDIA, str(survey_id)): 1,
+        (SURVEY_BYTES, str(survey_id)): size,
+    })
+
+
+def file_size(field_file):
+    if not field_file:
+        return 0
+    try:
+        return field_file.size
+    except (OSError, ValueError, SuspiciousFileOperation):
+        return 0
+
+
+def media_size(media_item):
+    """媒体文件的字节数：优先取已记录的 file_size，其次 MediaBlob.size，最后读取文件大小"""
+    if media_item.file_size is not None:
+        return media_item.file_size
+    if media_item.blob_id:
+        if MediaItem.blob.is_cached(media_item):
+            return media_item.blob.size
+        return MediaBlob.objects.filter(pk=media_item.blob_id).values_list('size', flat=True).first() or 0
+    return file_size(media_item.file_path)
+
+
+def media_sizes(media_items):
+    """批量计算文件大小，未记录 file_size 的 MediaBlob 大小一次查询取回"""
+    blob_ids = {m.blob_id for m in media_items if m.blob_id and m.file_size is None}
+    blob_sizes = dict(MediaBlob.objects.filter(pk__in=blob_ids).values_list('pk', 'size')) if blob_ids else {}
+    return [m.file_size if m.file_size is not None else
+            blob_sizes.get(m.blob_id, 0) if m.blob_id else file_size(m.file_path) for m in media_items]
+
+
+def negate(counters):
+    return Counter({key: -value for key, value in counters.items()})
+
+
+def difference(old, new):
+    delta = Counter(new)
+    delta.subtract(old)
+    return delta
+
+
+def record(delta):
+    """把增量写入汇总表"""
+    StatCounter.objects.add_many(delta)
+
+
+def forget_survey(survey_id):
+    StatCounter.objects.filter(dimension__in=PER_SURVEY_DIMENSIONS, key=str(survey_id)).delete()
+
+
+def compute(survey_model=Survey, media_model=MediaItem):
+    """按原始数据完整计算汇总，迁移中传入历史模型"""
+    counters = Counter()
+    surveys = survey_model.objects.order_by()
+    counters[(TOTAL, 'surveys')] = surveys.count()
+    for row in surveys.values('investigator_id').annotate(n=Count('id')):
+        counters[(INVESTIGATOR, str(row['investigator_id']))] = row['n']
+    for row in surveys.annotate(month=TruncMonth('created_at')).values('month').annotate(n=Count('id')):
+        counters[(MONTH, month_key(row['month']))] += row['n']
+
+    media = media_model.objects.order_by()
+    counters[(TOTAL, 'media_items')] = media.count()
+    for field, dimension in (('media_type', MEDIA_TYPE), ('category', CATEGORY)):
+        for row in media.values(field).annotate(n=Count('id')):
+            counters[(dimension, row[field])] = row['n']
+    for row in media.values('survey_id').annotate(n=Count('id')):
+        counters[(SURVEY_MEDIA, str(row['survey_id']))] = row['n']
+    for row in media.filter(blob__isnull=False).values('survey_id').annotate(size=Sum('blob__size')):
+        counters[(SURVEY_BYTES, str(row['survey_id']))] += row['size'] or 0
+    legacy = media.filter(blob__isnull=True)
+    # 迁移中的历史模型可能还没有 file_size 字段
+    if any(field.name == 'file_size' for field in media_model._meta.fields):
+        for row in legacy.filter(file_size__isnull=False).values('survey_id').annotate(size=Sum('file_size')):
+            counters[(SURVEY_BYTES, str(row['survey_id']))] += row['size']
+        legacy = legacy.filter(file_size__isnull=True)
+    # 未经去重存储、也未回填元数据的旧文件只能逐个读取大小
+    for item in legacy.only('id', 'survey_id', 'file_path').iterator():
+        counters[(SURVEY_BYTES, str(item.survey_id))] += file_size(item.file_path)
+    counters[(TOTAL, 'storage_bytes')] = sum(
+        value for (dimension, _), value in counters.items() if dimension == SURVEY_BYTES)
+    return counters
+
+
+def reconcile(dry_run=False):
+    """校正汇总表，返回 [(维度, 键, 汇总值, 实际值), ...]"""
+    with transaction.atomic():
+        expected = compute()
+        actual = {(c.dimension, c.key): c for c in StatCounter.objects.select_for_update()}
+        drift = []
+        for key in sorted(set(expected) | set(actual)):
+            value = expected.get(key, 0)
+            counter = actual.get(key)
+            current = counter.value if counter else 0
+            if value != current:
+                drift.append((key[0], key[1], current, value))
+            if dry_run:
+                continue
+            if counter is None:
+                if value:
+                    StatCounter.objects.create(dimension=key[0], key=key[1], value=value)
+            elif key not in expected:
+                counter.delete()
+            elif value != current:
+                StatCounter.objects.filter(pk=counter.pk).update(value=value)
+    return drift
+
+
+def summary(top=20):
+    """统计接口的数据，查询次数与数据量无关"""
+    rows = StatCounter.objects.exclude(dimension__in=PER_SURVEY_DIMENSIONS).values_list('dimension', 'key', 'value')
+    values = {}
+    for dimension, key, value in rows:
+        values.setdefault(dimension, {})[key] = value
+
+    totals = values.get(TOTAL, {})
+    investigators = {k: v for k, v in values.get(INVESTIGATOR, {}).items() if v > 0}
+    usernames = dict(UserProfile.objects.filter(pk__in=[int(k) for k in investigators])
+                     .values_list('pk', 'username'))
+    per_investigator = sorted(
+        ({'investigator': int(k), 'username': usernames.get(int(k)), 'count': v} for k, v in investigators.items()),
+        key=lambda row: (-row['count'], row['investigator']))
+
+    def by_choice(dimension, choices):
+        counts = values.get(dimension, {})
+        return {value: counts.get(value, 0) for value, _ in choices}
+
+    top_rows = list(StatCounter.objects.filter(dimension=SURVEY_BYTES)
+                    .order_by('-value', 'key').values_list('key', 'value')[:top])
+    survey_ids = [int(key) for key, _ in top_rows]
+    names = dict(Survey.objects.filter(pk__in=survey_ids).values_list('pk', 'name'))
+    media_counts = dict(StatCounter.objects.filter(dimension=SURVEY_MEDIA, key__in=[k for k, _ in top_rows])
+                        .values_list('key', 'value'))
+    per_survey = [
+        {'survey': int(key), 'name': names.get(int(key)), 'media_count': media_counts.get(key, 0), 'bytes': value}
+        for key, value in top_rows
+    ]
+
+    return {
+        'totals': {
+            'surveys': totals.get('surveys', 0),
+            'media_items': totals.get('media_items', 0),
+            'storage_bytes': totals.get('storage_bytes', 0),
+        },
+        'surveys_per_investigator': per_investigator,
+        'media_per_type': by_choice(MEDIA_TYPE, MediaItem.MEDIA_TYPES),
+        'media_per_category': by_choice(CATEGORY, MediaItem.CATEGORY_TYPES),
+        'surveys_per_month': [
+            {'month': k, 'count': v} for k, v in sorted(values.get(MONTH, {}).items()) if v > 0
+        ],
+        'storage_per_survey': per_survey,
+    }
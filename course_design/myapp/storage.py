@@ -0,0 +1,102 @@
+import hashlib
+import os
+import tempfile
+import uuid
+
+from django.core.files import File
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+class StagedFile:
+    """已计算好哈希、等待落到最终位置的上传文件"""
+
+    def __init__(self, path, digest, size, owned):
+        self.path = path
+        self.digest = digest
+        self.size = size
+        # owned 为 False 表示文件是 Django 的上传临时文件，由 Django 负责清理
+        self.owned = owned
+
+
+class StagedUpload(File):
+    """磁盘上已写好的上传文件，与 TemporaryUploadedFile 一样可被直接移动而不复制"""
+
+    def __init__(self, path, name):
+        super().__init__(open(path, 'rb'), name=name)
+        self.path = path
+
+    def temporary_file_path(self):
+        return self.path
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """按内容寻址的文件存储
+
+    上传内容在写盘的同时计算 SHA-256，最终保存在 blobs/<前两位>/<次两位>/ 下。
+    文件名除了哈希外还带一段随机后缀，使同一内容被删除后重新上传时
+    不会与仍在清理中的旧文件重名。去重与引用计数由 MediaBlob 负责。
+    """
+    blob_dir = 'blobs'
+
+    def staging_root(self):
+        """上传暂存目录，不创建目录；其中的文件不能经媒体文件接口访问"""
+        return os.path.join(self.location, self.blob_dir, 'tmp')
+
+    def staging_dir(self):
+        path = self.staging_root()
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def stage(self, content):
+        """边写临时文件边计算哈希；已在磁盘上的上传临时文件只读取不复制"""
+        sha256 = hashlib.sha256()
+        size = 0
+        if hasattr(content, 'temporary_file_path'):
+            # 上传时已算好哈希（myapp.uploads），不再读一遍
+            inspection = getattr(content, 'inspection', None)
+            if inspection is not None:
+                return StagedFile(content.temporary_file_path(), inspection.sha256, inspection.size, owned=False)
+            for chunk in content.chunks():
+                sha256.update(chunk)
+                size += len(chunk)
+            return StagedFile(content.temporary_file_path(), sha256.hexdigest(), size, owned=False)
+
+        fd, path = tempfile.mkstemp(dir=self.staging_dir())
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in content.chunks():
+                    sha256.update(chunk)
+                    size += len(chunk)
+                    f.write(chunk)
+        except Exception:
+            os.remove(path)
+            raise
+        return StagedFile(path, sha256.hexdigest(), size, owned=True)
+
+    def blob_name(self, digest, original_name):
+        ext = os.path.splitext(original_name or '')[1].lower()
+        return '/'.join([
+            self.blob_dir, digest[:2], digest[2:4],
+            '%s_%s%s' % (digest, uuid.uuid4().hex[:8], ext),
+        ])
+
+    def commit(self, staged, name):
+        """把暂存文件移动到最终位置（同一文件系统下只是重命名）"""
+        full_path = self.path(name)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        file_move_safe(staged.path, full_path, allow_overwrite=False)
+        if self.file_permissions_mode is not None:
+            os.chmod(full_path, self.file_permissions_mode)
+        staged.path = full_path
+        staged.owned = True
+        return name
+
+    def discard(self, staged):
+        if staged.owned and os.path.exists(staged.path):
+            os.remove(staged.path)
+
+
+blob_storage = ContentAddressedStorage()
@@ -1,3 +1,1921 @@
-from django.test import TestCase
+import asyncio
+import csv
+import datetime
+import hashlib
+import importlib
+import io
+import json
+import multiprocessing
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.signals import request_finished, request_started
+from django.db import close_old_connections, connection, connections
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from . import (
+    aio, asgi, authentication, caching, clustering, derivatives, fileserve, geo, mediainfo, metrics, profiling,
+    ratelimit, search, stats, uploads, views, zipstream,
+)
+from .models import (
+    Survey, MediaItem, MediaBlob, MediaDerivative, DerivativeJob, ClusterTile, StatCounter, UploadSession,
+    UserProfile,
+)
+from .pagination import SurveyCursorPagination
+from .storage import blob_storage
+
+
+class ApiTestCase(TestCase):
+    """每个用例开始前清空响应缓存、token 缓存和限流计数，避免前一个用例的状态残留"""
+
+    def setUp(self):
+        caches[settings.API_CACHE_ALIAS].clear()
+        caches[settings.RATELIMIT_CACHE_ALIAS].clear()
+        authentication.token_cache.clear()
+
+
+def make_surveys(count, media_per_survey=2, investigator=None):
+    """批量造测试数据，每条调查挂若干媒体"""
+    if investigator is None:
+        investigator = UserProfile.objects.create_user(username='investigator', password='pass1234')
+    today = datetime.date.today()
+    surveys = []
+    for i in range(count):
+        survey = Survey.objects.create(
+            name='调查%d' % i, longitude=100.0 + i * 0.01, latitude=25.0 + i * 0.01,
+            start_date=today, end_date=today, investigator=investigator,
+        )
+        for j in range(media_per_survey):
+            MediaItem.objects.create(
+                survey=survey, title='资料%d-%d' % (i, j), media_type='IMAGE',
+                category='FOLKLORE', file_path='survey_files/test/%d_%d.png' % (i, j),
+            )
+        surveys.append(survey)
+    return surveys
+
+
+# 上传内容按文件头识别类型，测试文件需带上真实的魔数
+FILE_HEADERS = {
+    'IMAGE': b'\x89PNG\r\n\x1a\n',
+    'AUDIO': b'ID3\x04\x00',
+    'VIDEO': b'\x00\x00\x00\x18ftypmp42',
+    'DOCUMENT': b'%PDF-1.4\n',
+}
+
+
+class QueryBudgetTestCase(ApiTestCase):
+    """查询预算测试基类
+
+    子类在 QUERY_BUDGETS 中为每个接口声明允许的最大查询数，
+    assertQueryBudget 会分别在少量和大量数据下请求接口，
+    超出预算或查询数随数据量增长（N+1）都会失败。
+    """
+    QUERY_BUDGETS = {}
+    SMALL_SIZE = 2
+    LARGE_SIZE = 12
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+
+    def count_queries(self, url):
+        # 预算针对未命中缓存时的查询
+        caches[settings.API_CACHE_ALIAS].clear()
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return len(ctx.captured_queries), ctx.captured_queries
+
+    def assertQueryBudget(self, name, url_factory):
+        budget = self.QUERY_BUDGETS[name]
+        investigator = UserProfile.objects.create_user(username='budget', password='pass1234')
+        small = make_surveys(self.SMALL_SIZE, investigator=investigator)
+        small_count, _ = self.count_queries(url_factory(small))
+        make_surveys(self.LARGE_SIZE - self.SMALL_SIZE, investigator=investigator)
+        large_count, queries = self.count_queries(url_factory(small))
+        sql = '\n'.join(q['sql'] for q in queries)
+        self.assertLessEqual(
+            large_count, budget,
+            '%s 执行了 %d 条查询，超出预算 %d:\n%s' % (name, large_count, budget, sql))
+        self.assertEqual(
+            small_count, large_count,
+            '%s 的查询数随数据量变化 (%d -> %d)，可能存在 N+1:\n%s' % (name, small_count, large_count, sql))
+
+
+class EndpointQueryBudgetTests(QueryBudgetTestCase):
+    QUERY_BUDGETS = {
+        'survey-list': 1,
+        'survey-list-expanded': 3,
+        'survey-detail': 3,
+        'media-item-list': 2,
+    }
+
+    def test_survey_list(self):
+        self.assertQueryBudget('survey-list', lambda s: '/api/surveys/?page_size=50')
+
+    def test_survey_list_expanded(self):
+        self.assertQueryBudget('survey-list-expanded', lambda s: '/api/surveys/?page_size=50&expand=media')
+
+    def test_survey_detail(self):
+        self.assertQueryBudget('survey-detail', lambda s: '/api/surveys/%d/' % s[0].pk)
+
+    def test_media_item_list(self):
+        self.assertQueryBudget('media-item-list', lambda s: '/api/media-items/')
+
+
+class SurveyPaginationTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+
+    def walk(self, url):
+        """沿 next 取完所有页，返回各页的 id 列表"""
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, response.content)
+            pages.append([row['id'] for row in response.data['results']])
+            url = response.data['next']
+        return pages
+
+    def test_walk_next_across_created_at_ties(self):
+        surveys = make_surveys(11, media_per_survey=0)
+        # 三组相同的创建时间，每组都跨越页边界
+        base = timezone.make_aware(datetime.datetime(2026, 1, 1))
+        for i, survey in enumerate(surveys):
+            Survey.objects.filter(pk=survey.pk).update(created_at=base + datetime.timedelta(hours=i // 4))
+        expected = list(Survey.objects.order_by('-created_at', '-id').values_list('pk', flat=True))
+
+        pages = self.walk('/api/surveys/?page_size=3')
+        self.assertEqual([len(page) for page in pages], [3, 3, 3, 2])
+        self.assertEqual([pk for page in pages for pk in page], expected)
+
+    def test_page_size_capped(self):
+        make_surveys(SurveyCursorPagination.max_page_size + 5, media_per_survey=0)
+        response = self.client.get('/api/surveys/?page_size=1000')
+        self.assertEqual(len(response.data['results']), SurveyCursorPagination.max_page_size)
+        self.assertIsNotNone(response.data['next'])
+        self.assertEqual(len(self.client.get('/api/surveys/').data['results']), SurveyCursorPagination.page_size)
+
+    def test_summary_media_count(self):
+        busy, idle = make_surveys(2, media_per_survey=0)
+        for i in range(3):
+            MediaItem.objects.create(survey=busy, title='资料%d' % i, media_type='IMAGE', category='FOLKLORE',
+                                     file_path='survey_files/test/%d.png' % i)
+        rows = {row['id']: row for row in self.client.get('/api/surveys/').data['results']}
+        self.assertEqual(rows[busy.pk]['media_count'], 3)
+        self.assertEqual(rows[idle.pk]['media_count'], 0)
+        self.assertNotIn('media_items', rows[busy.pk])
+
+    def test_expand_media(self):
+        survey, = make_surveys(1, media_per_survey=2)
+        row, = self.client.get('/api/surveys/?expand=media').data['results']
+        self.assertEqual(row['id'], survey.pk)
+        self.assertEqual(sorted(item['title'] for item in row['media_items']), ['资料0-0', '资料0-1'])
+        self.assertNotIn('media_count', row)
+
+
+class IndexUsageTests(TestCase):
+    """热点过滤 / 排序查询必须走索引
+
+    检查 EXPLAIN 输出中出现预期的索引名。测试数据量很小，PostgreSQL 会倾向顺序扫描，
+    因此在 PostgreSQL 上先关闭 enable_seqscan，只验证索引可用。
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        make_surveys(3)
+
+    def assertUsesIndex(self, queryset, *index_names):
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        plan = queryset.explain()
+        self.assertTrue(any(name in plan for name in index_names),
+                        '查询未使用索引 %s:\n%s\n%s' % ('/'.join(index_names), queryset.query, plan))
+
+    def test_survey_indexes(self):
+        user = UserProfile.objects.get(username='investigator')
+        today = datetime.date.today()
+        self.assertUsesIndex(Survey.objects.order_by('-created_at', '-id')[:20], 'survey_created_id_idx')
+        self.assertUsesIndex(Survey.objects.filter(investigator=user).order_by('-created_at', '-id')[:20],
+                             'survey_investigator_idx')
+        self.assertUsesIndex(Survey.objects.filter(start_date__lte=today, end_date__gte=today),
+                             'survey_period_idx', 'survey_end_date_idx')
+        # 后台 list_filter 的日期筛选
+        self.assertUsesIndex(Survey.objects.filter(start_date__gte=today, start_date__lt=today), 'survey_period_idx')
+        self.assertUsesIndex(Survey.objects.filter(end_date__gte=today, end_date__lt=today), 'survey_end_date_idx')
+
+    def test_media_item_indexes(self):
+        survey = Survey.objects.first()
+        self.assertUsesIndex(MediaItem.objects.filter(survey=survey), 'mediaitem_survey_type_idx')
+        self.assertUsesIndex(
+            MediaItem.objects.filter(survey=survey, media_type='IMAGE', category='FOLKLORE').order_by('id'),
+            'mediaitem_survey_type_idx')
+        self.assertUsesIndex(MediaItem.objects.filter(media_type='IMAGE'), 'mediaitem_type_category_idx')
+        self.assertUsesIndex(MediaItem.objects.filter(media_type='IMAGE', category='FOLKLORE'),
+                             'mediaitem_type_category_idx', 'mediaitem_survey_type_idx')
+        self.assertUsesIndex(MediaItem.objects.filter(category='FOLKLORE'), 'mediaitem_category_idx')
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ServeMediaFileTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.content = bytes(range(256)) * 4
+        path = os.path.join(settings.MEDIA_ROOT, 'survey_files', 'clip.mp3')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(self.content)
+        self.url = '/api/media/survey_files/clip.mp3'
+
+    def test_full_response_has_validators(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Content-Type'], 'audio/mpeg')
+        self.assertIn('ETag', response)
+
+    def test_range_request(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/%d' % len(self.content))
+        self.assertEqual(b''.join(response.streaming_content), self.content[10:20])
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-5')
+        self.assertEqual(b''.join(response.streaming_content), self.content[-5:])
+
+    def test_unsatisfiable_range(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=99999-')
+        self.assertEqual(response.status_code, 416)
+        with self.assertRaises(ValueError):
+            fileserve.parse_range_header('bytes=-5', 0)
+
+    def test_conditional_get(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_stale_if_range_returns_full_file(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_path_traversal_rejected(self):
+        response = self.client.get('/api/media/../settings.py')
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(MEDIA_ACCEL_MODE='x-accel-redirect')
+    def test_accel_redirect(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/survey_files/clip.mp3')
+        self.assertEqual(response.content, b'')
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class AsgiTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.content = os.urandom(200 * 1024)
+        path = os.path.join(settings.MEDIA_ROOT, 'survey_files', 'clip.mp3')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(self.content)
+        self.path = path
+
+    def asgi_get(self, path, headers=()):
+        """经 myapp.asgi.ASGIHandler 发送请求，返回 (状态码, 响应头, 响应体)"""
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        path, _, query_string = path.partition('?')
+        scope = {
+            'type': 'http', 'method': 'GET', 'path': path, 'query_string': query_string.encode(), 'root_path': '',
+            'headers': [(b'host', b'localhost')] + list(headers), 'client': ('127.0.0.1', 0),
+        }
+        async def run_db(request, func, *args, **kwargs):
+            # 测试事务所在的连接只能在当前线程使用，查询不进数据库池
+            return await sync_to_async(func, thread_sensitive=True)(*args, **kwargs)
+
+        # 与 Django 测试客户端一样，请求开始 / 结束时不关闭测试事务所在的连接
+        request_started.disconnect(close_old_connections)
+        request_finished.disconnect(close_old_connections)
+        try:
+            with mock.patch.object(aio, 'run_db', run_db):
+                async_to_sync(asgi.ASGIHandler())(scope, receive, send)
+        finally:
+            request_started.connect(close_old_connections)
+            request_finished.connect(close_old_connections)
+        start = messages[0]
+        return start['status'], dict(start['headers']), b''.join(m.get('body', b'') for m in messages[1:])
+
+    def test_file_range_async_iteration(self):
+        file_range = fileserve.FileRange(self.path, 1000, 150000, chunk_size=64 * 1024)
+        self.assertEqual(b''.join(file_range), self.content[1000:151000])
+
+        async def collect():
+            return [chunk async for chunk in file_range]
+        self.assertEqual(b''.join(async_to_sync(collect)()), self.content[1000:151000])
+
+        reads = []
+        original = aio.run_file_io
+
+        async def tracking(func, *args, **kwargs):
+            reads.append(func)
+            return await original(func, *args, **kwargs)
+        with mock.patch.object(aio, 'run_file_io', tracking):
+            async_to_sync(collect)()
+        self.assertEqual(reads[0], open)
+        self.assertEqual(len(reads), 1 + 3)
+
+    def test_media_streamed_asynchronously(self):
+        status, headers, body = self.asgi_get('/api/media/survey_files/clip.mp3')
+        self.assertEqual(status, 200)
+        self.assertEqual(body, self.content)
+        self.assertEqual(headers[b'Content-Type'], b'audio/mpeg')
+
+        status, headers, body = self.asgi_get('/api/media/survey_files/clip.mp3', [(b'range', b'bytes=100-199')])
+        self.assertEqual(status, 206)
+        self.assertEqual(headers[b'Content-Range'], b'bytes 100-199/%d' % len(self.content))
+        self.assertEqual(body, self.content[100:200])
+
+        self.assertEqual(self.asgi_get('/api/media/survey_files/missing.mp3')[0], 404)
+        self.assertEqual(self.asgi_get('/api/media/../settings.py')[0], 404)
+
+    def test_sync_streaming_content_iterated_in_file_pool(self):
+        response = fileserve.RangeStreamingResponse(iter([b'a', b'b']))
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+        async_to_sync(asgi.ASGIHandler().send_response)(response, send)
+        self.assertEqual(b''.join(m.get('body', b'') for m in messages[1:]), b'ab')
+        self.assertFalse(messages[-1].get('more_body', False))
+
+    def test_export_streamed_in_db_pool(self):
+        make_surveys(3, media_per_survey=1)
+        with override_settings(EXPORT_CHUNK_SIZE=1):
+            status, headers, body = self.asgi_get('/api/export/surveys/?format=ndjson')
+        self.assertEqual(status, 200)
+        rows = [json.loads(line) for line in body.decode('utf-8').splitlines()]
+        self.assertEqual([row['media_count'] for row in rows], [1, 1, 1])
+
+    def test_sync_view_profiled(self):
+        override = override_settings(PROFILE_DIR=tempfile.mkdtemp())
+        override.enable()
+        self.addCleanup(override.disable)
+        staff = UserProfile.objects.create_user(username='ops', password='pass1234', is_staff=True)
+        list_media = views.MediaItemViewSet.list
+
+        def slow_list(viewset, request, *args, **kwargs):
+            time.sleep(0.05)
+            return list_media(viewset, request, *args, **kwargs)
+        with mock.patch.object(views.MediaItemViewSet, 'list', slow_list):
+            status, headers, body = self.asgi_get('/api/media-items/', [
+                (b'authorization', b'Token ' + authentication.issue_token(staff).key.encode()),
+                (b'x-profile', b'1')])
+        self.assertEqual(status, 200)
+        trace = profiling.load_trace(headers[b'X-Profile-Id'].decode())
+        self.assertTrue(any('slow_list' in stack for stack in trace['stacks']), trace['stacks'])
+
+    def test_async_urlconf(self):
+        for path in ('/api/surveys/', '/api/surveys/1/', '/api/media/x.png'):
+            match = resolve(path, settings.ASGI_ROOT_URLCONF)
+            self.assertTrue(asyncio.iscoroutinefunction(match.func), path)
+        # 其余路由与 WSGI 部署相同
+        self.assertFalse(asyncio.iscoroutinefunction(resolve('/api/media-items/', settings.ASGI_ROOT_URLCONF).func))
+
+    @override_settings(ROOT_URLCONF='course_design.urls_asgi')
+    def test_async_survey_views(self):
+        make_surveys(2)
+        client = APIClient()
+        client.force_authenticate(UserProfile.objects.get())
+        response = client.get('/api/surveys/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 2)
+        survey_id = response.json()['results'][0]['id']
+        self.assertEqual(client.get('/api/surveys/%d/' % survey_id).json()['id'], survey_id)
+        response = client.post('/api/surveys/', {
+            'name': '异步', 'longitude': 100, 'latitude': 25, 'start_date': '2026-01-01', 'end_date': '2026-01-02',
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class MediaBlobDedupTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.survey = make_surveys(1, media_per_survey=0)[0]
+
+    def upload(self, content, name='photo.png'):
+        response = APIClient().post(
+            '/api/surveys/%d/upload_media/' % self.survey.pk,
+            {'file': SimpleUploadedFile(name, FILE_HEADERS['IMAGE'] + content), 'title': name,
+             'media_type': 'IMAGE', 'category': 'FOLKLORE'},
+            format='multipart')
+        self.assertEqual(response.status_code, 201, response.content)
+        return MediaItem.objects.get(pk=response.data['id'])
+
+    def test_identical_uploads_share_one_file(self):
+        first = self.upload(b'same-bytes')
+        second = self.upload(b'same-bytes', name='copy.png')
+        other = self.upload(b'other-bytes')
+
+        self.assertEqual(first.blob_id, second.blob_id)
+        self.assertEqual(first.file_path.name, second.file_path.name)
+        self.assertNotEqual(first.blob_id, other.blob_id)
+        self.assertEqual(MediaBlob.objects.get(pk=first.blob_id).ref_count, 2)
+
+    def test_file_removed_with_last_reference(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            first = self.upload(b'shared')
+            second = self.upload(b'shared')
+        path = first.file_path.path
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(MediaBlob.objects.get(pk=second.blob_id).ref_count, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(MediaBlob.objects.exists())
+
+    def save_failing(self, content):
+        media_item = MediaItem(survey=self.survey, title='失败', media_type='IMAGE', category='FOLKLORE',
+                               file_path=SimpleUploadedFile('photo.png', FILE_HEADERS['IMAGE'] + content))
+        # 取得文件引用之后、写入记录之前失败
+        with mock.patch.object(mediainfo, 'probe', side_effect=OSError('probe failed')):
+            with self.assertRaises(OSError):
+                media_item.save()
+
+    def test_failed_save_releases_shared_blob(self):
+        existing = self.upload(b'shared')
+        self.save_failing(b'shared')
+        self.assertEqual(MediaBlob.objects.get(pk=existing.blob_id).ref_count, 1)
+        self.assertEqual(MediaItem.objects.count(), 1)
+
+    def test_failed_save_removes_new_blob(self):
+        self.save_failing(b'fresh')
+        self.assertFalse(MediaBlob.objects.exists())
+        self.assertFalse(MediaItem.objects.exists())
+        digest = hashlib.sha256(FILE_HEADERS['IMAGE'] + b'fresh').hexdigest()
+        directory = os.path.join(blob_storage.location, blob_storage.blob_dir, digest[:2], digest[2:4])
+        self.assertFalse(os.path.isdir(directory) and os.listdir(directory))
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), CHUNKED_UPLOAD_MIN_CHUNK_SIZE=1)
+class ChunkedUploadTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.survey = make_surveys(1, media_per_survey=0)[0]
+        self.client.force_authenticate(self.survey.investigator)
+        self.content = FILE_HEADERS['AUDIO'] + os.urandom(2495)
+
+    def create_session(self):
+        response = self.client.post('/api/uploads/', {
+            'survey': self.survey.pk, 'title': '访谈录音', 'media_type': 'AUDIO',
+            'category': 'INTERVIEW', 'filename': 'interview.mp3',
+            'total_size': len(self.content), 'chunk_size': 1000,
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.data['chunk_count'], 3)
+        return '/api/uploads/%s/' % response.data['id']
+
+    def put_chunk(self, url, index, data=None, checksum=None):
+        if data is None:
+            data = self.content[index * 1000:(index + 1) * 1000]
+        return self.client.generic(
+            'PUT', '%schunks/%d/' % (url, index), data, content_type='application/octet-stream',
+            HTTP_X_CHUNK_CHECKSUM=checksum or hashlib.sha256(data).hexdigest())
+
+    def test_out_of_order_upload_and_commit(self):
+        url = self.create_session()
+        for index in (2, 0):
+            self.assertEqual(self.put_chunk(url, index).status_code, 200)
+
+        response = self.client.post(url + 'commit/')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(url).data['received_chunks'], [0, 2])
+
+        self.assertEqual(self.put_chunk(url, 1).status_code, 200)
+        response = self.client.post(url + 'commit/')
+        self.assertEqual(response.status_code, 201, response.content)
+
+        item = MediaItem.objects.get(pk=response.data['id'])
+        with item.file_path.open('rb') as f:
+            self.assertEqual(f.read(), self.content)
+        self.assertEqual(item.blob.sha256, hashlib.sha256(self.content).hexdigest())
+        self.assertEqual(self.client.post(url + 'commit/').status_code, 409)
+
+    def test_bad_checksum_rejected(self):
+        url = self.create_session()
+        response = self.put_chunk(url, 0, checksum='0' * 64)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(url).data['received_chunks'], [])
+
+    def test_wrong_chunk_length_rejected(self):
+        url = self.create_session()
+        self.assertEqual(self.put_chunk(url, 0, data=b'short').status_code, 400)
+
+    def test_requires_authentication(self):
+        self.client.force_authenticate(None)
+        response = self.client.post('/api/uploads/', {
+            'survey': self.survey.pk, 'title': 't', 'media_type': 'AUDIO', 'category': 'INTERVIEW',
+            'filename': 'a.mp3', 'total_size': 10 * 1024 * 1024 * 1024, 'chunk_size': 1000,
+        }, format='json')
+        self.assertIn(response.status_code, (401, 403))
+        self.assertFalse(UploadSession.objects.exists())
+
+    def test_expired_session_refused_and_purged(self):
+        url = self.create_session()
+        self.assertEqual(self.put_chunk(url, 0).status_code, 200)
+        session = UploadSession.objects.get()
+        self.assertGreater(session.expires_at, timezone.now())
+        UploadSession.objects.update(expires_at=timezone.now())
+        self.assertEqual(self.put_chunk(url, 1).status_code, 410)
+        self.assertEqual(self.client.post(url + 'commit/').status_code, 410)
+
+        active = self.create_session()
+        orphan = os.path.join(blob_storage.staging_dir(), 'upload-orphan')
+        open(orphan, 'wb').close()
+        stale = time.time() - settings.CHUNKED_UPLOAD_SESSION_TTL - 60
+        os.utime(orphan, (stale, stale))
+        active_path = UploadSession.objects.get(pk=active.split('/')[-2]).staging_path
+        os.utime(active_path, (stale, stale))
+
+        call_command('purge_upload_sessions', stdout=io.StringIO())
+        self.assertFalse(UploadSession.objects.filter(pk=session.pk).exists())
+        self.assertFalse(os.path.exists(session.staging_path))
+        self.assertFalse(os.path.exists(orphan))
+        self.assertTrue(os.path.exists(active_path))
+        self.assertEqual(self.put_chunk(active, 0).status_code, 200)
+
+    def test_staging_files_not_served(self):
+        url = self.create_session()
+        session = UploadSession.objects.get(pk=url.split('/')[-2])
+        name = os.path.relpath(session.staging_path, settings.MEDIA_ROOT).replace(os.sep, '/')
+        self.assertEqual(self.client.get('/api/media/' + name).status_code, 404)
+
+
+class ProfilingTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        override = override_settings(PROFILE_DIR=tempfile.mkdtemp())
+        override.enable()
+        self.addCleanup(override.disable)
+        make_surveys(2)
+        self.staff = UserProfile.objects.create_user(username='ops', password='pass1234', is_staff=True)
+        self.client = APIClient()
+
+    def test_sampler_records_stacks(self):
+        def spin():
+            deadline = time.perf_counter() + 0.05
+            while time.perf_counter() < deadline:
+                pass
+
+        sampler = profiling.Sampler(0.001, [threading.get_ident()])
+        sampler.start()
+        spin()
+        sampler.stop()
+        self.assertGreater(sampler.samples, 0)
+        self.assertTrue(any(stack.endswith('spin (myapp/tests.py:%d)' % spin.__code__.co_firstlineno)
+                            for stack in sampler.stacks))
+
+    def test_staff_flag(self):
+        # 中间件在 DRF 之前自行认证，需用真实的 Token / 会话而非 force_authenticate
+        self.client.credentials(HTTP_AUTHORIZATION='Token %s' % authentication.issue_token(self.staff).key)
+        response = self.client.get('/api/surveys/', HTTP_X_PROFILE='1')
+        trace = profiling.load_trace(response['X-Profile-Id'])
+        self.assertEqual((trace['view'], trace['status'], trace['user'], trace['trigger']),
+                         ('survey-list', 200, 'ops', 'flag'))
+        self.assertNotIn('X-Profile-Id', self.client.get('/api/surveys/'))
+
+        session_client = APIClient()
+        session_client.login(username='ops', password='pass1234')
+        self.assertIn('X-Profile-Id', session_client.get('/api/surveys/?profile=1'))
+
+    def test_flag_ignored_for_non_staff(self):
+        investigator = UserProfile.objects.get(username='investigator')
+        self.client.credentials(HTTP_AUTHORIZATION='Token %s' % authentication.issue_token(investigator).key)
+        with mock.patch.object(profiling, 'Sampler', side_effect=AssertionError('不应开始采样')):
+            self.assertNotIn('X-Profile-Id', self.client.get('/api/surveys/', HTTP_X_PROFILE='1'))
+            self.assertNotIn('X-Profile-Id', APIClient().get('/api/surveys/?profile=1'))
+            bad_token = APIClient()
+            bad_token.credentials(HTTP_AUTHORIZATION='Token invalid')
+            bad_token.get('/api/surveys/?profile=1')
+        self.assertEqual(profiling.list_trace_ids(), [])
+
+    @override_settings(PROFILE_SAMPLE_RATE=1.0, PROFILE_MAX_TRACES=3)
+    def test_sampling_rate_and_ring_buffer(self):
+        ids = [self.client.get('/api/surveys/')['X-Profile-Id'] for _ in range(5)]
+        self.assertEqual(profiling.list_trace_ids(), ids[:-4:-1])
+        self.assertEqual(profiling.load_trace(ids[-1])['trigger'], 'sample')
+
+    def test_browse_and_download(self):
+        trace_id = '%019d-%s' % (time.time_ns(), 'abcdef01')
+        profiling.save_trace({'id': trace_id, 'view': 'survey-list', 'stacks': {'main;list;query': 3, 'main;list': 1}})
+        self.assertEqual(self.client.get('/api/profiles/').status_code, 401)
+
+        self.client.force_authenticate(self.staff)
+        listing = self.client.get('/api/profiles/').json()
+        self.assertEqual([t['id'] for t in listing], [trace_id])
+        self.assertNotIn('stacks', listing[0])
+        detail = self.client.get('/api/profiles/%s/' % trace_id).json()
+        self.assertEqual(detail['top_frames'][0], {'frame': 'query', 'samples': 3, 'ratio': 0.75})
+
+        response = self.client.get('/api/profiles/%s/collapsed/' % trace_id)
+        self.assertEqual(response.content, b'main;list;query 3\nmain;list 1\n')
+        self.assertIn('attachment', response['Content-Disposition'])
+        self.assertEqual(self.client.get('/api/profiles/0000000000000000000-00000000/').status_code, 404)
+
+    def test_pool_threads_join_sampling(self):
+        sampler = profiling.Sampler(1)
+
+        async def run():
+            token = profiling._sampler.set(sampler)
+            try:
+                return await aio.run_in('db', lambda: threading.get_ident() in sampler.threads)
+            finally:
+                profiling._sampler.reset(token)
+        self.assertTrue(async_to_sync(run)())
+        self.assertEqual(sampler.threads, set())
+
+
+class MetricsTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        override = override_settings(METRICS_DIR=tempfile.mkdtemp())
+        override.enable()
+        self.addCleanup(override.disable)
+        metrics.registry.reset()
+
+    def sample(self, name, **labels):
+        """从 /metrics 的输出中取一个样本值，标签按输出中的顺序给出"""
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        prefix = name + metrics.format_labels(list(labels.items())) + ' '
+        for line in response.content.decode().splitlines():
+            if line.startswith(prefix):
+                return float(line[len(prefix):])
+        return None
+
+    def test_request_metrics(self):
+        make_surveys(3)
+        for _ in range(2):
+            self.assertEqual(self.client.get('/api/surveys/').status_code, 200)
+        self.assertEqual(self.sample('http_requests_total', method='GET', status='200', view='survey-list'), 2)
+        self.assertEqual(self.sample('http_request_duration_seconds_count', method='GET', view='survey-list'), 2)
+        self.assertEqual(self.sample('http_request_duration_seconds_bucket', method='GET', view='survey-list',
+                                     le='+Inf'), 2)
+        self.assertGreater(self.sample('http_request_db_queries_total', view='survey-list'), 0)
+        self.assertGreater(self.sample('http_response_bytes_total', view='survey-list'), 0)
+        self.assertEqual(self.sample('http_requests_total', method='GET', status='404', view='<unresolved>'), None)
+
+    def test_upload_and_streamed_bytes(self):
+        make_surveys(1)
+        body = json.dumps({'name': 'x'})
+        self.client.post('/api/surveys/', body, content_type='application/json')
+        self.assertEqual(self.sample('http_request_bytes_total', view='survey-list'), len(body))
+
+        response = self.client.get('/api/export/surveys/')
+        self.assertEqual(self.sample('http_response_bytes_total', view='export-surveys'), 0)
+        size = len(b''.join(response.streaming_content))
+        self.assertEqual(self.sample('http_response_bytes_total', view='export-surveys'), size)
+
+    def test_aggregated_across_processes(self):
+        self.client.get('/api/surveys/')
+
+        def worker():
+            metrics.registry.record('survey-list', 'GET', 200, 0.2, metrics.RequestMetrics(), 0, 10)
+            metrics.registry.flush()
+
+        self.run_worker(worker)
+        # 本进程的计数在后台线程或读取 /metrics 时才写入
+        self.assertEqual(len(os.listdir(settings.METRICS_DIR)), 1)
+        self.assertEqual(self.sample('http_requests_total', method='GET', status='200', view='survey-list'), 2)
+        self.assertEqual(self.sample('http_request_duration_seconds_bucket', method='GET', view='survey-list',
+                                     le='0.25'), 2)
+
+    def run_worker(self, target):
+        process = multiprocessing.get_context('fork').Process(target=target)
+        process.start()
+        process.join()
+
+    def test_exited_processes_retired(self):
+        def worker():
+            metrics.registry.record('survey-list', 'GET', 200, 0.2, metrics.RequestMetrics(), 0, 10)
+            metrics.registry.flush()
+
+        for _ in range(2):
+            self.run_worker(worker)
+        self.assertEqual(self.sample('http_requests_total', method='GET', status='200', view='survey-list'), 2)
+        files = sorted(name for name in os.listdir(settings.METRICS_DIR) if name.endswith('.json'))
+        self.assertEqual(files, sorted([metrics.RETIRED_FILE, metrics.registry.filename]))
+        # 再次读取不会重复计入已并入的计数
+        self.assertEqual(self.sample('http_requests_total', method='GET', status='200', view='survey-list'), 2)
+
+    def test_earlier_process_with_same_pid_kept(self):
+        # PID 被复用时，旧进程的文件名带着不同的启动时间，不会被新进程覆盖
+        earlier = metrics.Registry()
+        earlier.record('survey-list', 'GET', 200, 0.2, metrics.RequestMetrics(), 0, 10)
+        earlier.started -= 1
+        earlier.flush()
+        self.client.get('/api/surveys/')
+        self.assertEqual(self.sample('http_requests_total', method='GET', status='200', view='survey-list'), 2)
+
+    def test_requests_do_not_write_files(self):
+        with mock.patch.object(metrics, 'write_file') as write_file:
+            self.client.get('/api/surveys/')
+        write_file.assert_not_called()
+
+    def test_queries_in_thread_pool_counted(self):
+        current = metrics.RequestMetrics()
+
+        async def query():
+            token = metrics._current.set(current)
+            try:
+                return await aio.run_in('db', metrics._current.get)
+            finally:
+                metrics._current.reset(token)
+        self.assertIs(async_to_sync(query)(), current)
+
+    @override_settings(SLOW_REQUEST_THRESHOLD=0)
+    def test_slow_request_log(self):
+        make_surveys(1)
+        with self.assertLogs('myapp.slow_requests', 'WARNING') as logs:
+            self.client.get('/api/surveys/')
+        self.assertIn('survey-list', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+    def test_access_restricted(self):
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.8').status_code, 403)
+        staff = UserProfile.objects.create_user(username='ops', password='pass1234', is_staff=True)
+        self.client.force_login(staff)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.8').status_code, 200)
+
+    @override_settings(METRICS_ALLOWED_IPS=[], METRICS_TOKEN='scrape-secret')
+    def test_bearer_token(self):
+        client = APIClient()
+        self.assertEqual(client.get('/metrics').status_code, 403)
+        self.assertEqual(client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        self.assertEqual(client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-secret').status_code, 200)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), CHUNKED_UPLOAD_MIN_CHUNK_SIZE=1)
+class UploadValidationTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.survey = make_surveys(1, media_per_survey=0)[0]
+
+    def upload(self, content, media_type='IMAGE', viewset=False):
+        data = {'title': 't', 'media_type': media_type, 'category': 'FOLKLORE'}
+        if viewset:
+            data.update(survey=self.survey.pk, file_path=SimpleUploadedFile('upload.bin', content))
+            return self.client.post('/api/media-items/', data, format='multipart')
+        data['file'] = SimpleUploadedFile('upload.bin', content)
+        return self.client.post('/api/surveys/%d/upload_media/' % self.survey.pk, data, format='multipart')
+
+    def test_sniff(self):
+        self.assertEqual(uploads.sniff(b'\xff\xd8\xff\xe0\x00\x10JFIF'), 'image/jpeg')
+        self.assertEqual(uploads.sniff(b'RIFF\x24\x00\x00\x00WAVEfmt '), 'audio/wav')
+        self.assertEqual(uploads.sniff(b'\x00\x00\x00\x20ftypM4A \x00'), 'audio/mp4')
+        self.assertEqual(uploads.sniff(b'\xff\xfb\x90\x00'), 'audio/mpeg')
+        self.assertEqual(uploads.sniff('田野笔记'.encode()[:-1]), 'text/plain')
+        self.assertIsNone(uploads.sniff(b'\x00\x01\x02\x03binary'))
+
+    def test_metadata_stored(self):
+        content = FILE_HEADERS['AUDIO'] + os.urandom(3000)
+        response = self.upload(content, media_type='AUDIO')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.data['mime_type'], 'audio/mpeg')
+        item = MediaItem.objects.get(pk=response.data['id'])
+        self.assertEqual(item.file_size, len(content))
+        self.assertEqual(item.checksum, hashlib.sha256(content).hexdigest())
+        self.assertEqual(item.blob.sha256, item.checksum)
+
+    def test_declared_type_must_match_content(self):
+        response = self.upload(FILE_HEADERS['IMAGE'] + b'data', media_type='AUDIO')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('media_type', response.data)
+        response = self.upload(FILE_HEADERS['IMAGE'] + b'data', media_type='AUDIO', viewset=True)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(MediaItem.objects.exists())
+
+        item = MediaItem.objects.get(pk=self.upload(FILE_HEADERS['IMAGE'] + b'data').data['id'])
+        response = self.client.patch('/api/media-items/%d/' % item.pk, {'media_type': 'VIDEO'}, format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.upload(FILE_HEADERS['VIDEO'] + b'data', media_type='VIDEO', viewset=True).status_code,
+                         201)
+
+    def test_unknown_content_rejected(self):
+        response = self.upload(b'\x00\x01\x02\x03' * 1000)
+        self.assertEqual(response.status_code, 415)
+        self.assertFalse(MediaItem.objects.exists())
+        self.assertFalse(MediaBlob.objects.exists())
+
+    @override_settings(MEDIA_UPLOAD_MAX_SIZE={'IMAGE': 4096})
+    def test_size_limit_enforced_while_streaming(self):
+        inspector = uploads.Inspector()
+        inspector.update(FILE_HEADERS['IMAGE'] + bytes(2000))
+        with self.assertRaises(uploads.UploadTooLarge):
+            inspector.update(bytes(3000))
+
+        response = self.upload(FILE_HEADERS['IMAGE'] + bytes(10000))
+        self.assertEqual(response.status_code, 413)
+        self.assertFalse(MediaItem.objects.exists())
+        self.assertEqual(self.upload(FILE_HEADERS['IMAGE'] + bytes(1000)).status_code, 201)
+
+    def test_model_save_sniffs_file(self):
+        item = MediaItem.objects.create(survey=self.survey, title='后台', media_type='DOCUMENT', category='FOLKLORE',
+                                        file_path=SimpleUploadedFile('a.pdf', FILE_HEADERS['DOCUMENT'] + b'x'))
+        self.assertEqual(item.mime_type, 'application/pdf')
+        self.assertEqual(item.file_size, len(FILE_HEADERS['DOCUMENT']) + 1)
+
+    @override_settings(MEDIA_UPLOAD_MAX_SIZE={'AUDIO': 2000})
+    def test_chunked_upload_checks(self):
+        self.client.force_authenticate(self.survey.investigator)
+        session = {
+            'survey': self.survey.pk, 'title': '录音', 'media_type': 'AUDIO', 'category': 'INTERVIEW',
+            'filename': 'a.mp3', 'total_size': 2500, 'chunk_size': 1000,
+        }
+        response = self.client.post('/api/uploads/', session, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('total_size', response.data)
+
+        response = self.client.post('/api/uploads/', dict(session, total_size=1500), format='json')
+        url = '/api/uploads/%s/' % response.data['id']
+        data = FILE_HEADERS['IMAGE'] + bytes(1000 - len(FILE_HEADERS['IMAGE']))
+        response = self.client.generic('PUT', url + 'chunks/0/', data, content_type='application/octet-stream',
+                                       HTTP_X_CHUNK_CHECKSUM=hashlib.sha256(data).hexdigest())
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(url).data['received_chunks'], [])
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class MediaMetadataTests(ApiTestCase):
+    PNG = FILE_HEADERS['IMAGE'] + b'\x00\x00\x00\x0dIHDR' + struct.pack('>II', 640, 480) + bytes(20)
+    JPEG = (b'\xff\xd8\xff\xe0' + struct.pack('>H', 16) + b'JFIF\x00' + bytes(9)
+            + b'\xff\xc0' + struct.pack('>HBHH', 17, 8, 300, 400) + bytes(12))
+    # 8kHz 单声道 16 位，2 秒
+    WAV = (b'RIFF' + struct.pack('<I', 36 + 32000) + b'WAVEfmt ' + struct.pack('<IHHIIHH', 16, 1, 1, 8000, 16000, 2, 16)
+           + b'data' + struct.pack('<I', 32000) + bytes(32000))
+
+    def setUp(self):
+        super().setUp()
+        self.survey = make_surveys(1, media_per_survey=0)[0]
+
+    def upload(self, content, media_type):
+        response = APIClient().post(
+            '/api/surveys/%d/upload_media/' % self.survey.pk,
+            {'file': SimpleUploadedFile('upload.bin', content), 'title': 't',
+             'media_type': media_type, 'category': 'FOLKLORE'},
+            format='multipart')
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.data
+
+    def test_header_parsing(self):
+        self.assertEqual(mediainfo.image_size(io.BytesIO(self.PNG), 'image/png'), (640, 480))
+        self.assertEqual(mediainfo.image_size(io.BytesIO(self.JPEG), 'image/jpeg'), (400, 300))
+        self.assertEqual(mediainfo.image_size(io.BytesIO(b'GIF89a' + struct.pack('<HH', 16, 9)), 'image/gif'),
+                         (16, 9))
+        self.assertEqual(mediainfo.wav_duration(io.BytesIO(self.WAV)), 2.0)
+        self.assertIsNone(mediainfo.image_size(io.BytesIO(b'\xff\xd8\xff'), 'image/jpeg'))
+
+    def test_metadata_filled_on_upload(self):
+        data = self.upload(self.PNG, 'IMAGE')
+        self.assertEqual((data['width'], data['height'], data['file_size']), (640, 480, len(self.PNG)))
+        data = self.upload(self.WAV, 'AUDIO')
+        self.assertEqual((data['mime_type'], data['duration']), ('audio/wav', 2.0))
+
+    def test_serving_uses_stored_metadata(self):
+        item = MediaItem.objects.get(pk=self.upload(self.JPEG, 'IMAGE')['id'])
+        url = '/api/media/%s' % item.file_path.name
+        with mock.patch.object(views, 'stat_media_file', side_effect=AssertionError('不应 stat 文件')):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(b''.join(response.streaming_content), self.JPEG)
+            self.assertEqual(response['Content-Type'], 'image/jpeg')
+            self.assertEqual(response['ETag'], '"%s"' % item.checksum)
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        # 没有元数据记录的文件仍按 stat 结果投递
+        self.assertEqual(self.client.get('/api/media/survey_files/none.png').status_code, 404)
+
+    def test_missing_file_with_metadata(self):
+        item = MediaItem.objects.get(pk=self.upload(self.JPEG, 'IMAGE')['id'])
+        os.remove(item.file_path.path)
+        self.assertEqual(self.client.get('/api/media/%s' % item.file_path.name).status_code, 404)
+
+    def test_backfill_command(self):
+        for i, content in enumerate([self.PNG, self.WAV]):
+            path = os.path.join(settings.MEDIA_ROOT, 'legacy', '%d.bin' % i)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(content)
+        MediaItem.objects.bulk_create([
+            MediaItem(survey=self.survey, title='旧图片', media_type='IMAGE', category='FOLKLORE',
+                      file_path='legacy/0.bin'),
+            MediaItem(survey=self.survey, title='旧录音', media_type='AUDIO', category='FOLKLORE',
+                      file_path='legacy/1.bin'),
+            MediaItem(survey=self.survey, title='缺失', media_type='AUDIO', category='FOLKLORE',
+                      file_path='legacy/missing.bin'),
+        ])
+        out, err = io.StringIO(), io.StringIO()
+        generation_key = caching.survey_generation_key(self.survey.pk)
+        generation = caching.get_generations([generation_key])[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('backfill_media_metadata', processes=2, batch_size=2, stdout=out, stderr=err)
+        self.assertGreater(caching.get_generations([generation_key])[0], generation)
+        self.assertIn('已回填 2 条，失败 1 条', out.getvalue())
+        self.assertIn('legacy/missing.bin', err.getvalue())
+
+        image = MediaItem.objects.get(title='旧图片')
+        self.assertEqual((image.mime_type, image.width, image.height), ('image/png', 640, 480))
+        self.assertEqual(image.checksum, hashlib.sha256(self.PNG).hexdigest())
+        audio = MediaItem.objects.get(title='旧录音')
+        self.assertEqual((audio.file_size, audio.duration), (len(self.WAV), 2.0))
+        self.assertEqual(stats.media_size(audio), len(self.WAV))
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class DerivativePipelineTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.survey = make_surveys(1, media_per_survey=0)[0]
+
+    def upload(self, media_type='IMAGE'):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = APIClient().post(
+                '/api/surveys/%d/upload_media/' % self.survey.pk,
+                {'file': SimpleUploadedFile('a.png', FILE_HEADERS[media_type] + b'truncated'), 'title': 'a',
+                 'media_type': media_type, 'category': 'FOLKLORE'},
+                format='multipart')
+        self.assertEqual(response.status_code, 201, response.content)
+        return MediaItem.objects.get(pk=response.data['id'])
+
+    def test_upload_enqueues_job(self):
+        item = self.upload()
+        self.assertEqual(item.derivative_jobs.get().status, 'PENDING')
+        self.upload(media_type='DOCUMENT')
+        self.assertEqual(DerivativeJob.objects.count(), 1)
+
+    def test_jobs_are_claimed_once(self):
+        self.upload()
+        self.upload()
+        first = derivatives.claim_jobs(1)
+        second = derivatives.claim_jobs(5)
+        self.assertEqual(len(first), 1)
+        self.assertEqual(len(second), 1)
+        self.assertNotEqual(first, second)
+        self.assertEqual(derivatives.claim_jobs(5), [])
+
+    def test_failed_job_records_error(self):
+        self.upload()
+        job_id = derivatives.claim_jobs(1)[0]
+        status = derivatives.process_job(job_id)
+        job = DerivativeJob.objects.get(pk=job_id)
+        self.assertIn(status, ('PENDING', 'FAILED'))
+        self.assertEqual(job.status, status)
+        self.assertEqual(job.attempts, 1)
+        self.assertTrue(job.error)
+
+    def test_retry_waits_for_backoff(self):
+        self.upload()
+        job_id = derivatives.claim_jobs(1)[0]
+        with mock.patch.object(derivatives, 'generate_derivatives', side_effect=OSError('磁盘错误')):
+            self.assertEqual(derivatives.process_job(job_id), 'PENDING')
+        self.assertEqual(derivatives.claim_jobs(1), [])
+        DerivativeJob.objects.filter(pk=job_id).update(
+            updated_at=timezone.now() - datetime.timedelta(seconds=settings.DERIVATIVE_RETRY_DELAY))
+        self.assertEqual(derivatives.claim_jobs(1), [job_id])
+
+    def test_job_of_deleted_media_item(self):
+        item = self.upload()
+        job_id = derivatives.claim_jobs(1)[0]
+        item.delete()
+        self.assertEqual(derivatives.process_job(job_id), 'DELETED')
+
+    def test_variants_in_serializer(self):
+        item = self.upload()
+        MediaDerivative.objects.create(
+            media_item=item, variant='thumb', file='derivatives/1_thumb.jpg', width=256, height=128)
+        data = APIClient().get('/api/media-items/%d/' % item.pk).data
+        self.assertEqual(data['variants']['thumb']['width'], 256)
+        self.assertTrue(data['variants']['thumb']['url'].endswith('/media/derivatives/1_thumb.jpg'))
+
+
+class GeoFilterTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        investigator = UserProfile.objects.create_user(username='geo', password='pass1234')
+        today = datetime.date.today()
+        self.points = {}
+        for name, lon, lat in [('昆明', 102.71, 25.04), ('大理', 100.23, 25.61),
+                               ('丽江', 100.23, 26.87), ('北京', 116.40, 39.90),
+                               ('斐济', 179.95, -17.7), ('萨摩亚', -179.9, -17.6)]:
+            self.points[name] = Survey.objects.create(
+                name=name, longitude=lon, latitude=lat, start_date=today, end_date=today,
+                investigator=investigator)
+
+    def names(self, query):
+        response = APIClient().get('/api/surveys/?page_size=100&' + query)
+        self.assertEqual(response.status_code, 200, response.content)
+        return {row['name'] for row in response.data['results']}
+
+    def test_grid_cell_saved(self):
+        survey = self.points['昆明']
+        self.assertEqual((survey.grid_x, survey.grid_y), geo.grid_cell(102.71, 25.04))
+
+    def test_bbox(self):
+        self.assertEqual(self.names('bbox=100,25,103,26'), {'昆明', '大理'})
+
+    def test_bbox_across_antimeridian(self):
+        self.assertEqual(self.names('bbox=179,-18,-179,-17'), {'斐济', '萨摩亚'})
+
+    def test_radius(self):
+        # 昆明到大理约 250 公里
+        self.assertEqual(self.names('lat=25.04&lon=102.71&radius=100'), {'昆明'})
+        self.assertEqual(self.names('lat=25.04&lon=102.71&radius=300'), {'昆明', '大理'})
+
+    def test_invalid_params(self):
+        response = APIClient().get('/api/surveys/?bbox=1,2,3')
+        self.assertEqual(response.status_code, 400)
+
+
+class FilterTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = UserProfile.objects.create_user(username='alice', password='pass1234')
+        self.bob = UserProfile.objects.create_user(username='bob', password='pass1234')
+        self.winter = Survey.objects.create(
+            name='冬季', longitude=100.0, latitude=25.0, investigator=self.alice,
+            start_date=datetime.date(2026, 1, 1), end_date=datetime.date(2026, 1, 31))
+        self.spring = Survey.objects.create(
+            name='春季', longitude=100.1, latitude=25.1, investigator=self.bob,
+            start_date=datetime.date(2026, 2, 10), end_date=datetime.date(2026, 3, 10))
+        self.empty = Survey.objects.create(
+            name='无资料', longitude=100.2, latitude=25.2, investigator=self.alice,
+            start_date=datetime.date(2026, 4, 1), end_date=datetime.date(2026, 4, 2))
+        for survey, media_type, category in [(self.winter, 'IMAGE', 'FOLKLORE'),
+                                             (self.winter, 'AUDIO', 'INTERVIEW'),
+                                             (self.spring, 'IMAGE', 'INTERVIEW')]:
+            MediaItem.objects.create(survey=survey, title=survey.name, media_type=media_type, category=category,
+                                     file_path='survey_files/test/%s.bin' % media_type)
+        Survey.objects.filter(pk=self.winter.pk).update(
+            created_at=timezone.make_aware(datetime.datetime(2025, 12, 1)))
+
+    def names(self, query):
+        response = APIClient().get('/api/surveys/?page_size=100&' + query)
+        self.assertEqual(response.status_code, 200, response.content)
+        return {row['name'] for row in response.data['results']}
+
+    def media_titles(self, query):
+        response = APIClient().get('/api/media-items/?' + query)
+        self.assertEqual(response.status_code, 200, response.content)
+        return sorted((row['title'], row['media_type']) for row in response.data)
+
+    def test_investigator(self):
+        self.assertEqual(self.names('investigator=%d' % self.alice.pk), {'冬季', '无资料'})
+
+    def test_date_overlap(self):
+        self.assertEqual(self.names('date_from=2026-01-20&date_to=2026-02-10'), {'冬季', '春季'})
+        self.assertEqual(self.names('date_from=2026-03-11'), {'无资料'})
+        self.assertEqual(self.names('date_to=2026-01-01'), {'冬季'})
+
+    def test_created_window(self):
+        self.assertEqual(self.names('created_before=2026-01-01T00:00:00'), {'冬季'})
+        self.assertEqual(self.names('created_after=2026-01-01T00:00:00'), {'春季', '无资料'})
+
+    def test_media_conditions_match_same_item(self):
+        self.assertEqual(self.names('category=INTERVIEW'), {'冬季', '春季'})
+        self.assertEqual(self.names('media_type=IMAGE&category=INTERVIEW'), {'春季'})
+        self.assertEqual(self.names('media_type=AUDIO&media_type=VIDEO'), {'冬季'})
+
+    def test_has_media(self):
+        self.assertEqual(self.names('has_media=true'), {'冬季', '春季'})
+        self.assertEqual(self.names('has_media=false'), {'无资料'})
+
+    def test_media_filters_use_single_query(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.names('has_media=true&media_type=IMAGE&investigator=%d' % self.alice.pk)
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertIn('EXISTS', ctx.captured_queries[0]['sql'])
+
+    def test_invalid_value(self):
+        self.assertEqual(APIClient().get('/api/surveys/?media_type=TEXT').status_code, 400)
+        self.assertEqual(APIClient().get('/api/surveys/?date_from=yesterday').status_code, 400)
+        self.assertEqual(APIClient().get('/api/export/surveys/?media_type=TEXT').status_code, 400)
+
+    def test_media_items(self):
+        self.assertEqual(self.media_titles('survey=%d' % self.spring.pk), [('春季', 'IMAGE')])
+        self.assertEqual(self.media_titles('media_type=IMAGE&category=INTERVIEW'), [('春季', 'IMAGE')])
+        self.assertEqual(self.media_titles('investigator=%d&media_type=AUDIO&media_type=IMAGE' % self.alice.pk),
+                         [('冬季', 'AUDIO'), ('冬季', 'IMAGE')])
+
+    def test_export(self):
+        response = self.client.get('/api/export/surveys/?has_media=false')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode('utf-8').splitlines()]
+        self.assertEqual([row['name'] for row in rows], ['无资料'])
+
+class ClusterTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.investigator = UserProfile.objects.create_user(username='cluster', password='pass1234')
+
+    def add(self, lon, lat):
+        today = datetime.date.today()
+        with self.captureOnCommitCallbacks(execute=True):
+            return Survey.objects.create(name='点', longitude=lon, latitude=lat, start_date=today,
+                                         end_date=today, investigator=self.investigator)
+
+    def clusters(self, zoom, bbox='97,21,106,29'):
+        response = APIClient().get('/api/surveys/clusters/?zoom=%d&bbox=%s' % (zoom, bbox))
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.data['clusters']
+
+    def test_points_merge_at_low_zoom(self):
+        self.add(102.71, 25.04)
+        self.add(102.72, 25.05)
+        self.add(100.23, 25.61)
+        self.assertEqual(sorted(c['count'] for c in self.clusters(1)), [3])
+        high = self.clusters(8, bbox='100,25,103,26')
+        self.assertEqual(sorted(c['count'] for c in high), [1, 2])
+        pair = [c for c in high if c['count'] == 2][0]
+        self.assertAlmostEqual(pair['longitude'], 102.715)
+        self.assertEqual(pair['bounds'], [102.71, 25.04, 102.72, 25.05])
+
+    def test_tiles_cached_and_invalidated(self):
+        survey = self.add(102.71, 25.04)
+        self.assertEqual(self.clusters(6)[0]['count'], 1)
+        self.assertTrue(ClusterTile.objects.filter(zoom=6).exists())
+
+        self.add(102.72, 25.05)
+        self.assertEqual(self.clusters(6)[0]['count'], 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            survey.delete()
+        self.assertEqual(self.clusters(6)[0]['count'], 1)
+
+    def test_moved_survey_leaves_old_tile(self):
+        survey = self.add(102.71, 25.04)
+        self.assertEqual(len(self.clusters(8)), 1)
+        survey.longitude, survey.latitude = 116.40, 39.90
+        with self.captureOnCommitCallbacks(execute=True):
+            survey.save()
+        self.assertEqual(self.clusters(8), [])
+
+    def test_invalidate_many_points(self):
+        self.add(102.71, 25.04)
+        self.clusters(6)
+        points = [(97 + i * 0.013, 21 + i * 0.011) for i in range(500)] + [(102.71, 25.04)]
+        with CaptureQueriesContext(connection) as queries:
+            clustering.invalidate(points)
+        x, y = clustering.tile_xy(102.71, 25.04, 6)
+        self.assertFalse(ClusterTile.objects.filter(zoom=6, tile_x=x, tile_y=y).exists())
+        self.assertLess(len(queries), 100)
+
+    def test_high_zoom_not_stored_and_empty_tiles_cached(self):
+        self.add(102.71, 25.04)
+        self.assertEqual(len(self.clusters(16, bbox='102.70,25.03,102.72,25.05')), 1)
+        self.assertFalse(ClusterTile.objects.exists())
+        self.assertEqual(self.clusters(6, bbox='0.5,0.5,1,1'), [])
+        self.assertEqual(ClusterTile.objects.get().clusters, [])
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.clusters(6, bbox='0.5,0.5,1,1'), [])
+        self.assertFalse([q for q in queries.captured_queries if 'myapp_survey' in q['sql']])
+
+    def test_low_zoom_tiles_refreshed_by_ttl(self):
+        self.add(102.71, 25.04)
+        self.assertEqual(self.clusters(2)[0]['count'], 1)
+        self.add(102.72, 25.05)
+        self.assertEqual(self.clusters(2)[0]['count'], 1)
+        self.assertEqual(self.clusters(settings.CLUSTER_INVALIDATE_MIN_ZOOM)[0]['count'], 2)
+        ClusterTile.objects.update(updated_at=timezone.now() - datetime.timedelta(
+            seconds=settings.CLUSTER_TILE_TTL + 1))
+        self.assertEqual(self.clusters(2)[0]['count'], 2)
+
+    def test_cells_match_tile_xy(self):
+        # 含瓦片和格子边界上的点，SQL 中的划分应与 tile_xy 一致
+        points = [(0.0, 0.0), (-180.0, 0.0), (180.0, -85.0), (90.0, 45.0), (102.71, 25.04), (102.72, 25.05)]
+        points += [(-170 + i * 7.3, -80 + i * 3.9) for i in range(40)]
+        for lon, lat in points:
+            self.add(lon, lat)
+        zoom = 3
+        expected = {}
+        for lon, lat in points:
+            tile = clustering.tile_xy(lon, lat, zoom)
+            cell = clustering.tile_xy(lon, lat, zoom + clustering.CELL_BITS)
+            expected.setdefault(tile, {}).setdefault(cell, 0)
+            expected[tile][cell] += 1
+        for x in range(2 ** zoom):
+            for y in range(2 ** zoom):
+                counts = sorted(c['count'] for c in clustering.compute_tile(zoom, x, y))
+                self.assertEqual(counts, sorted(expected.get((x, y), {}).values()), (x, y))
+
+    def test_expired_tile_recomputed(self):
+        survey = self.add(102.71, 25.04)
+        self.clusters(6)
+        # 模拟与计算并发的失效：表中留下了不含新点的旧瓦片
+        Survey.objects.filter(pk=survey.pk).update(longitude=102.72)
+        Survey.objects.create(name='点', longitude=102.73, latitude=25.05, start_date=survey.start_date,
+                              end_date=survey.end_date, investigator=self.investigator)
+        self.assertEqual(self.clusters(6)[0]['count'], 1)
+        ClusterTile.objects.update(updated_at=timezone.now() - datetime.timedelta(
+            seconds=settings.CLUSTER_TILE_TTL + 1))
+        self.assertEqual(self.clusters(6)[0]['count'], 2)
+
+    def test_requires_params(self):
+        self.assertEqual(APIClient().get('/api/surveys/clusters/?zoom=3').status_code, 400)
+
+
+class SearchTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        survey = make_surveys(1, media_per_survey=0)[0]
+        survey.name = '大理白族火把节调查'
+        survey.save()
+        self.survey = survey
+        self.interview = MediaItem.objects.create(
+            survey=survey, title='火把节访谈录音', description='采访村中老人关于节日起源的口述',
+            media_type='AUDIO', category='INTERVIEW', file_path='a.mp3')
+        self.photo = MediaItem.objects.create(
+            survey=survey, title='Torch festival photo', description='白族 dancers',
+            media_type='IMAGE', category='FOLKLORE', file_path='b.jpg')
+
+    def search(self, query, **params):
+        params['q'] = query
+        response = APIClient().get('/api/search/', params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return [(r['type'], r['id']) for r in response.data['results']]
+
+    def test_tokenize(self):
+        self.assertEqual(search.tokenize('火把节 Torch'), ['火把', '把节', 'torch'])
+
+    def test_cjk_substring(self):
+        self.assertEqual(set(self.search('火把节')), {
+            ('survey', self.survey.pk), ('media', self.interview.pk)})
+        self.assertEqual(self.search('口述'), [('media', self.interview.pk)])
+        self.assertEqual(self.search('族', type='media'), [('media', self.photo.pk)])
+
+    def test_latin_prefix_and_and(self):
+        self.assertEqual(self.search('fest'), [('media', self.photo.pk)])
+        self.assertEqual(self.search('白族 dancers'), [('media', self.photo.pk)])
+
+    def test_title_ranks_higher(self):
+        # 标题命中的资料排在只在描述中命中的前面
+        other = MediaItem.objects.create(
+            survey=self.survey, title='其他', description='有关火把节的笔记',
+            media_type='DOCUMENT', category='LITERATURE', file_path='c.pdf')
+        results = self.search('火把节', type='media')
+        self.assertEqual(results, [('media', self.interview.pk), ('media', other.pk)])
+
+    def test_index_follows_updates_and_deletes(self):
+        self.interview.title = '山歌'
+        self.interview.description = ''
+        self.interview.save()
+        self.assertEqual(self.search('山歌'), [('media', self.interview.pk)])
+        self.assertEqual(self.search('口述'), [])
+        self.interview.delete()
+        self.assertEqual(self.search('山歌'), [])
+
+    def test_pagination(self):
+        response = APIClient().get('/api/search/', {'q': '火把', 'page_size': 1, 'page': 2})
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual(len(response.data['results']), 1)
+
+
+class ResponseCacheTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.survey = make_surveys(1, media_per_survey=1)[0]
+        self.detail_url = '/api/surveys/%d/' % self.survey.pk
+
+    def test_detail_cached_until_media_changes(self):
+        first = self.client.get(self.detail_url)
+        self.assertEqual(first['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            second = self.client.get(self.detail_url)
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(second.content, first.content)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            MediaItem.objects.create(survey=self.survey, title='新资料', media_type='IMAGE',
+                                     category='FOLKLORE', file_path='n.png')
+        third = self.client.get(self.detail_url)
+        self.assertEqual(third['X-Cache'], 'MISS')
+        self.assertEqual(len(third.json()['media_items']), 2)
+
+    def test_list_invalidated_by_survey_save(self):
+        self.client.get('/api/surveys/')
+        self.assertEqual(self.client.get('/api/surveys/')['X-Cache'], 'HIT')
+        self.survey.name = '改名'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.survey.save()
+        response = self.client.get('/api/surveys/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['results'][0]['name'], '改名')
+
+    def test_generation_bumped_after_commit(self):
+        self.client.get(self.detail_url)
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.survey.name = '改名'
+            self.survey.save()
+            # 提交前仍返回旧的缓存，不会在新代数下缓存未提交的数据
+            self.assertEqual(self.client.get(self.detail_url)['X-Cache'], 'HIT')
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.client.get(self.detail_url)['X-Cache'], 'MISS')
+
+    def test_investigator_change_invalidates(self):
+        self.client.get(self.detail_url)
+        investigator = self.survey.investigator
+        with self.captureOnCommitCallbacks(execute=True):
+            investigator.last_login = timezone.now()
+            investigator.save(update_fields=['last_login'])
+        self.assertEqual(self.client.get(self.detail_url)['X-Cache'], 'HIT')
+        with self.captureOnCommitCallbacks(execute=True):
+            investigator.phone = '13800000000'
+            investigator.save()
+        response = self.client.get(self.detail_url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['investigator']['phone'], '13800000000')
+
+    def test_other_survey_change_keeps_detail_cached(self):
+        self.client.get(self.detail_url)
+        make_surveys(1, investigator=self.survey.investigator)
+        self.assertEqual(self.client.get(self.detail_url)['X-Cache'], 'HIT')
+
+    def test_etag_revalidation(self):
+        etag = self.client.get(self.detail_url)['ETag']
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_query_params_in_key(self):
+        self.client.get('/api/surveys/')
+        self.assertEqual(self.client.get('/api/surveys/?expand=media')['X-Cache'], 'MISS')
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class BulkTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = UserProfile.objects.create_user(username='bulk', password='pass1234')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def survey_payload(self, i, **extra):
+        data = {'name': '导入调查%d' % i, 'longitude': 100 + i * 0.1, 'latitude': 25.0,
+                'start_date': '2024-01-01', 'end_date': '2024-01-02'}
+        data.update(extra)
+        return data
+
+    def test_bulk_create_with_item_errors(self):
+        payload = [self.survey_payload(0), self.survey_payload(1, start_date='bad'), self.survey_payload(2)]
+        with override_settings(BULK_CHUNK_SIZE=1):
+            response = self.client.post('/api/surveys/bulk/', payload, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.data['succeeded'], 2)
+        self.assertIn('start_date', response.data['results'][1]['errors'])
+        ids = [response.data['results'][i]['id'] for i in (0, 2)]
+        created = Survey.objects.in_bulk(ids)
+        self.assertEqual(created[ids[1]].name, '导入调查2')
+        self.assertEqual(created[ids[0]].investigator, self.user)
+        self.assertEqual((created[ids[0]].grid_x, created[ids[0]].grid_y), geo.grid_cell(100, 25.0))
+        self.assertEqual(search.search('导入')[0], 2)
+
+    def test_bulk_create_spread_out_points(self):
+        make_surveys(1, investigator=self.user)
+        self.client.get('/api/surveys/clusters/?zoom=6&bbox=90,10,120,40')
+        payload = [self.survey_payload(i, longitude=90 + i * 0.17, latitude=10 + i * 0.13) for i in range(150)]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/surveys/bulk/', payload, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.data['succeeded'], 150)
+        clusters = self.client.get('/api/surveys/clusters/?zoom=6&bbox=90,10,120,40').data['clusters']
+        self.assertEqual(sum(c['count'] for c in clusters), Survey.objects.count())
+
+    def test_ndjson_create(self):
+        body = '\n'.join(json.dumps(self.survey_payload(i)) for i in range(3))
+        response = self.client.generic('POST', '/api/surveys/bulk/', body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(Survey.objects.count(), 3)
+
+    def test_bulk_update_and_delete(self):
+        surveys = make_surveys(3, media_per_survey=0, investigator=self.user)
+        response = self.client.patch('/api/surveys/bulk/', [
+            {'id': surveys[0].pk, 'name': '已更新', 'longitude': 110.0},
+            {'id': 999999, 'name': 'x'},
+        ], format='json')
+        self.assertEqual(response.data['succeeded'], 1)
+        updated = Survey.objects.get(pk=surveys[0].pk)
+        self.assertEqual(updated.name, '已更新')
+        self.assertEqual(updated.grid_x, geo.grid_cell(110.0, updated.latitude)[0])
+        self.assertGreater(updated.updated_at, surveys[0].updated_at)
+
+        response = self.client.delete('/api/surveys/bulk/', {'ids': [surveys[1].pk, surveys[2].pk]}, format='json')
+        self.assertEqual(response.data['succeeded'], 2)
+        self.assertEqual(Survey.objects.count(), 1)
+
+    def test_non_integer_ids_rejected_per_item(self):
+        survey = make_surveys(1, media_per_survey=0, investigator=self.user)[0]
+        response = self.client.patch('/api/surveys/bulk/', [
+            {'id': [survey.pk], 'name': 'x'}, {'id': {}, 'name': 'x'}, {'id': survey.pk, 'name': '已更新'},
+        ], format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual([sorted(r) for r in response.data['results']],
+                         [['errors', 'index'], ['errors', 'index'], ['id', 'index']])
+
+        response = self.client.delete('/api/surveys/bulk/', [[survey.pk], {}, True], format='json')
+        self.assertEqual(response.status_code, 400, response.content)
+        self.assertEqual(response.data['failed'], 3)
+        self.assertTrue(Survey.objects.filter(pk=survey.pk).exists())
+
+        response = self.client.post('/api/media-items/bulk/', [
+            {'survey': [survey.pk], 'title': 'x', 'media_type': 'DOCUMENT', 'category': 'LITERATURE',
+             'file_path': 'imports/a.pdf'},
+            {'survey': {}, 'title': 'x', 'media_type': 'DOCUMENT', 'category': 'LITERATURE',
+             'file_path': 'imports/a.pdf'},
+        ], format='json')
+        self.assertEqual(response.status_code, 400, response.content)
+        self.assertTrue(all('survey' in r['errors'] for r in response.data['results']))
+
+    def test_bulk_media_validates_survey_and_file(self):
+        survey = make_surveys(1, media_per_survey=0, investigator=self.user)[0]
+        path = os.path.join(settings.MEDIA_ROOT, 'imports', 'a.pdf')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, 'wb').close()
+        item = {'survey': survey.pk, 'title': '文献', 'media_type': 'DOCUMENT',
+                'category': 'LITERATURE', 'file_path': 'imports/a.pdf'}
+        # 含统计汇总的一条 upsert
+        with self.assertNumQueries(8):
+            response = self.client.post('/api/media-items/bulk/', [
+                item, dict(item, survey=999999), dict(item, file_path='../secret'),
+            ], format='json')
+        results = response.data['results']
+        self.assertIn('id', results[0])
+        self.assertIn('survey', results[1]['errors'])
+        self.assertIn('file_path', results[2]['errors'])
+        self.assertEqual(MediaItem.objects.get(pk=results[0]['id']).file_path.name, 'imports/a.pdf')
+
+    def test_bulk_media_rejects_blob_files(self):
+        survey = make_surveys(1, media_per_survey=0, investigator=self.user)[0]
+        staged = os.path.join(blob_storage.staging_dir(), 'upload-x')
+        open(staged, 'wb').close()
+        blob = os.path.join(settings.MEDIA_ROOT, blob_storage.blob_dir, 'ab', 'cd', 'abcd.pdf')
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        open(blob, 'wb').close()
+        item = {'survey': survey.pk, 'title': '文献', 'media_type': 'DOCUMENT', 'category': 'LITERATURE'}
+        response = self.client.post('/api/media-items/bulk/', [
+            dict(item, file_path='blobs/tmp/upload-x'), dict(item, file_path='/media/blobs/ab/cd/abcd.pdf'),
+        ], format='json')
+        self.assertEqual(response.status_code, 400, response.content)
+        self.assertTrue(all('file_path' in r['errors'] for r in response.data['results']))
+
+    def test_requires_authentication(self):
+        response = APIClient().post('/api/surveys/bulk/', [self.survey_payload(0)], format='json')
+        self.assertIn(response.status_code, (401, 403))
+
+
+class ExportTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.surveys = make_surveys(3, media_per_survey=2)
+        make_surveys(1, media_per_survey=0, investigator=self.surveys[0].investigator)
+
+    def export(self, query=''):
+        response = self.client.get('/api/export/surveys/' + query)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_ndjson(self):
+        with override_settings(EXPORT_CHUNK_SIZE=1):
+            lines = [json.loads(line) for line in self.export('?format=ndjson').splitlines()]
+        self.assertEqual([row['id'] for row in lines], sorted(s.pk for s in Survey.objects.all()))
+        self.assertEqual([row['media_count'] for row in lines], [2, 2, 2, 0])
+        self.assertEqual(lines[0]['media_items'][0]['title'], '资料0-0')
+        self.assertEqual(lines[0]['investigator'], 'investigator')
+
+    def test_csv(self):
+        rows = list(csv.DictReader(io.StringIO(self.export('?format=csv').lstrip('﻿'))))
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[0]['name'], '调查0')
+        self.assertEqual(rows[0]['media_count'], '2')
+
+    def test_geojson_with_bbox(self):
+        data = json.loads(self.export('?format=geojson&media=0&bbox=99,24,100.015,26'))
+        self.assertEqual(len(data['features']), 3)
+        self.assertEqual(data['features'][0]['geometry']['coordinates'], [100.0, 25.0])
+        self.assertNotIn('media_items', data['features'][0]['properties'])
+
+    def test_bad_format(self):
+        self.assertEqual(self.client.get('/api/export/surveys/?format=xml').status_code, 400)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class MediaArchiveTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.survey = make_surveys(1, media_per_survey=2)[0]
+        MediaItem.objects.create(survey=self.survey, title='录音', media_type='AUDIO', category='FOLKLORE',
+                                 file_path='survey_files/test/song.mp3')
+        MediaItem.objects.create(survey=self.survey, title='缺失', media_type='IMAGE', category='FOLKLORE',
+                                 file_path='survey_files/test/missing.png')
+        self.contents = {}
+        for i, name in enumerate(['0_0.png', '0_1.png', 'song.mp3']):
+            content = os.urandom(1000 + i * 517)
+            path = os.path.join(settings.MEDIA_ROOT, 'survey_files', 'test', name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(content)
+            self.contents[name] = content
+        self.url = '/api/surveys/%d/media-archive/' % self.survey.pk
+
+    def download(self, query='', **headers):
+        response = self.client.get(self.url + query, **headers)
+        return response, b''.join(response.streaming_content) if response.streaming else response.content
+
+    def test_archive_contents(self):
+        response, data = self.download()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(int(response['Content-Length']), len(data))
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            self.assertIsNone(archive.testzip())
+            infos = archive.infolist()
+            self.assertEqual(len(infos), 3)
+            self.assertTrue(all(info.compress_type == zipfile.ZIP_STORED for info in infos))
+            for info in infos:
+                self.assertEqual(archive.read(info), self.contents[info.filename.split('_', 1)[1]])
+
+    def test_filter(self):
+        _, data = self.download('?media_type=AUDIO')
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            self.assertEqual([info.filename.split('/')[0] for info in archive.infolist()], ['audio'])
+        response, _ = self.download('?category=NOPE')
+        self.assertEqual(response.status_code, 400)
+
+    def test_range_resume(self):
+        response, full = self.download()
+        etag = response['ETag']
+        caches['default'].clear()
+        for start in (0, 30, 1100, len(full) - 40):
+            response, part = self.download(HTTP_RANGE='bytes=%d-' % start, HTTP_IF_RANGE=etag)
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(part, full[start:])
+        response, _ = self.download(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_zip64_records(self):
+        files = [('a/%s' % name, os.path.join(settings.MEDIA_ROOT, 'survey_files', 'test', name),
+                  os.stat(os.path.join(settings.MEDIA_ROOT, 'survey_files', 'test', name)))
+                 for name in self.contents]
+        with mock.patch.object(zipstream, 'ZIP64_LIMIT', 500), \
+                mock.patch.object(zipstream, 'ZIP_FILECOUNT_LIMIT', 2):
+            archive = zipstream.ZipStream(files)
+            data = b''.join(archive)
+        self.assertEqual(len(data), archive.size)
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(archive.read('a/song.mp3'), self.contents['song.mp3'])
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class StatisticsTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.surveys = make_surveys(3, media_per_survey=2)
+        self.user = self.surveys[0].investigator
+
+    def assertInSync(self):
+        self.assertEqual(stats.reconcile(dry_run=True), [])
+
+    def test_signals_keep_counters_in_sync(self):
+        self.assertInSync()
+        MediaItem.objects.create(survey=self.surveys[1], title='录音', media_type='AUDIO', category='INTERVIEW',
+                                 file_path=SimpleUploadedFile('a.mp3', b'x' * 1234))
+        self.assertInSync()
+        media_item = self.surveys[0].media_items.first()
+        media_item.media_type = 'VIDEO'
+        media_item.survey = self.surveys[2]
+        media_item.save()
+        self.assertInSync()
+        self.surveys[1].media_items.first().delete()
+        self.assertInSync()
+        other = UserProfile.objects.create_user(username='other', password='pass1234')
+        self.surveys[2].investigator = other
+        self.surveys[2].save()
+        self.assertInSync()
+        self.surveys[1].delete()
+        self.assertInSync()
+        self.assertFalse(StatCounter.objects.filter(key=str(self.surveys[1].pk),
+                                                    dimension__in=stats.PER_SURVEY_DIMENSIONS).exists())
+
+    def test_survey_save_reads_old_row_once(self):
+        survey = self.surveys[0]
+        survey.name = '改名'
+        with CaptureQueriesContext(connection) as ctx:
+            survey.save()
+        selects = [q['sql'] for q in ctx.captured_queries
+                   if q['sql'].startswith('SELECT') and 'FROM "myapp_survey"' in q['sql']]
+        self.assertEqual(len(selects), 1, selects)
+        self.assertInSync()
+
+    def test_bulk_writes_keep_counters_in_sync(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post('/api/surveys/bulk/', [
+            {'name': '导入', 'longitude': 100, 'latitude': 25, 'start_date': '2024-01-01', 'end_date': '2024-01-01'},
+        ], format='json')
+        self.assertEqual(response.data['succeeded'], 1)
+        media_item = self.surveys[0].media_items.first()
+        response = client.patch('/api/media-items/bulk/', [
+            {'id': media_item.pk, 'survey': self.surveys[1].pk, 'category': 'INTERVIEW'},
+        ], format='json')
+        self.assertEqual(response.data['succeeded'], 1)
+        self.assertInSync()
+
+    def test_endpoint(self):
+        MediaItem.objects.create(survey=self.surveys[1], title='录音', media_type='AUDIO', category='INTERVIEW',
+                                 file_path=SimpleUploadedFile('a.mp3', b'x' * 1234))
+        with self.assertNumQueries(5):
+            response = self.client.get('/api/statistics/')
+        data = response.json()
+        self.assertEqual(data['totals'], {'surveys': 3, 'media_items': 7, 'storage_bytes': 1234})
+        self.assertEqual(data['surveys_per_investigator'],
+                         [{'investigator': self.user.pk, 'username': 'investigator', 'count': 3}])
+        self.assertEqual(data['media_per_type']['IMAGE'], 6)
+        self.assertEqual(data['media_per_category']['INTERVIEW'], 1)
+        self.assertEqual(data['surveys_per_month'], [{'month': stats.month_key(self.surveys[0].created_at),
+                                                      'count': 3}])
+        self.assertEqual(data['storage_per_survey'],
+                         [{'survey': self.surveys[1].pk, 'name': '调查1', 'media_count': 3, 'bytes': 1234}])
+
+    def test_reconcile_command(self):
+        StatCounter.objects.filter(dimension=stats.TOTAL, key='surveys').update(value=99)
+        StatCounter.objects.create(dimension=stats.MEDIA_TYPE, key='STALE', value=4)
+        out = io.StringIO()
+        call_command('reconcile_statistics', stdout=out)
+        self.assertIn('total:surveys 99 -> 3', out.getvalue())
+        self.assertInSync()
+        self.assertFalse(StatCounter.objects.filter(key='STALE').exists())
+
+
+class SessionTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        UserProfile.objects.create_user(username='fieldwork', password='pass1234')
+        response = self.client.post('/api/auth/session/login/', {'username': 'fieldwork', 'password': 'pass1234'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        self.assertEqual(response.data['user']['username'], 'fieldwork')
+
+    def test_reads_do_not_write_session(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/auth/user/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['username'], 'fieldwork')
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+
+    def test_session_refreshed_after_interval(self):
+        later = time.time() + settings.SESSION_REFRESH_INTERVAL + 1
+        with mock.patch('myapp.middleware.time.time', return_value=later):
+            response = self.client.get('/api/auth/user/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.cookies[settings.SESSION_COOKIE_NAME]['max-age'], settings.SESSION_COOKIE_AGE)
+        # 刷新后间隔内不再写入
+        with mock.patch('myapp.middleware.time.time', return_value=later + 1):
+            response = self.client.get('/api/auth/user/')
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+
+    def test_logout(self):
+        response = self.client.post('/api/auth/session/logout/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.cookies[settings.SESSION_COOKIE_NAME].value, '')
+        self.assertEqual(self.client.get('/api/auth/user/').status_code, 401)
+
+
+class TokenAuthenticationTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = UserProfile.objects.create_user(username='tokenuser', password='pass1234')
+        response = self.client.post('/api/auth/login/', {'username': 'tokenuser', 'password': 'pass1234'},
+                                    content_type='application/json')
+        self.token = response.json()['token']
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token)
+
+    def test_cached_after_first_request(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get('/api/auth/user/').status_code, 200)
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/auth/user/')
+        self.assertEqual(response.data['username'], 'tokenuser')
+
+    def test_logout_revokes_cached_token(self):
+        self.client.get('/api/auth/user/')
+        self.assertEqual(self.client.post('/api/auth/logout/').status_code, 200)
+        self.assertEqual(self.client.get('/api/auth/user/').status_code, 401)
+
+    def test_revocation_marker_reaches_other_processes(self):
+        self.client.get('/api/auth/user/')
+        # 模拟其他进程删除 token：本进程的缓存条目仍在，只能依靠共享缓存中的吊销标记
+        Token.objects.filter(key=self.token).delete()
+        authentication.token_cache.set(self.token, (self.user, Token(key=self.token, user=self.user,
+                                                                     created=timezone.now())))
+        self.assertEqual(self.client.get('/api/auth/user/').status_code, 401)
+
+    def test_deactivated_user_is_rejected(self):
+        self.client.get('/api/auth/user/')
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/auth/user/').status_code, 401)
+
+    def test_expired_token(self):
+        expired = timezone.now() - datetime.timedelta(seconds=settings.TOKEN_EXPIRE_AFTER + 1)
+        Token.objects.filter(key=self.token).update(created=expired)
+        self.assertEqual(self.client.get('/api/auth/user/').status_code, 401)
+        self.assertFalse(Token.objects.filter(key=self.token).exists())
+
+        response = APIClient().post('/api/auth/login/', {'username': 'tokenuser', 'password': 'pass1234'},
+                                    format='json')
+        self.assertNotEqual(response.data['token'], self.token)
+
+    def test_purge_command(self):
+        other = UserProfile.objects.create_user(username='stale', password='pass1234')
+        stale = Token.objects.create(user=other)
+        Token.objects.filter(pk=stale.pk).update(
+            created=timezone.now() - datetime.timedelta(seconds=settings.TOKEN_EXPIRE_AFTER + 1))
+        call_command('purge_expired_tokens', stdout=io.StringIO())
+        self.assertEqual(list(Token.objects.values_list('key', flat=True)), [self.token])
+
+    @override_settings(TOKEN_CACHE_SIZE=2)
+    def test_cache_is_bounded(self):
+        cache = authentication.TokenCache()
+        for key in 'abc':
+            cache.set(key, key)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('c'), 'c')
+
+
+@override_settings(LOGIN_RATE_LIMITS={'username': (3, 60), 'ip': (5, 60)})
+class LoginProtectionTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = UserProfile.objects.create_user(username='ratelimited', password='pass1234')
+
+    def login(self, username, password='wrong', url='/api/auth/login/', ip='10.0.0.1'):
+        return self.client.post(url, {'username': username, 'password': password},
+                                content_type='application/json', REMOTE_ADDR=ip)
+
+    def test_username_limit_rejects_before_hashing(self):
+        for _ in range(3):
+            self.assertEqual(self.login('ratelimited').status_code, 401)
+        with mock.patch('myapp.views.authenticate') as authenticate:
+            response = self.login('ratelimited', 'pass1234', ip='10.0.0.2')
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+        authenticate.assert_not_called()
+        # 其他用户名不受影响
+        self.assertEqual(self.login('someone', ip='10.0.0.2').status_code, 401)
+
+    def test_ip_limit_applies_to_session_login(self):
+        for i in range(5):
+            self.assertEqual(self.login('user%d' % i, url='/api/auth/session/login/').status_code, 401)
+        self.assertEqual(self.login('other', url='/api/auth/session/login/').status_code, 429)
+        self.assertEqual(self.login('other', url='/api/auth/session/login/', ip='10.0.0.9').status_code, 401)
+
+    @override_settings(TRUSTED_PROXY_IPS=['127.0.0.1'])
+    def test_client_ip_behind_proxy(self):
+        for i in range(5):
+            self.client.post('/api/auth/login/', {'username': 'user%d' % i, 'password': 'wrong'},
+                             content_type='application/json', REMOTE_ADDR='127.0.0.1',
+                             HTTP_X_FORWARDED_FOR='1.2.3.4, 10.0.0.5')
+        response = self.client.post('/api/auth/login/', {'username': 'other', 'password': 'wrong'},
+                                    content_type='application/json', REMOTE_ADDR='127.0.0.1',
+                                    HTTP_X_FORWARDED_FOR='10.0.0.6')
+        self.assertEqual(response.status_code, 401)
+        # 不可信来源伪造的 X-Forwarded-For 不被采用
+        request = mock.Mock(META={'REMOTE_ADDR': '10.0.0.7', 'HTTP_X_FORWARDED_FOR': '1.1.1.1'})
+        self.assertEqual(ratelimit.client_ip(request), '10.0.0.7')
+
+    def test_non_string_username_rejected(self):
+        for url in ('/api/auth/login/', '/api/auth/session/login/'):
+            response = self.client.post(url, {'username': ['a'], 'password': 'x'}, content_type='application/json')
+            self.assertEqual(response.status_code, 400, url)
+
+    def test_success_resets_username_counter(self):
+        for _ in range(2):
+            self.login('ratelimited')
+        self.assertEqual(self.login('ratelimited', 'pass1234').status_code, 200)
+        for _ in range(2):
+            self.assertEqual(self.login('ratelimited').status_code, 401)
+
+    def test_sliding_window(self):
+        window = 60
+        base = 1200.0
+        for _ in range(4):
+            ratelimit.record('k', window, now=base + 30)
+        # 下一窗口过了 1/4：估计值 = 4 * 3/4 + 0
+        previous, current, elapsed = ratelimit.window_counts('k', window, base + 75)
+        self.assertEqual(ratelimit.estimate(previous, current, elapsed, window), 3)
+        self.assertEqual(ratelimit.retry_after(previous, current, elapsed, 3, window), 1)
+        self.assertEqual(ratelimit.retry_after(4, 4, 0, 3, window), 75)
+
+    def test_password_rehashed_with_configured_cost(self):
+        with override_settings(PASSWORD_PBKDF2_ITERATIONS=1000):
+            self.user.set_password('cheap1234')
+            self.user.save()
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$1000$'))
+        with override_settings(PASSWORD_PBKDF2_ITERATIONS=2000):
+            self.assertEqual(self.login('ratelimited', 'cheap1234').status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$2000$'))
+
+
+class ProductionSettingsTests(TestCase):
+    def load(self, **environ):
+        sys.modules.pop('course_design.settings_production', None)
+        with mock.patch.dict(os.environ, environ, clear=True):
+            return importlib.import_module('course_design.settings_production')
+
+    def test_requires_secret_key(self):
+        with self.assertRaises(ImproperlyConfigured):
+            self.load()
+
+    def test_sqlite_profile(self):
+        module = self.load(DJANGO_SECRET_KEY='x', DJANGO_ALLOWED_HOSTS='a.example.com, b.example.com')
+        self.assertFalse(module.DEBUG)
+        self.assertEqual(module.ALLOWED_HOSTS, ['a.example.com', 'b.example.com'])
+        self.assertEqual(module.DATABASES['default']['ENGINE'], 'django.db.backends.sqlite3')
+        self.assertEqual(module.SQLITE_PRAGMAS['journal_mode'], 'WAL')
+        self.assertEqual(module.CONN_MAX_AGE, 60)
+        self.assertEqual(module.REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'],
+                         ['rest_framework.renderers.JSONRenderer'])
+        # 反向代理后所有请求都来自 127.0.0.1，/metrics 不能按地址放行
+        self.assertEqual(module.METRICS_ALLOWED_IPS, [])
+
+    def test_postgresql_behind_pgbouncer(self):
+        module = self.load(DJANGO_SECRET_KEY='x', DATABASE_ENGINE='postgresql', POSTGRES_DB='surveys',
+                           DATABASE_CONN_MAX_AGE='300', DATABASE_POOLER='pgbouncer',
+                           DJANGO_CACHE_LOCATION='memcached://127.0.0.1:11211')
+        database = module.DATABASES['default']
+        self.assertEqual(database['NAME'], 'surveys')
+        self.assertEqual(database['CONN_MAX_AGE'], 300)
+        self.assertTrue(database['DISABLE_SERVER_SIDE_CURSORS'])
+        self.assertEqual(module.CACHES['default']['LOCATION'], '127.0.0.1:11211')
+        self.assertNotEqual(module.CACHES['default']['KEY_PREFIX'], module.CACHES['api']['KEY_PREFIX'])
+
+    def test_file_cache_rejected_for_ratelimit_and_revocation(self):
+        # 文件缓存的 incr 不是原子的，并且会随机淘汰吊销标记
+        with self.assertRaises(ImproperlyConfigured):
+            self.load(DJANGO_SECRET_KEY='x', DJANGO_CACHE_LOCATION='/var/cache/surveys')
+
+    def test_file_cache_allowed_for_responses(self):
+        module = self.load(DJANGO_SECRET_KEY='x', DJANGO_API_CACHE_DIR='/var/cache/surveys')
+        self.assertEqual(module.CACHES['api']['BACKEND'], 'django.core.cache.backends.filebased.FileBasedCache')
+        self.assertEqual(module.CACHES['api']['TIMEOUT'], 300)
+        self.assertEqual(module.CACHES[module.RATELIMIT_CACHE_ALIAS]['BACKEND'],
+                         'django.core.cache.backends.memcached.PyMemcacheCache')
+        self.assertEqual(module.CACHES[module.TOKEN_REVOCATION_CACHE_ALIAS]['BACKEND'],
+                         'django.core.cache.backends.memcached.PyMemcacheCache')
+
+    def test_sqlite_pragmas_applied_to_new_connections(self):
+        path = os.path.join(tempfile.mkdtemp(), 'wal.sqlite3')
+        settings_dict = dict(connection.settings_dict, NAME=path)
+        with override_settings(SQLITE_PRAGMAS={'journal_mode': 'WAL', 'synchronous': 'NORMAL'}):
+            wrapper = connections['default'].__class__(settings_dict, alias='wal-test')
+            try:
+                with wrapper.cursor() as cursor:
+                    cursor.execute('PRAGMA journal_mode')
+                    self.assertEqual(cursor.fetchone()[0], 'wal')
+                    cursor.execute('PRAGMA synchronous')
+                    self.assertEqual(cursor.fetchone()[0], 1)
+            finally:
+                wrapper.close()
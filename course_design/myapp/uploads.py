@@ -0,0 +1,208 @@
+"""媒体上传的内容检查
+
+上传数据流过 Inspector 时一次完成：计算 SHA-256 和大小、按文件头的魔数识别真实 MIME 类型、
+按识别出的媒体类型检查 MEDIA_UPLOAD_MAX_SIZE。识别不出的类型和超限的文件在接收过程中即被拒绝，
+不会等整个文件写完。检查结果（FileInspection）挂在上传文件的 inspection 属性上，
+去重存储直接使用其中的哈希，保存 MediaItem 时写入 mime_type / file_size / checksum，之后无需重新计算。
+"""
+import hashlib
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from rest_framework import exceptions
+
+from .models import MediaItem
+
+# 识别所需的文件头长度；文本文件按这部分内容判断
+HEADER_SIZE = 512
+CHUNK_SIZE = 64 * 1024
+
+# (偏移, 魔数, MIME)，按顺序匹配
+SIGNATURES = [
+    (0, b'\xff\xd8\xff', 'image/jpeg'),
+    (0, b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (0, b'GIF87a', 'image/gif'),
+    (0, b'GIF89a', 'image/gif'),
+    (0, b'II*\x00', 'image/tiff'),
+    (0, b'MM\x00*', 'image/tiff'),
+    (0, b'BM', 'image/bmp'),
+    (0, b'ID3', 'audio/mpeg'),
+    (0, b'OggS', 'audio/ogg'),
+    (0, b'fLaC', 'audio/flac'),
+    (0, b'#!AMR', 'audio/amr'),
+    (0, b'\x1aE\xdf\xa3', 'video/webm'),
+    (0, b'\x00\x00\x01\xba', 'video/mpeg'),
+    (0, b'%PDF-', 'application/pdf'),
+    (0, b'{\\rtf', 'application/rtf'),
+    (0, b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'application/msword'),
+    # docx / xlsx / pptx 都是 zip
+    (0, b'PK\x03\x04', 'application/zip'),
+]
+
+RIFF_TYPES = {b'WEBP': 'image/webp', b'WAVE': 'audio/wav', b'AVI ': 'video/x-msvideo'}
+
+# ISO 基础媒体格式（MP4 / MOV / HEIC）的 ftyp 品牌
+FTYP_BRANDS = {
+    b'M4A ': 'audio/mp4', b'M4B ': 'audio/mp4',
+    b'qt  ': 'video/quicktime',
+    b'heic': 'image/heic', b'heix': 'image/heic', b'mif1': 'image/heif',
+    b'3gp4': 'video/3gpp', b'3gp5': 'video/3gpp',
+}
+
+DOCUMENT_TYPES = {'application/pdf', 'application/rtf', 'application/msword', 'application/zip', 'text/plain'}
+
+FileInspection = namedtuple('FileInspection', ['sha256', 'size', 'mime_type', 'media_type'])
+
+
+class UploadRejected(exceptions.APIException):
+    status_code = 415
+    default_detail = '不支持的文件类型'
+    default_code = 'unsupported_file_type'
+
+
+class UploadTooLarge(UploadRejected):
+    status_code = 413
+    default_detail = '文件过大'
+    default_code = 'file_too_large'
+
+
+def sniff(header):
+    """按文件头识别 MIME 类型，无法识别时返回 None"""
+    for offset, magic, mime_type in SIGNATURES:
+        if header[offset:offset + len(magic)] == magic:
+            return mime_type
+    if header[:4] == b'RIFF' and header[8:12] in RIFF_TYPES:
+        return RIFF_TYPES[header[8:12]]
+    if header[4:8] == b'ftyp':
+        return FTYP_BRANDS.get(header[8:12], 'video/mp4')
+    if len(header) >= 2 and header[0] == 0xff:
+        # MPEG 音频帧同步：ADTS（AAC）的 layer 位为 0，MP3 不为 0
+        if header[1] & 0xf6 == 0xf0:
+            return 'audio/aac'
+        if header[1] & 0xe0 == 0xe0 and header[1] & 0x06:
+            return 'audio/mpeg'
+    if header and b'\x00' not in header:
+        try:
+            # 文件头可能在多字节字符中间截断
+            header.decode('utf-8')
+            return 'text/plain'
+        except UnicodeDecodeError as e:
+            if e.start >= len(header) - 3 and e.reason == 'unexpected end of data':
+                return 'text/plain'
+    return None
+
+
+def media_type_for(mime_type):
+    """MIME 类型对应的 MediaItem.media_type，不接受的类型返回 None"""
+    if not mime_type:
+        return None
+    if mime_type in DOCUMENT_TYPES:
+        return 'DOCUMENT'
+    return {'image': 'IMAGE', 'audio': 'AUDIO', 'video': 'VIDEO'}.get(mime_type.split('/')[0])
+
+
+def size_limit(media_type):
+    return settings.MEDIA_UPLOAD_MAX_SIZE.get(media_type)
+
+
+def check_size(media_type, size):
+    limit = size_limit(media_type)
+    if limit is not None and size > limit:
+        raise UploadTooLarge('%s 类型的文件不能超过 %d 字节' % (dict(MediaItem.MEDIA_TYPES)[media_type], limit))
+
+
+class Inspector:
+    """逐块接收数据，单遍完成哈希、识别和大小检查；不符合要求时抛出 UploadRejected"""
+
+    def __init__(self):
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        self.header = b''
+        self.mime_type = None
+        self.media_type = None
+
+    def identify(self):
+        self.mime_type = sniff(self.header)
+        self.media_type = media_type_for(self.mime_type)
+        if self.media_type is None:
+            raise UploadRejected()
+
+    def update(self, data):
+        if self.media_type is None and len(self.header) < HEADER_SIZE:
+            self.header += data[:HEADER_SIZE - len(self.header)]
+            if len(self.header) >= HEADER_SIZE:
+                self.identify()
+        self.sha256.update(data)
+        self.size += len(data)
+        if self.media_type is not None:
+            check_size(self.media_type, self.size)
+
+    def finish(self):
+        if self.media_type is None:
+            self.identify()
+            check_size(self.media_type, self.size)
+        return FileInspection(self.sha256.hexdigest(), self.size, self.mime_type, self.media_type)
+
+
+def inspect_file(f):
+    """检查已在磁盘上的文件（分块上传提交时）"""
+    inspector = Inspector()
+    f.seek(0)
+    while True:
+        data = f.read(CHUNK_SIZE)
+        if not data:
+            break
+        inspector.update(data)
+    f.seek(0)
+    return inspector.finish()
+
+
+def sniff_file(f):
+    """只读取文件头识别类型，不改变读取位置"""
+    try:
+        position = f.tell()
+        f.seek(0)
+        header = f.read(HEADER_SIZE)
+        f.seek(position)
+    except (OSError, ValueError):
+        return None
+    return sniff(header)
+
+
+class MediaUploadHandler(TemporaryFileUploadHandler):
+    """边接收边检查的上传处理器，检查通过的文件带有 inspection 属性
+
+    被拒绝时删除临时文件并抛出 UploadRejected，不再读取请求体的剩余部分，
+    DRF 将其转换为 413 / 415 响应。
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.inspector = Inspector()
+
+    def receive_data_chunk(self, raw_data, start):
+        try:
+            self.inspector.update(raw_data)
+        except UploadRejected:
+            self.file.close()
+            raise
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        try:
+            inspection = self.inspector.finish()
+        except UploadRejected:
+            self.file.close()
+            raise
+        upload = super().file_complete(file_size)
+        upload.inspection = inspection
+        return upload
+
+
+class MediaUploadMixin:
+    """视图集的文件上传改用 MediaUploadHandler"""
+
+    def initialize_request(self, request, *args, **kwargs):
+        request.upload_handlers = [MediaUploadHandler(request)]
+        return super().initialize_request(request, *args, **kwargs)
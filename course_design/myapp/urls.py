@@ -1,20 +1,37 @@
+from django.conf import settings
 from django.urls import path, include, re_path
 from rest_framework.routers import DefaultRouter
-from . import views
+from . import auth, views
 
 router = DefaultRouter()
 router.register(r'surveys', views.SurveyViewSet)
 router.register(r'media-items', views.MediaItemViewSet)
 router.register(r'users', views.UserProfileViewSet)
+router.register(r'uploads', views.UploadSessionViewSet)
+router.register(r'profiles', views.ProfileTraceViewSet, basename='profile')
 
 urlpatterns = [
     path('', include(router.urls)),
     path('auth/login/', views.login, name='login'),
     path('auth/logout/', views.logout, name='logout'),
+    path('auth/session/login/', auth.login, name='session-login'),
+    path('auth/session/logout/', auth.logout, name='session-logout'),
+    path('auth/user/', auth.user_info, name='user-info'),
+    path('search/', views.search, name='search'),
+    path('statistics/', views.statistics, name='statistics'),
+    path('export/surveys/', views.export_surveys, name='export-surveys'),
     re_path(r'^media/(?P<file_path>.*)$', views.serve_media_file, name='serve-media'),
 ]
 
+# ASGI 部署中优先匹配的异步视图，见 course_design.urls_asgi
+async_urlpatterns = [
+    path('surveys/', views.survey_list_async),
+    re_path(r'^surveys/(?P<pk>[^/.]+)/$', views.survey_detail_async),
+    re_path(r'^media/(?P<file_path>.*)$', views.serve_media_file_async),
+]
+
 # 添加调试输出
-print("Available URLs:")
-for url in router.urls:
-    print(f"- {url.pattern}") 
\ No newline at end of file
+if settings.DEBUG:
+    print("Available URLs:")
+    for url in router.urls:
+        print(f"- {url.pattern}")
@@ -1,33 +1,78 @@
 from django.shortcuts import get_object_or_404
-from rest_framework import viewsets, permissions, status
+from django.db.models import Count, OuterRef, Subquery, IntegerField
+from django.db.models.functions import Coalesce
+from django.db import transaction, IntegrityError
+from rest_framework import viewsets, mixins, permissions, status
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
+from rest_framework.exceptions import ValidationError
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
-from django.http import FileResponse, Http404
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, StreamingHttpResponse
 from django.conf import settings
 import os
+import stat
+import mimetypes
+import hashlib
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils import timezone
+from django.utils.http import http_date
+from django.core.exceptions import SuspiciousFileOperation
 from django.contrib.auth import authenticate
 from rest_framework.authtoken.models import Token
 from django.views.decorators.csrf import csrf_exempt
 from rest_framework.permissions import AllowAny
+from django_filters.rest_framework import DjangoFilterBackend
 
-from .models import Survey, MediaItem, UserProfile
-from .serializers import SurveySerializer, MediaItemSerializer, UserProfileSerializer
+from .models import Survey, MediaItem, UserProfile, UploadSession, UploadChunk
+from .serializers import (
+    SurveySerializer, SurveyListSerializer, MediaItemSerializer, UserProfileSerializer,
+    UploadSessionSerializer,
+)
+from .filters import SurveyFilter, MediaItemFilter
+from .pagination import SurveyCursorPagination
+from .fileserve import open_file, serve_file, serve_content, range_response
+from .caching import CachedResponseMixin
+from .authentication import issue_token
+from .bulk import SurveyBulkMixin, MediaItemBulkMixin
+from .storage import StagedUpload, blob_storage
+from .uploads import MediaUploadMixin
+from . import aio, clustering, export, geo, metrics, profiling, ratelimit, stats, uploads, search as search_index
+from .zipstream import ZipStream
 
-class SurveyViewSet(viewsets.ModelViewSet):
-    """调查记录的视图集"""
+class SurveyViewSet(MediaUploadMixin, CachedResponseMixin, SurveyBulkMixin, viewsets.ModelViewSet):
+    """调查记录的视图集，list/retrieve 带响应缓存"""
     queryset = Survey.objects.all()
     serializer_class = SurveySerializer
     parser_classes = (JSONParser, MultiPartParser, FormParser)
     permission_classes = [permissions.AllowAny]  # 允许所有人访问
+    pagination_class = SurveyCursorPagination
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = SurveyFilter
     
+    def is_summary_list(self):
+        """列表默认返回精简表示，?expand=media 时返回完整的嵌套媒体"""
+        return self.action == 'list' and self.request.query_params.get('expand') != 'media'
+
+    def get_serializer_class(self):
+        if self.is_summary_list():
+            return SurveyListSerializer
+        return SurveySerializer
+
     def get_queryset(self):
-        """获取查询集，支持过滤"""
-        queryset = Survey.objects.all()
-        category = self.request.query_params.get('category', None)
-        if category:
-            queryset = queryset.filter(category=category)
-        return queryset.order_by('-created_at')
+        """获取查询集，bbox / 半径过滤在此处理，其余过滤见 SurveyFilter"""
+        queryset = geo.filter_queryset(Survey.objects.all(), self.request.query_params)
+        queryset = queryset.select_related('investigator')
+        if self.is_summary_list():
+            # 用相关子查询计数，只对当前页的行求值，避免整表 GROUP BY
+            media_count = MediaItem.objects.filter(survey=OuterRef('pk')).order_by() \
+                .values('survey').annotate(c=Count('id')).values('c')
+            queryset = queryset.annotate(
+                media_count=Coalesce(Subquery(media_count, output_field=IntegerField()), 0)
+            )
+        else:
+            queryset = queryset.prefetch_related('media_items__derivatives')
+        return queryset.order_by('-created_at', '-id')
     
     def perform_create(self, serializer):
         """创建时自动设置调查人"""
@@ -36,6 +81,54 @@ class SurveyViewSet(viewsets.ModelViewSet):
         else:
             serializer.save()
     
+    @action(detail=False, methods=['get'])
+    def clusters(self, request):
+        """地图聚合：?zoom=缩放级别&bbox=min_lon,min_lat,max_lon,max_lat"""
+        zoom = request.query_params.get('zoom')
+        bbox = request.query_params.get('bbox')
+        if zoom is None or not zoom.isdigit() or not bbox:
+            return Response({'error': '请提供 zoom 和 bbox'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(clustering.get_clusters(int(zoom), geo.parse_bbox(bbox)))
+
+    @action(detail=True, methods=['get'], url_path='media-archive')
+    def media_archive(self, request, pk=None):
+        """打包下载该调查的全部媒体文件，可按 media_type / category 过滤，支持 Range 续传"""
+        survey = get_object_or_404(Survey, pk=pk)
+        media_items = survey.media_items.order_by('id')
+        for field, choices in (('media_type', MediaItem.MEDIA_TYPES), ('category', MediaItem.CATEGORY_TYPES)):
+            value = request.query_params.get(field)
+            if value:
+                if value not in dict(choices):
+                    return Response({'error': '%s 取值无效' % field}, status=status.HTTP_400_BAD_REQUEST)
+                media_items = media_items.filter(**{field: value})
+
+        files = []
+        for media_item in media_items.only('id', 'media_type', 'file_path'):
+            name = media_item.file_path.name
+            try:
+                full_path = safe_join(settings.MEDIA_ROOT, name)
+                stat_result = os.stat(full_path)
+            except (SuspiciousFileOperation, OSError):
+                continue
+            if not stat.S_ISREG(stat_result.st_mode):
+                continue
+            arcname = '%s/%d_%s' % (media_item.media_type.lower(), media_item.id, os.path.basename(name))
+            files.append((arcname, full_path, stat_result))
+
+        archive = ZipStream(files)
+        etag = archive.etag()
+        last_modified = archive.last_modified
+        response = get_conditional_response(request, etag=etag, last_modified=int(last_modified))
+        if response is None:
+            response = range_response(request, archive.size, etag, last_modified, archive.iter_range)
+            if response.status_code == 416:
+                return response
+            response['Content-Type'] = 'application/zip'
+            response['Content-Disposition'] = 'attachment; filename="survey-%d-media.zip"' % survey.id
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        return response
+
     @action(detail=True, methods=['post'])
     def upload_media(self, request, pk=None):
         """上传媒体文件到特定调查"""
@@ -59,49 +152,293 @@ class SurveyViewSet(viewsets.ModelViewSet):
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-    def create(self, request, *args, **kwargs):
-        print("接收到的数据:", request.data)  # 调试日志
-        return super().create(request, *args, **kwargs)
+# ASGI 下调查列表 / 详情使用的异步视图（见 course_design.urls_asgi）：
+# 整个 DRF 视图在 myapp.aio 的数据库池中执行，并发数不再受限于 Django 的单个同步线程
+survey_list_async = aio.async_view(SurveyViewSet.as_view(
+    {'get': 'list', 'post': 'create'}, basename='survey', detail=False))
+survey_detail_async = aio.async_view(SurveyViewSet.as_view(
+    {'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy'},
+    basename='survey', detail=True))
 
-class MediaItemViewSet(viewsets.ModelViewSet):
+class MediaItemViewSet(MediaUploadMixin, MediaItemBulkMixin, viewsets.ModelViewSet):
     """媒体资料的视图集"""
     queryset = MediaItem.objects.all()
     serializer_class = MediaItemSerializer
     parser_classes = (MultiPartParser, FormParser)
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = MediaItemFilter
     
     def get_queryset(self):
-        queryset = MediaItem.objects.all()
-        survey_id = self.request.query_params.get('survey', None)
-        if survey_id is not None:
-            queryset = queryset.filter(survey_id=survey_id)
-        return queryset
+        # survey 只序列化为主键，直接读取 survey_id，无需关联查询
+        return MediaItem.objects.prefetch_related('derivatives')
+
+class UploadSessionViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin,
+                           mixins.DestroyModelMixin, viewsets.GenericViewSet):
+    """分块断点续传
+
+    1. POST /uploads/ 创建会话，返回分块大小和分块数
+    2. PUT /uploads/{id}/chunks/{index}/ 以任意顺序上传分块，
+       请求体为原始字节，X-Chunk-Checksum 头为该块的 SHA-256
+    3. GET /uploads/{id}/ 查询已收到的分块，断线后只补传缺失的部分
+    4. POST /uploads/{id}/commit/ 校验完整后生成媒体资料
+
+    会话预先占用完整大小的暂存文件，只允许登录用户创建；超过 expires_at 未提交的会话不再接受分块。
+    """
+    queryset = UploadSession.objects.all()
+    serializer_class = UploadSessionSerializer
+    parser_classes = (JSONParser, FormParser)
+    permission_classes = [permissions.IsAuthenticated]
+
+    def perform_create(self, serializer):
+        session = serializer.save(expires_at=UploadSession.new_expiry())
+        # 预先占好完整大小（稀疏文件），分块按偏移直接写入
+        with open(session.staging_path, 'wb') as f:
+            f.truncate(session.total_size)
+
+    def perform_destroy(self, instance):
+        if instance.status == 'OPEN':
+            instance.remove_staging_file()
+        instance.delete()
+
+    @action(detail=True, methods=['put'], url_path=r'chunks/(?P<index>\d+)')
+    def chunk(self, request, pk=None, index=None):
+        """写入一个分块"""
+        session = self.get_object()
+        index = int(index)
+        if session.expired:
+            return Response({'error': '上传会话已过期'}, status=status.HTTP_410_GONE)
+        if session.status != 'OPEN':
+            return Response({'error': '上传会话已结束'}, status=status.HTTP_409_CONFLICT)
+        if index >= session.chunk_count:
+            return Response({'error': '分块序号超出范围'}, status=status.HTTP_400_BAD_REQUEST)
+        checksum = request.META.get('HTTP_X_CHUNK_CHECKSUM', '').lower()
+        if not checksum:
+            return Response({'error': '缺少 X-Chunk-Checksum'}, status=status.HTTP_400_BAD_REQUEST)
+
+        expected = session.chunk_length(index)
+        sha256 = hashlib.sha256()
+        written = 0
+        header = b''
+        stream = request.stream
+        with open(session.staging_path, 'r+b') as f:
+            f.seek(index * session.chunk_size)
+            while stream is not None and written <= expected:
+                data = stream.read(min(64 * 1024, expected + 1 - written))
+                if not data:
+                    break
+                if index == 0 and len(header) < uploads.HEADER_SIZE:
+                    header += data[:uploads.HEADER_SIZE - len(header)]
+                f.write(data[:expected - written])
+                sha256.update(data)
+                written += len(data)
+        if written != expected or sha256.hexdigest() != checksum:
+            # 该区域可能已被部分覆盖，作废之前的记录，要求客户端重传
+            UploadChunk.objects.filter(session=session, index=index).delete()
+            if written != expected:
+                return Response({'error': '分块长度应为 %d 字节' % expected}, status=status.HTTP_400_BAD_REQUEST)
+            return Response({'error': '分块校验失败'}, status=status.HTTP_400_BAD_REQUEST)
+        if index == 0:
+            # 第一块到达时即可按文件头识别类型，不必等全部上传完才发现不符
+            actual = uploads.media_type_for(uploads.sniff(header))
+            if actual != session.media_type:
+                UploadChunk.objects.filter(session=session, index=index).delete()
+                if actual is None:
+                    raise uploads.UploadRejected()
+                return Response({'error': '文件内容为%s，与声明的媒体类型不符' % dict(MediaItem.MEDIA_TYPES)[actual]},
+                                status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            with transaction.atomic():
+                UploadChunk.objects.create(session=session, index=index, sha256=checksum)
+        except IntegrityError:
+            # 重传的分块内容已覆盖写入，保留原记录即可
+            pass
+        UploadSession.objects.filter(pk=session.pk).update(expires_at=UploadSession.new_expiry())
+        return Response({'index': index, 'received': session.chunks.count()})
+
+    @action(detail=True, methods=['post'])
+    def commit(self, request, pk=None):
+        """所有分块到齐后生成 MediaItem"""
+        session = self.get_object()
+        if session.expired:
+            return Response({'error': '上传会话已过期'}, status=status.HTTP_410_GONE)
+        if session.status != 'OPEN':
+            return Response({'error': '上传会话已结束'}, status=status.HTTP_409_CONFLICT)
+        received = session.chunks.count()
+        if received != session.chunk_count:
+            return Response({
+                'error': '分块未上传完整',
+                'received_chunks': sorted(session.chunks.values_list('index', flat=True)),
+            }, status=status.HTTP_400_BAD_REQUEST)
+        # 条件更新防止同一会话被重复提交，也不会与 purge_upload_sessions 同时处理同一会话
+        if not UploadSession.objects.filter(pk=session.pk, status='OPEN', expires_at__gt=timezone.now()) \
+                .update(status='COMMITTED'):
+            return Response({'error': '上传会话已结束'}, status=status.HTTP_409_CONFLICT)
 
-def serve_media_file(request, file_path):
-    """服务媒体文件的视图函数"""
-    full_path = os.path.join(settings.MEDIA_ROOT, file_path)
-    
-    if os.path.exists(full_path) and os.path.isfile(full_path):
         try:
-            file = open(full_path, 'rb')
-            response = FileResponse(file)
-            
-            # 设置合适的Content-Type
-            if file_path.endswith('.pdf'):
-                response['Content-Type'] = 'application/pdf'
-            elif file_path.endswith('.png'):
-                response['Content-Type'] = 'image/png'
-            elif file_path.endswith('.jpg') or file_path.endswith('.jpeg'):
-                response['Content-Type'] = 'image/jpeg'
-            elif file_path.endswith('.mp3'):
-                response['Content-Type'] = 'audio/mpeg'
-            elif file_path.endswith('.mp4'):
-                response['Content-Type'] = 'video/mp4'
-                
-            return response
-        except Exception as e:
-            raise Http404(f"Error serving file: {e}")
-    else:
+            with StagedUpload(session.staging_path, session.filename) as upload:
+                # 一遍读完暂存文件：哈希供去重存储使用，并复核类型和大小
+                upload.inspection = uploads.inspect_file(upload)
+                if upload.inspection.media_type != session.media_type:
+                    raise ValidationError({'media_type': '文件内容与声明的媒体类型不符'})
+                media_item = MediaItem.objects.create(
+                    survey=session.survey,
+                    title=session.title,
+                    description=session.description,
+                    media_type=session.media_type,
+                    category=session.category,
+                    file_path=upload,
+                )
+        except Exception:
+            UploadSession.objects.filter(pk=session.pk).update(status='OPEN')
+            raise
+        # 内容已存在时暂存文件未被移走，这里清理掉
+        session.remove_staging_file()
+        UploadSession.objects.filter(pk=session.pk).update(media_item=media_item)
+
+        serializer = MediaItemSerializer(media_item, context=self.get_serializer_context())
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+def stat_media_file(file_path):
+    """返回 (完整路径, stat 结果)，文件不存在或越出 MEDIA_ROOT 时抛出 Http404"""
+    full_path = media_file_path(file_path)
+    try:
+        stat_result = os.stat(full_path)
+    except OSError:
+        raise Http404("File not found")
+    if not stat.S_ISREG(stat_result.st_mode):
+        raise Http404("File not found")
+    return full_path, stat_result
+
+def lookup_media_file(file_path):
+    """数据库中记录的媒体文件元数据 (mime_type, file_size, checksum, created_at)，没有记录时返回 None"""
+    return MediaItem.objects.filter(file_path=file_path, file_size__isnull=False).exclude(checksum='') \
+        .order_by('pk').values_list('mime_type', 'file_size', 'checksum', 'created_at').first()
+
+def media_file_path(file_path):
+    """媒体文件的完整路径；越出 MEDIA_ROOT 或位于上传暂存目录（未完成的分块上传）时抛出 Http404"""
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, file_path)
+    except SuspiciousFileOperation:
         raise Http404("File not found")
+    staging_root = os.path.normcase(blob_storage.staging_root()) + os.sep
+    if os.path.normcase(full_path).startswith(staging_root):
+        raise Http404("File not found")
+    return full_path
+
+def open_media_file(file_path):
+    """打开有元数据的媒体文件，文件缺失时抛出 Http404；由前端代理发送文件时无需打开，返回 None"""
+    if getattr(settings, 'MEDIA_ACCEL_MODE', None):
+        return None
+    return open_file(media_file_path(file_path))
+
+def media_file_response(request, file_path, metadata, stat_media=None, fileobj=None):
+    """有元数据时直接使用，ETag 即内容的 SHA-256；否则按 stat 结果和扩展名投递（衍生文件、未回填的旧文件）
+
+    有元数据时调用方先用 open_media_file 打开文件（代替 stat），文件缺失时在发出响应头之前返回 404。
+    """
+    if metadata is None:
+        full_path, stat_result = stat_media
+        return serve_file(request, full_path, file_path, stat_result,
+                          content_type=mimetypes.guess_type(file_path)[0] or 'application/octet-stream')
+    mime_type, size, checksum, created_at = metadata
+    return serve_content(request, media_file_path(file_path), file_path, size, '"%s"' % checksum,
+                         created_at.timestamp(), content_type=mime_type or 'application/octet-stream',
+                         fileobj=fileobj)
+
+def serve_media_file(request, file_path):
+    """服务媒体文件的视图函数
+
+    支持 Range 断点续传、ETag/Last-Modified 条件请求，
+    配置 MEDIA_ACCEL_MODE 后交由前端代理直接发送文件。
+    去重存储中的文件内容不会改变，大小和类型取自 MediaItem，只需打开文件，不再 stat。
+    """
+    metadata = lookup_media_file(file_path)
+    if metadata is None:
+        return media_file_response(request, file_path, None, stat_media_file(file_path))
+    return media_file_response(request, file_path, metadata, fileobj=open_media_file(file_path))
+
+async def serve_media_file_async(request, file_path):
+    """serve_media_file 的异步版本（ASGI），查询在数据库池、stat、打开和读取文件在文件池中执行"""
+    metadata = await aio.run_db(request, lookup_media_file, file_path)
+    if metadata is None:
+        return media_file_response(request, file_path, None, await aio.run_file_io(stat_media_file, file_path))
+    return media_file_response(request, file_path, metadata,
+                               fileobj=await aio.run_file_io(open_media_file, file_path))
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def search(request):
+    """全文检索调查名称、媒体标题与描述
+
+    参数：q 关键词（空格分隔，全部命中），type=survey|media，page，page_size
+    """
+    query = request.query_params.get('q', '').strip()
+    kind = request.query_params.get('type') or None
+    if not query:
+        return Response({'error': '请提供关键词 q'}, status=status.HTTP_400_BAD_REQUEST)
+    if kind not in (None, search_index.KIND_SURVEY, search_index.KIND_MEDIA):
+        return Response({'error': 'type 只能是 survey 或 media'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        page = max(int(request.query_params.get('page', 1)), 1)
+        page_size = min(max(int(request.query_params.get('page_size', 20)), 1), 100)
+    except ValueError:
+        return Response({'error': 'page 和 page_size 必须是整数'}, status=status.HTTP_400_BAD_REQUEST)
+
+    total, hits = search_index.search(query, kind, offset=(page - 1) * page_size, limit=page_size)
+    survey_ids = [pk for k, pk, _ in hits if k == search_index.KIND_SURVEY]
+    media_ids = [pk for k, pk, _ in hits if k == search_index.KIND_MEDIA]
+    objects = {}
+    for row in Survey.objects.filter(pk__in=survey_ids).values(
+            'id', 'name', 'longitude', 'latitude', 'start_date', 'end_date', 'created_at'):
+        objects[(search_index.KIND_SURVEY, row['id'])] = row
+    for row in MediaItem.objects.filter(pk__in=media_ids).values(
+            'id', 'survey_id', 'title', 'description', 'media_type', 'category', 'created_at'):
+        objects[(search_index.KIND_MEDIA, row['id'])] = row
+
+    results = []
+    for kind_, pk, score in hits:
+        row = objects.get((kind_, pk))
+        if row is not None:
+            results.append({'type': kind_, 'score': round(score, 6), **row})
+    return Response({'count': total, 'page': page, 'page_size': page_size, 'results': results})
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def statistics(request):
+    """统计概览：读取汇总表，?top= 控制按存储量排名的调查条数（默认 20，最多 100）"""
+    top = request.query_params.get('top', '20')
+    top = min(int(top), 100) if top.isdigit() else 20
+    return Response(stats.summary(top))
+
+def prometheus_metrics(request):
+    """所有工作进程合并后的请求指标（Prometheus 文本格式），访问条件见 myapp.metrics.scrape_allowed"""
+    if not metrics.scrape_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+def export_surveys(request):
+    """流式导出调查资料库
+
+    ?format=ndjson|csv|geojson，支持与调查列表相同的过滤参数（bbox / lat,lon,radius 及 SurveyFilter）；
+    media=0 时不包含媒体列表。
+    """
+    fmt = request.GET.get('format', 'ndjson')
+    if fmt not in export.FORMATS:
+        return HttpResponseBadRequest('format 只能是 %s' % '/'.join(export.FORMATS))
+    try:
+        queryset = geo.filter_queryset(Survey.objects.all(), request.GET)
+    except ValidationError as e:
+        return HttpResponseBadRequest(str(e.detail))
+    filterset = SurveyFilter(request.GET, queryset=queryset)
+    if not filterset.is_valid():
+        return HttpResponseBadRequest(str(dict(filterset.errors)))
+    queryset = filterset.qs
+    surveys = export.iter_surveys(queryset, include_media=request.GET.get('media') != '0',
+                                  url_builder=request.build_absolute_uri)
+    response = StreamingHttpResponse(export.render(fmt, surveys), content_type=export.CONTENT_TYPES[fmt])
+    response['Content-Disposition'] = 'attachment; filename="surveys.%s"' % fmt
+    return response
 
 class UserProfileViewSet(viewsets.ModelViewSet):
     """用户配置的视图集"""
@@ -115,6 +452,42 @@ class UserProfileViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(request.user)
         return Response(serializer.data)
 
+class ProfileTraceViewSet(viewsets.ViewSet):
+    """请求采样分析记录（见 myapp.profiling），仅管理员可访问
+
+    GET /profiles/ 最近的记录（不含调用栈），GET /profiles/{id}/ 单条记录及耗时最多的函数，
+    GET /profiles/{id}/collapsed/ 下载折叠栈，可交给 flamegraph.pl 或 speedscope 生成火焰图
+    """
+    permission_classes = [permissions.IsAdminUser]
+    lookup_value_regex = r'\d{19}-[0-9a-f]{8}'
+
+    def get_trace(self, pk):
+        trace = profiling.load_trace(pk)
+        if trace is None:
+            raise Http404('分析记录不存在')
+        return trace
+
+    def list(self, request):
+        traces = []
+        for trace_id in profiling.list_trace_ids():
+            trace = profiling.load_trace(trace_id)
+            if trace is not None:
+                del trace['stacks']
+                traces.append(trace)
+        return Response(traces)
+
+    def retrieve(self, request, pk=None):
+        trace = self.get_trace(pk)
+        trace['top_frames'] = profiling.top_frames(trace)
+        del trace['stacks']
+        return Response(trace)
+
+    @action(detail=True, methods=['get'])
+    def collapsed(self, request, pk=None):
+        response = HttpResponse(profiling.collapsed(self.get_trace(pk)), content_type='text/plain; charset=utf-8')
+        response['Content-Disposition'] = 'attachment; filename="profile-%s.collapsed"' % pk
+        return response
+
 @api_view(['POST'])
 @permission_classes([AllowAny])
 @csrf_exempt
@@ -122,15 +495,21 @@ def login(request):
     username = request.data.get('username')
     password = request.data.get('password')
     
-    if not username or not password:
+    if not username or not password or not isinstance(username, str) or not isinstance(password, str):
         return Response({'error': '请提供用户名和密码'}, status=400)
-    
+
+    # 在计算密码哈希之前限流
+    wait = ratelimit.check_login(request, username)
+    if wait is not None:
+        return ratelimit.throttled_response(wait)
+
     user = authenticate(username=username, password=password)
     
     if not user:
         return Response({'error': '用户名或密码错误'}, status=401)
-    
-    token, _ = Token.objects.get_or_create(user=user)
+
+    ratelimit.reset_login(request, username)
+    token = issue_token(user)
     
     return Response({
         'token': token.key,
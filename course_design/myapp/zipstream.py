@@ -0,0 +1,232 @@
+"""边读边写的 ZIP 归档
+
+条目一律采用 stored（不压缩）方式：媒体文件大多已经压缩过，再压缩只会浪费 CPU。
+本地文件头使用数据描述符（标志位 3），CRC 放在文件数据之后，因此不必预先读取文件；
+归档中每一段的长度只取决于文件名和文件大小，总长度可以预先算出，
+从而支持 Content-Length 和 Range 断点续传。续传时跳过的文件的 CRC 从缓存读取，
+缓存未命中才重新读文件计算。超过 4 GiB 的文件和偏移使用 ZIP64 扩展。
+"""
+import hashlib
+import struct
+import time
+import zlib
+
+from django.core.cache import cache
+
+from .fileserve import CHUNK_SIZE
+
+# 达到这些值时改用 ZIP64 扩展，原字段填写下面的占位值
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP_FILECOUNT_LIMIT = 0xFFFF
+ZIP64_MARKER = 0xFFFFFFFF
+ZIP64_COUNT_MARKER = 0xFFFF
+
+LOCAL_HEADER = struct.Struct('<4sHHHHHLLLHH')
+CENTRAL_HEADER = struct.Struct('<4sHHHHHHLLLHHHHHLL')
+END_RECORD = struct.Struct('<4sHHHHLLH')
+END_RECORD64 = struct.Struct('<4sQHHLLQQQQ')
+END_LOCATOR64 = struct.Struct('<4sLQL')
+
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+VERSION_DEFAULT = 20
+VERSION_ZIP64 = 45
+EXTERNAL_ATTR = 0o100644 << 16
+
+CRC_CACHE_TIMEOUT = 7 * 24 * 3600
+
+
+def dos_datetime(timestamp):
+    t = time.localtime(timestamp)
+    year = min(max(t.tm_year, 1980), 2107)
+    return ((year - 1980) << 9 | t.tm_mon << 5 | t.tm_mday,
+            t.tm_hour << 11 | t.tm_min << 5 | t.tm_sec // 2)
+
+
+def crc_cache_key(path, size, mtime):
+    return 'zipcrc:%s' % hashlib.sha1(('%s:%d:%d' % (path, size, int(mtime))).encode('utf-8')).hexdigest()
+
+
+class ZipEntry:
+    def __init__(self, arcname, path, size, mtime):
+        self.name = arcname.encode('utf-8')
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.date, self.time = dos_datetime(mtime)
+        self.zip64 = size >= ZIP64_LIMIT
+        self.offset = 0
+        self._crc = None
+
+    @property
+    def version(self):
+        return VERSION_ZIP64 if self.zip64 or self.offset >= ZIP64_LIMIT else VERSION_DEFAULT
+
+    @property
+    def crc(self):
+        if self._crc is None:
+            key = crc_cache_key(self.path, self.size, self.mtime)
+            self._crc = cache.get(key)
+            if self._crc is None:
+                crc = 0
+                for data in read_exactly(self.path, 0, self.size):
+                    crc = zlib.crc32(data, crc)
+                self.crc = crc
+        return self._crc
+
+    @crc.setter
+    def crc(self, value):
+        self._crc = value
+        cache.set(crc_cache_key(self.path, self.size, self.mtime), value, CRC_CACHE_TIMEOUT)
+
+    def local_header(self):
+        extra = b''
+        size = 0
+        if self.zip64:
+            # 大小写在数据描述符中，这里按 ZIP64 约定填占位值
+            extra = struct.pack('<HHQQ', 1, 16, 0, 0)
+            size = ZIP64_MARKER
+        return LOCAL_HEADER.pack(
+            b'PK\x03\x04', self.version, FLAG_DATA_DESCRIPTOR | FLAG_UTF8, 0,
+            self.time, self.date, 0, size, size, len(self.name), len(extra),
+        ) + self.name + extra
+
+    def descriptor_length(self):
+        return 24 if self.zip64 else 16
+
+    def descriptor(self):
+        fmt = '<4sLQQ' if self.zip64 else '<4sLLL'
+        return struct.pack(fmt, b'PK\x07\x08', self.crc, self.size, self.size)
+
+    def central_header(self):
+        extra_values = []
+        size = self.size
+        offset = self.offset
+        if size >= ZIP64_LIMIT:
+            extra_values += [size, size]
+            size = ZIP64_MARKER
+        if offset >= ZIP64_LIMIT:
+            extra_values.append(offset)
+            offset = ZIP64_MARKER
+        extra = b''
+        if extra_values:
+            extra = struct.pack('<HH%dQ' % len(extra_values), 1, 8 * len(extra_values), *extra_values)
+        return CENTRAL_HEADER.pack(
+            b'PK\x01\x02', VERSION_ZIP64, self.version, FLAG_DATA_DESCRIPTOR | FLAG_UTF8, 0,
+            self.time, self.date, self.crc, size, size, len(self.name), len(extra), 0, 0, 0,
+            EXTERNAL_ATTR, offset,
+        ) + self.name + extra
+
+    def central_header_length(self):
+        extra = 0
+        if self.size >= ZIP64_LIMIT:
+            extra += 16
+        if self.offset >= ZIP64_LIMIT:
+            extra += 8
+        return CENTRAL_HEADER.size + len(self.name) + (4 + extra if extra else 0)
+
+
+def read_exactly(path, start, length):
+    """读取文件区间；文件在打包过程中被截断时无法再保证归档完整，直接报错中断"""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            data = f.read(min(CHUNK_SIZE, remaining))
+            if not data:
+                raise IOError('%s 在打包过程中发生了变化' % path)
+            remaining -= len(data)
+            yield data
+
+
+class ZipStream:
+    """由 (归档内名称, 文件路径, os.stat 结果) 列表构成的流式 ZIP"""
+
+    def __init__(self, files):
+        self.entries = [ZipEntry(name, path, st.st_size, st.st_mtime) for name, path, st in files]
+        # 每段为 (长度, 种类, 条目)，种类：header / data / descriptor / central / end
+        self.segments = []
+        offset = 0
+        for entry in self.entries:
+            entry.offset = offset
+            header_length = len(entry.local_header())
+            self.segments += [
+                (header_length, 'header', entry),
+                (entry.size, 'data', entry),
+                (entry.descriptor_length(), 'descriptor', entry),
+            ]
+            offset += header_length + entry.size + entry.descriptor_length()
+        self.central_offset = offset
+        self.central_size = sum(entry.central_header_length() for entry in self.entries)
+        self.zip64_end = (len(self.entries) >= ZIP_FILECOUNT_LIMIT or self.central_offset >= ZIP64_LIMIT
+                          or self.central_size >= ZIP64_LIMIT)
+        end_length = END_RECORD.size
+        if self.zip64_end:
+            end_length += END_RECORD64.size + END_LOCATOR64.size
+        self.segments += [(self.central_size, 'central', None), (end_length, 'end', None)]
+        self.size = offset + self.central_size + end_length
+
+    @property
+    def last_modified(self):
+        return max([entry.mtime for entry in self.entries], default=0)
+
+    def etag(self):
+        """由条目名称、大小和修改时间决定，文件不变则归档内容不变"""
+        sha1 = hashlib.sha1()
+        for entry in self.entries:
+            sha1.update(b'%s\0%d\0%d\0' % (entry.name, entry.size, int(entry.mtime)))
+        return '"zip-%s"' % sha1.hexdigest()
+
+    def end_record(self):
+        count = len(self.entries)
+        if not self.zip64_end:
+            return END_RECORD.pack(b'PK\x05\x06', 0, 0, count, count, self.central_size, self.central_offset, 0)
+        return END_RECORD64.pack(
+            b'PK\x06\x06', END_RECORD64.size - 12, VERSION_ZIP64, VERSION_ZIP64, 0, 0,
+            count, count, self.central_size, self.central_offset,
+        ) + END_LOCATOR64.pack(
+            b'PK\x06\x07', 0, self.central_offset + self.central_size, 1,
+        ) + END_RECORD.pack(
+            b'PK\x05\x06', 0, 0, ZIP64_COUNT_MARKER, ZIP64_COUNT_MARKER, ZIP64_MARKER, ZIP64_MARKER, 0)
+
+    def segment_bytes(self, kind, entry):
+        if kind == 'header':
+            return entry.local_header()
+        if kind == 'descriptor':
+            return entry.descriptor()
+        if kind == 'central':
+            return b''.join(e.central_header() for e in self.entries)
+        return self.end_record()
+
+    def iter_data(self, entry, start, length):
+        if start == 0 and length == entry.size and entry._crc is None:
+            # 完整读取文件时顺便计算 CRC，供数据描述符和中央目录使用
+            crc = 0
+            for data in read_exactly(entry.path, 0, entry.size):
+                crc = zlib.crc32(data, crc)
+                yield data
+            entry.crc = crc
+        else:
+            yield from read_exactly(entry.path, start, length)
+
+    def iter_range(self, start=0, length=None):
+        """产出归档中 [start, start + length) 区间的字节"""
+        if length is None:
+            length = self.size - start
+        end = start + length
+        position = 0
+        for segment_length, kind, entry in self.segments:
+            segment_end = position + segment_length
+            if segment_end > start and position < end:
+                lo = max(start, position) - position
+                hi = min(end, segment_end) - position
+                if kind == 'data':
+                    yield from self.iter_data(entry, lo, hi - lo)
+                else:
+                    yield self.segment_bytes(kind, entry)[lo:hi]
+            position = segment_end
+            if position >= end:
+                break
+
+    def __iter__(self):
+        return self.iter_range()